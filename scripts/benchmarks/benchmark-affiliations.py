@@ -0,0 +1,59 @@
+"""Times affiliation classification of all first-three-author affiliations in a database.
+
+Compares the original get_aff_type (re.search per type x string x
+affiliation) with AffiliationClassifier's compiled regexes alone, and with
+its memo cold and filled.
+
+Usage: python benchmark-affiliations.py [dbfile]
+
+Without a dbfile argument a synthetic 7,000-paper database is created in /tmp.
+"""
+import json
+import os
+import sys
+import time
+
+import yaml
+
+import synthetic
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'tests'))
+from test_affiliations import legacy_get_aff_type
+
+kpub = synthetic.kpub
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        db = kpub.PublicationDB(sys.argv[1], synthetic.make_config())
+    else:
+        db = synthetic.make_db('/tmp/kpub-benchmark.db')
+    config = yaml.load(open(os.path.join(kpub.PACKAGEDIR, 'config', 'config.keck.yaml')),
+                       Loader=yaml.FullLoader)
+    aff_defs = config['aff_defs']
+    affs = [aff for (metrics,) in db.con.execute("SELECT metrics FROM pubs")
+            for aff in json.loads(metrics)['aff'][:3]]
+    print(f"{len(affs)} affiliations, {len(set(affs))} distinct")
+
+    start = time.perf_counter()
+    expected = [legacy_get_aff_type(aff, aff_defs) for aff in affs]
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classifier = kpub.AffiliationClassifier(aff_defs)
+    [classifier.match(aff) for aff in affs]
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classifier = kpub.AffiliationClassifier(aff_defs)
+    result = classifier.classify_many(affs)
+    cold = time.perf_counter() - start
+    assert result == expected
+
+    start = time.perf_counter()
+    classifier.classify_many(affs)
+    warm = time.perf_counter() - start
+
+    print(f"get_aff_type:                 {legacy:8.3f} s")
+    print(f"compiled regexes, no memo:    {compiled:8.3f} s ({legacy / compiled:.0f}x)")
+    print(f"AffiliationClassifier (cold): {cold:8.3f} s ({legacy / cold:.0f}x)")
+    print(f"AffiliationClassifier (warm): {warm:8.3f} s ({legacy / warm:.0f}x)")
@@ -0,0 +1,36 @@
+"""Compares ingest throughput of PublicationDB.add (one commit per row) and add_many.
+
+Usage: python benchmark-ingest.py [n_articles]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import synthetic
+
+
+def ingest(articles, bulk, journal_mode=None):
+    config = synthetic.make_config()
+    if journal_mode:
+        config['db'] = {'journal_mode': journal_mode}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = synthetic.kpub.PublicationDB(os.path.join(tmpdir, 'kpub.db'), config)
+        start = time.perf_counter()
+        if bulk:
+            db.add_many(dict(art, mission='keck') for art in articles)
+        else:
+            for art in articles:
+                db.add(dict(art), mission='keck')
+        elapsed = time.perf_counter() - start
+        db.con.close()
+    return len(articles) / elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    articles = synthetic.make_articles(n)
+    print(f"{n} articles")
+    print(f"add, rollback journal:      {ingest(articles, False):8.0f} rows/s")
+    print(f"add_many, rollback journal: {ingest(articles, True):8.0f} rows/s")
+    print(f"add_many, WAL journal:      {ingest(articles, True, 'WAL'):8.0f} rows/s")
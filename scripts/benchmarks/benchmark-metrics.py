@@ -0,0 +1,35 @@
+"""Times PublicationDB.get_metrics against the original row-by-row implementation.
+
+Usage: python benchmark-metrics.py [dbfile]
+
+Without a dbfile argument a synthetic 7,000-paper database is created in /tmp.
+"""
+import os
+import sys
+import time
+
+import synthetic
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'tests'))
+from test_metrics import legacy_get_metrics
+
+
+def timeit(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        db = synthetic.kpub.PublicationDB(sys.argv[1], synthetic.make_config())
+    else:
+        db = synthetic.make_db('/tmp/kpub-benchmark.db')
+    t_old, old = timeit(lambda: legacy_get_metrics(db))
+    t_new, new = timeit(lambda: db.get_metrics())
+    assert old == new, "get_metrics output differs from the original implementation"
+    print(f"{old['publication_count']} publications")
+    print(f"original json loop: {t_old*1000:8.1f} ms")
+    print(f"SQL aggregation:    {t_new*1000:8.1f} ms  ({t_old/t_new:.1f}x faster)")
@@ -0,0 +1,69 @@
+"""Compares the per-word regex scan of extracted PDF text with kpub.WordScanner.
+
+Usage: python benchmark-scanner.py [text_dir]
+
+text_dir holds extracted paper texts (*.txt, e.g. from pdftotext).  Without
+it, a corpus of synthetic papers of ~60,000 characters each is used.
+"""
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+import yaml
+
+import synthetic
+
+kpub = synthetic.kpub
+
+
+def legacy_counts(text, words):
+    counts = {}
+    for word in words:
+        counts[word] = {'count': 0, 'snippets': []}
+        for ch in (' ', '/', '\\(', '-', ':'):
+            for m in re.finditer(f"{ch}{word}".lower(), text):
+                counts[word]['count'] += 1
+                counts[word]['snippets'].append(text[m.start()-80:m.end()+80])
+    return {key: val for key, val in counts.items() if val['count'] != 0}
+
+
+def make_corpus(n=50, seed=42):
+    rng = random.Random(seed)
+    vocab = ['the', 'of', 'and', 'we', 'observed', 'spectra', 'with', 'at', 'planet',
+             'star', 'mass', 'data', 'reduced', 'using', 'pipeline', 'figure', 'table']
+    terms = ['Keck', 'HIRES', '(NIRC2)', 'OSIRIS/', 'KOA', 'K2-18', 'MOSFIRE', 'Keck Observatory Archive']
+    texts = []
+    for i in range(n):
+        words = [rng.choice(terms) if rng.random() < 0.005 else rng.choice(vocab)
+                 for j in range(12000)]
+        texts.append(' '.join(words))
+    return texts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        texts = [open(f, errors='ignore').read() for f in glob.glob(os.path.join(sys.argv[1], '*.txt'))]
+    else:
+        texts = make_corpus()
+    texts = [kpub.clean_pdf_text(text) for text in texts]
+    config = yaml.load(open(os.path.join(kpub.PACKAGEDIR, 'config', 'config.keck.yaml')),
+                       Loader=yaml.FullLoader)
+    words = config['missions'] + config['instruments'] + config['archive']
+    print(f"{len(texts)} texts, {sum(map(len, texts)) / len(texts):.0f} chars each, {len(words)} words")
+
+    start = time.perf_counter()
+    for text in texts:
+        legacy_counts(text, words)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scanner = kpub.WordScanner(words)
+    for text in texts:
+        scanner.count(text)
+    scan = time.perf_counter() - start
+
+    print(f"per-word regex: {1000 * legacy / len(texts):8.2f} ms/paper")
+    print(f"WordScanner:    {1000 * scan / len(texts):8.2f} ms/paper ({legacy / scan:.1f}x)")
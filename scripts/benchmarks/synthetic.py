@@ -0,0 +1,68 @@
+"""Builds a synthetic publication database shaped like the Keck one (~7,000 papers)."""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+import kpub
+kpub.log.setLevel('WARNING')
+
+
+def make_articles(n=7000, seed=42):
+    """Returns `n` dicts mimicking documents returned by the ADS search API."""
+    rng = random.Random(seed)
+    surnames = [f"Surname{i}" for i in range(12000)]
+    affs = ["W. M. Keck Observatory, 65-1120 Mamalahoa Hwy, Kamuela, HI 96743, USA",
+            "Department of Astronomy, California Institute of Technology, Pasadena, CA 91125, USA",
+            "Institute for Astronomy, University of Hawaii, Honolulu, HI 96822, USA",
+            "Max-Planck-Institut fur Astronomie, Heidelberg, Germany",
+            "National Astronomical Observatory of Japan, Mitaka, Tokyo, Japan",
+            "NASA Goddard Space Flight Center, Greenbelt, MD 20771, USA",
+            "-"]
+    articles = []
+    for idx in range(n):
+        year = rng.randint(1994, 2024)
+        month = rng.randint(1, 12)
+        nauth = min(int(rng.expovariate(1 / 8)) + 1, 300)
+        authors = [f"{rng.choice(surnames)}, {chr(65 + rng.randint(0, 25))}." for _ in range(nauth)]
+        norms = [a[:-1] for a in authors]
+        articles.append({
+            'id': str(idx),
+            'bibcode': f"{year}ApJ...{idx:05d}{'PhDT' if idx % 200 == 0 else 'X'}",
+            'year': str(year),
+            'pubdate': f"{year}-{month:02d}-00",
+            'title': [f"Synthetic paper {idx} observed with Keck"],
+            'abstract': "We present observations obtained with HIRES at the W. M. Keck Observatory. " * 5,
+            'author': authors,
+            'author_norm': norms,
+            'first_author_norm': norms[0],
+            'aff': [rng.choice(affs) for _ in authors],
+            'citation_count': rng.randint(0, 100),
+            'read_count': rng.randint(0, 2000),
+            'property': ['REFEREED', 'ARTICLE'] if rng.random() > 0.2 else ['NOT REFEREED'],
+            'pub': 'The Astrophysical Journal',
+            'doctype': 'article',
+            'keyword': ['stars: planetary systems', 'techniques: spectroscopic'],
+            'reference': [f"2000ApJ...{i:05d}X" for i in range(rng.randint(20, 80))],
+            'citation': [f"2020ApJ...{i:05d}X" for i in range(rng.randint(0, 100))],
+            'indexstamp': f"{year}-{month:02d}-15T00:00:00.000Z",
+        })
+    return articles
+
+
+def make_config():
+    return {'missions': ['keck'], 'sciences': [], 'aff_defs': [],
+            'plots': {'year_begin': 1994, 'instruments': []}}
+
+
+def make_db(filename, n=7000):
+    """Creates (or reuses) a synthetic database with `n` articles at `filename`."""
+    exists = os.path.exists(filename)
+    db = kpub.PublicationDB(filename, make_config())
+    if not exists:
+        rng = random.Random(1)
+        for art in make_articles(n):
+            db.add(art, mission='keck' if rng.random() > 0.1 else 'unrelated',
+                   instruments=rng.choice(['HIRES', 'NIRC2|OSIRIS', 'LRIS', '']),
+                   archive=rng.choice(['0', '1']))
+    return db
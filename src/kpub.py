@@ -9,9 +9,22 @@ import os
 import re
 import sys
 import json
+import math
+import time
 import datetime
+import fnmatch
+import gzip
+import hashlib
+import tempfile
+import threading
+import queue
 import argparse
 import collections
+import io
+import heapq
+import itertools
+import concurrent.futures
+import urllib.parse
 import sqlite3 as sql
 import numpy as np
 import yaml
@@ -43,11 +56,61 @@ log.setLevel(logging.INFO)
 
 #ADS API URL
 ADS_API = 'https://api.adsabs.harvard.edu/v1/search/query?'
+ADS_BIGQUERY = 'https://api.adsabs.harvard.edu/v1/search/bigquery?'
 
 # Where is the default location of the SQLite database?
 #DEFAULT_DB = os.path.expanduser("~/.kpub.db")
 DEFAULT_DB = "data/kpub.db"
 
+# HTTP settings for the ADS client: seconds to wait for a response (PDF
+# downloads are slow), number of retries on errors and the base delay of
+# the exponential backoff between them.
+ADS_TIMEOUT = 60
+ADS_PDF_TIMEOUT = 120
+ADS_RETRIES = 5
+ADS_BACKOFF = 1.0
+# PDF downloads are retried less, the ADS query fallback is used instead.
+ADS_PDF_RETRIES = 1
+# Longest wait in seconds for the ADS rate limit to reset.  An exhausted
+# daily quota raises ADSQuotaError rather than appearing to hang.
+ADS_MAX_WAIT = 300
+
+# Default directory for locally cached data (config: cache_dir), the
+# number of per-article full-text analyses kept in memory and the size limit
+# of the cached PDFs and extracted texts (config: cache_max_mb).  Once
+# over the limit, the cache is pruned down to DOCUMENT_CACHE_LOW_WATER of it.
+CACHEDIR = '/tmp/kpub-cache'
+ANALYSIS_CACHE_SIZE = 64
+DOCUMENT_CACHE_MB = 2000
+DOCUMENT_CACHE_LOW_WATER = 0.8
+
+# Number of articles requested per page of ADS search results.
+ADS_PAGE_SIZE = 200
+
+# Number of upcoming articles whose PDFs are fetched and scanned in the
+# background during `kpub update` (config: prefetch_depth, 0 disables it).
+PREFETCH_DEPTH = 3
+PREFETCH_MAX_WORKERS = 4
+
+# Default probabilities above which `kpub update --auto` accepts an article for
+# a mission or rejects it as unrelated without asking (config: auto), and the
+# number of classified articles needed to train the model.
+AUTO_ACCEPT = 0.99
+AUTO_REJECT = 0.99
+AUTO_MIN_EXAMPLES = 50
+
+# Number of bibcodes resolved per ADS query when importing a csv file.
+IMPORT_CHUNK_SIZE = 100
+
+# Number of bibcodes per ADS bigquery request (at most 2000) and of requests
+# run at once by `kpub refresh-metrics`.
+REFRESH_CHUNK_SIZE = 2000
+REFRESH_WORKERS = 4
+
+# Default number of rows written per executemany() call and transaction by
+# PublicationDB.add_many. Can be overridden with the config's db.batch_size.
+BATCH_SIZE = 500
+
 # Which metadata fields do we want to retrieve from the ADS API?
 # (basically everything apart from 'body' to reduce data volume)
 FIELDS = ['date', 'pub', 'id', 'volume', 'links_data', 'citation', 'doi',
@@ -60,6 +123,19 @@ FIELDS = ['date', 'pub', 'id', 'volume', 'links_data', 'citation', 'doi',
           'first_author', 'reader', 'read_count', 'indexstamp', 'issue', 'keyword_facet',
           'aff', 'facility', 'simbid']
 
+# Version of the database schema, stored in SQLite's user_version pragma.
+# Bump this and add a step to PublicationDB.migrate() when the schema changes.
+SCHEMA_VERSION = 6
+
+# Frequently used ADS fields which are copied out of the metrics json blob
+# into typed columns of the pubs table so they can be queried directly.
+HOT_COLUMNS = [('citation_count', 'INTEGER'),
+               ('read_count', 'INTEGER'),
+               ('refereed', 'INTEGER'),
+               ('first_author_norm', 'TEXT'),
+               ('pub', 'TEXT'),
+               ('doctype', 'TEXT')]
+
 #Defines colors for highlighting words in the terminal.
 HIGHLIGHTS = {
     "RED"    : "\033[4;31m",
@@ -72,6 +148,986 @@ HIGHLIGHTS = {
 }
 
 
+class RateLimiter(object):
+    """Token bucket limiting the request rate to the ADS API.
+
+    The bucket starts out unlimited.  After each response it is resized from
+    the ADS rate-limit headers (X-RateLimit-Remaining and X-RateLimit-Reset,
+    an epoch time): requests may burst up to the remaining quota, and once
+    that is used up they are paced so the refill lasts until the reset.
+    Thread-safe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = None        # tokens per second, None means unlimited
+        self.capacity = None
+        self.tokens = None
+        self.reset = None       # epoch time the quota is reset
+        self.updated = time.monotonic()
+
+    def acquire(self, max_wait=None):
+        """Blocks until a request may be sent.
+
+        Returns False without waiting if that would take longer than `max_wait` seconds.
+        """
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return True
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return False
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Refills the bucket from the rate-limit headers of an ADS response."""
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            window = max(reset - time.time(), 1.0)
+            self.rate = max(remaining, 0) / window or 1.0 / window
+            self.capacity = max(remaining, 1)
+            self.tokens = min(self.tokens if self.tokens is not None else remaining, remaining)
+            self.reset = reset
+            self.updated = time.monotonic()
+
+
+class ADSQuotaError(requests.HTTPError):
+    """Raised when the ADS API quota is used up for longer than ADS_MAX_WAIT."""
+
+
+class ADSClient(object):
+    """HTTP client for the ADS API, shared by all requests of a `PublicationDB`.
+
+    Keeps a pool of keep-alive connections, applies a timeout to every
+    request, retries connection errors, 429 and 5xx responses with
+    exponential backoff and throttles requests with a `RateLimiter`.
+
+    Parameters
+    ----------
+    api_key : str
+        ADS API token.
+    """
+    def __init__(self, api_key, timeout=ADS_TIMEOUT, retries=ADS_RETRIES,
+                 backoff=ADS_BACKOFF, pool_size=10):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def get(self, url, timeout=None, **kwargs):
+        """Sends a GET request and returns the `requests.Response`.
+
+        Raises the last error once all retries are used up.
+        """
+        return self.request('GET', url, timeout=timeout, **kwargs)
+
+    def post(self, url, timeout=None, **kwargs):
+        """Sends a POST request and returns the `requests.Response`, retrying like `get`."""
+        return self.request('POST', url, timeout=timeout, **kwargs)
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        """Sends a rate-limited request, retrying connection errors, 429 and 5xx responses.
+
+        `retries` overrides the client's number of retries.  Raises
+        `ADSQuotaError` if the quota is exhausted for longer than ADS_MAX_WAIT,
+        and `requests.HTTPError` once the retries of a 429 or 5xx response are
+        used up.  Other responses, including 4xx errors such as 401 or 404, are
+        returned as they are: callers call `raise_for_status` before reading
+        the body, or check `status_code` where an error is expected (e.g. a
+        missing PDF).
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            if not self.limiter.acquire(max_wait=ADS_MAX_WAIT):
+                raise ADSQuotaError(f"ADS API quota exhausted until {time.ctime(self.limiter.reset)}")
+            delay = self.backoff * 2 ** attempt
+            try:
+                r = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                self.limiter.update(r.headers)
+                if r.status_code != 429 and r.status_code < 500:
+                    return r
+                error = requests.HTTPError(f"{r.status_code} {r.reason}", response=r)
+                if r.status_code == 429 and 'X-RateLimit-Reset' in r.headers:
+                    # Out of quota: wait for the reset rather than hammering the API
+                    reset = float(r.headers['X-RateLimit-Reset'])
+                    if reset - time.time() > ADS_MAX_WAIT:
+                        raise ADSQuotaError(f"ADS API quota exhausted until {time.ctime(reset)}",
+                                            response=r)
+                    delay = max(delay, reset - time.time())
+            if attempt < retries:
+                log.warning(f"ADS request failed ({error}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        raise error
+
+
+class WordScanner(object):
+    """Finds all occurrences of a list of words in a text in a single pass.
+
+    A word matches where it follows one of the `BOUNDARY` characters, as
+    in " HIRES", "/HIRES", "(HIRES", "-HIRES" or ":HIRES".  Matching is
+    case-insensitive and literal.  The words are compiled once into a trie
+    and a regular expression that finds the boundary positions followed by
+    some word; the trie is then walked from each of those
+    positions, so words that are prefixes of one another
+    (e.g. "Keck" and "Keck Observatory Archive") are all found.
+    """
+    BOUNDARY = ' /(-:'
+    SNIPPET = 80
+
+    def __init__(self, words):
+        self.words = list(words)
+        self.trie = {}
+        for word in self.words:
+            node = self.trie
+            for ch in word.lower():
+                node = node.setdefault(ch, {})
+            node.setdefault(None, []).append(word)
+        # Only stop where at least one word follows, so the trie is walked rarely
+        alternatives = '|'.join(re.escape(word.lower()) for word in sorted(self.words, key=len))
+        self.regex = re.compile(f"[{re.escape(self.BOUNDARY)}](?={alternatives})") if self.words else None
+
+    def scan(self, text):
+        """Returns a dict mapping each word found in the lower-cased `text` to
+        a list of its (start, end) offsets, where start includes the boundary character.
+        """
+        offsets = {}
+        if self.regex is None:
+            return offsets
+        for m in self.regex.finditer(text):
+            node = self.trie
+            pos = m.end()
+            while pos < len(text):
+                node = node.get(text[pos])
+                if node is None:
+                    break
+                pos += 1
+                for word in node.get(None, ()):
+                    offsets.setdefault(word, []).append((m.start(), pos))
+        return offsets
+
+    def count(self, text):
+        """Returns the count and surrounding snippets of each word found in `text`."""
+        counts = {}
+        for word, spans in self.scan(text).items():
+            snippets = [text[max(0, start - self.SNIPPET):end + self.SNIPPET] for start, end in spans]
+            counts[word] = {'count': len(spans), 'snippets': snippets}
+        return counts
+
+
+class ArticleAnalysis(object):
+    """Full-text matches of a list of words in one article.
+
+    Parameters
+    ----------
+    bibcode : str
+    words : list of str
+        Words the article text was scanned for.
+    counts : dict
+        Maps each word found to a dict with its 'count' and 'snippets'.
+    method : str
+        'pdf' if the PDF text was scanned, 'query' if ADS highlights were used.
+    """
+    def __init__(self, bibcode, words, counts, method):
+        self.bibcode = bibcode
+        self.words = list(words)
+        self.counts = counts
+        self.method = method
+
+    @classmethod
+    def run(cls, bibcode, words, ads, documents=None, scanner=None):
+        """Scans an article for all `words` at once, from its PDF if possible.
+
+        PDFs and their text are read from and saved to the `DocumentCache`
+        `documents`, if given.  `scanner` is a prebuilt `WordScanner` for `words`.
+        """
+        #try two methods for finding matches
+        try:
+            counts = get_word_match_counts_by_pdf(bibcode, words, ads, documents, scanner)
+            method = 'pdf'
+        except Exception as e:
+            notify("WARN: Could not parse PDF file.  Using alternate ADS query method...")
+            counts = get_word_match_counts_by_query(bibcode, words, ads)
+            method = 'query'
+        return cls(bibcode, words, counts, method)
+
+    def matches(self, words):
+        """Returns the counts of the given subset of words, omitting those not found."""
+        return {word: self.counts[word] for word in words if word in self.counts}
+
+    def to_dict(self):
+        return {'bibcode': self.bibcode, 'words': self.words,
+                'counts': self.counts, 'method': self.method}
+
+
+class AnalysisCache(object):
+    """Two-level cache of `ArticleAnalysis` results: an in-memory LRU in front
+    of one json file per bibcode in `directory`.
+
+    Entries are only returned if they were computed for the same list of
+    words, so changing the configured instruments invalidates them.  Results
+    of the ADS query fallback are only kept in memory, so a later session
+    tries the PDF again.  The json files are evicted by `DocumentCache.prune`
+    along with the PDFs and texts.
+    """
+    def __init__(self, directory, size=ANALYSIS_CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, bibcode):
+        return os.path.join(self.directory, f"{bibcode}.json")
+
+    def get(self, bibcode, words):
+        with self.lock:
+            analysis = self.memory.get(bibcode)
+            if analysis is not None and analysis.words == list(words):
+                self.memory.move_to_end(bibcode)
+                return analysis
+        try:
+            with open(self.path(bibcode)) as f:
+                data = json.load(f)
+            os.utime(self.path(bibcode))
+        except (OSError, ValueError):
+            return None
+        if data.get('words') != list(words):
+            return None
+        analysis = ArticleAnalysis(data['bibcode'], data['words'], data['counts'], data['method'])
+        self.remember(analysis)
+        return analysis
+
+    def put(self, analysis):
+        self.remember(analysis)
+        if analysis.method != 'pdf':
+            # The PDF may only have been unavailable for a moment
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmpfile = self.path(analysis.bibcode) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmpfile, 'w') as f:
+                json.dump(analysis.to_dict(), f)
+            os.replace(tmpfile, self.path(analysis.bibcode))
+        except OSError as e:
+            log.warning(f"Could not cache analysis of {analysis.bibcode}: {e}")
+
+    def remember(self, analysis):
+        with self.lock:
+            self.memory[analysis.bibcode] = analysis
+            self.memory.move_to_end(analysis.bibcode)
+            while len(self.memory) > self.size:
+                self.memory.popitem(last=False)
+
+
+class DocumentCache(object):
+    """Content-addressed, gzip-compressed cache of article PDFs and their extracted text.
+
+    Each PDF is stored once under the sha256 of its content in `pdf/`, and the
+    text extracted from it under the same hash in `text/`.  An uncompressed
+    copy for opening in a viewer is kept under the same hash in `view/`.  A
+    small file per bibcode in `refs/` points to the hash of that article's PDF.  Reads check
+    the content against its hash and drop corrupt entries.  Objects are
+    touched when read, and `prune` evicts the least recently used ones,
+    including the `AnalysisCache` files in `analysis/`, until the cache fits
+    in `max_bytes`.
+
+    The size of the cache is counted once, on the first write, and then kept
+    up to date by `write` and `remove`, so that storing an object does not
+    walk the whole cache.  Only when the total goes over `max_bytes` is it
+    pruned, down to DOCUMENT_CACHE_LOW_WATER of the limit.  `AnalysisCache`
+    files are not counted as they are written, but every prune recounts them.
+    """
+    KINDS = ('pdf', 'text', 'view', 'analysis')
+
+    def __init__(self, directory, max_bytes=DOCUMENT_CACHE_MB * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total = None
+        self.lock = threading.RLock()
+
+    def path(self, kind, name):
+        suffix = {'pdf': '.pdf.gz', 'text': '.txt.gz', 'view': '.pdf', 'refs': ''}[kind]
+        return os.path.join(self.directory, kind, name + suffix)
+
+    def get_hash(self, bibcode):
+        try:
+            with open(self.path('refs', bibcode)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def read(self, kind, digest, verify=True):
+        """Returns the decompressed content of an object, or None if missing or corrupt."""
+        path = self.path(kind, digest)
+        try:
+            with gzip.open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError) as e:
+            log.warning(f"Dropping corrupt cache entry {path}: {e}")
+            self.remove(path)
+            return None
+        if verify and hashlib.sha256(content).hexdigest() != digest:
+            log.warning(f"Dropping cache entry {path}: content does not match its hash")
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return content
+
+    def write(self, path, content, compress=True):
+        """Atomically writes `content`, compressed unless `compress` is False, to `path`."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpfile = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmpfile, 'wb') as f:
+                if compress:
+                    with gzip.GzipFile(filename='', fileobj=f, mode='wb') as z:
+                        z.write(content)
+                else:
+                    f.write(content)
+            old_size = get_file_size(path)
+            os.replace(tmpfile, path)
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for mtime, size, path in self.entries())
+            else:
+                self.total += get_file_size(path) - old_size
+
+    def remove(self, path):
+        size = get_file_size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            if self.total is not None and os.path.basename(os.path.dirname(path)) in self.KINDS:
+                self.total -= size
+
+    def fit(self):
+        """Prunes the cache if the running total of its size is over `max_bytes`."""
+        if self.total is not None and self.total > self.max_bytes:
+            self.prune(int(self.max_bytes * DOCUMENT_CACHE_LOW_WATER))
+
+    def get_pdf(self, bibcode):
+        """Returns the cached PDF content of an article, or None."""
+        digest = self.get_hash(bibcode)
+        return self.read('pdf', digest) if digest else None
+
+    def put_pdf(self, bibcode, content):
+        """Stores the PDF content of an article and returns its hash."""
+        digest = hashlib.sha256(content).hexdigest()
+        try:
+            if not os.path.isfile(self.path('pdf', digest)):
+                self.write(self.path('pdf', digest), content)
+            os.makedirs(os.path.join(self.directory, 'refs'), exist_ok=True)
+            tmpfile = self.path('refs', bibcode) + f".{os.getpid()}.tmp"
+            with open(tmpfile, 'w') as f:
+                f.write(digest)
+            os.replace(tmpfile, self.path('refs', bibcode))
+        except OSError as e:
+            log.warning(f"Could not cache PDF of {bibcode}: {e}")
+        self.fit()
+        return digest
+
+    def get_view_file(self, bibcode):
+        """Returns the path of an uncompressed copy of the article's cached PDF, or None.
+
+        The copy is written on first use and reused until it is pruned.
+        """
+        digest = self.get_hash(bibcode)
+        if not digest:
+            return None
+        path = self.path('view', digest)
+        if os.path.isfile(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        content = self.read('pdf', digest)
+        if content is None:
+            return None
+        try:
+            self.write(path, content, compress=False)
+        except OSError as e:
+            log.warning(f"Could not write PDF of {bibcode} for viewing: {e}")
+            return None
+        self.fit()
+        return path if os.path.isfile(path) else None
+
+    def get_text(self, bibcode):
+        """Returns the cached text extracted from an article's PDF, or None."""
+        digest = self.get_hash(bibcode)
+        if not digest or not os.path.isfile(self.path('pdf', digest)):
+            return None
+        # Text is keyed by the hash of its PDF, not its own content
+        content = self.read('text', digest, verify=False)
+        return content.decode('utf-8') if content is not None else None
+
+    def put_text(self, bibcode, text):
+        """Stores the text extracted from the article's cached PDF."""
+        digest = self.get_hash(bibcode)
+        if not digest:
+            return
+        try:
+            self.write(self.path('text', digest), text.encode('utf-8'))
+        except OSError as e:
+            log.warning(f"Could not cache text of {bibcode}: {e}")
+        self.fit()
+
+    def entries(self):
+        """Returns a list of (mtime, size, path) of all cached objects, oldest first."""
+        entries = []
+        for kind in self.KINDS:
+            try:
+                names = os.listdir(os.path.join(self.directory, kind))
+            except OSError:
+                continue
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(self.directory, kind, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(self.directory, kind, name)))
+        return sorted(entries)
+
+    def stats(self):
+        """Returns a dict with the number and size of the cached PDFs, texts and bibcodes."""
+        stats = {f'{kind}_{unit}': 0 for kind in self.KINDS for unit in ('count', 'bytes')}
+        for mtime, size, path in self.entries():
+            kind = os.path.basename(os.path.dirname(path))
+            stats[f'{kind}_count'] += 1
+            stats[f'{kind}_bytes'] += size
+        try:
+            stats['bibcodes'] = len(os.listdir(os.path.join(self.directory, 'refs')))
+        except OSError:
+            stats['bibcodes'] = 0
+        stats['total_bytes'] = sum(stats[f'{kind}_bytes'] for kind in self.KINDS)
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def prune(self, max_bytes=None):
+        """Evicts the least recently used objects until the cache fits in `max_bytes`.
+
+        Returns the number of bytes freed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for mtime, size, path in entries)
+            self.total = total
+            freed = 0
+            for mtime, size, path in entries:
+                if total - freed <= max_bytes:
+                    break
+                self.remove(path)
+                freed += size
+            if freed:
+                self.remove_dangling_refs()
+        return freed
+
+    def remove_dangling_refs(self):
+        refsdir = os.path.join(self.directory, 'refs')
+        try:
+            names = os.listdir(refsdir)
+        except OSError:
+            return
+        for name in names:
+            digest = self.get_hash(name)
+            if not digest or not os.path.isfile(self.path('pdf', digest)):
+                self.remove(os.path.join(refsdir, name))
+                self.remove(self.path('text', digest or name))
+                self.remove(self.path('view', digest or name))
+
+
+class Prefetcher(object):
+    """Bounded pool of background threads computing `ArticleAnalysis` results ahead of need.
+
+    While the user reads one article, the PDFs of the next ones are downloaded,
+    extracted and scanned by `analyze`, a function of the bibcode.  Results are
+    handed back with `result`.  Workers are daemon threads and `close` cancels
+    whatever has not started, so quitting mid-session never waits on a download.
+    """
+    def __init__(self, analyze, workers=PREFETCH_MAX_WORKERS):
+        self.analyze = analyze
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()
+        self.stopped = threading.Event()
+        self.threads = []
+        for idx in range(workers):
+            thread = threading.Thread(target=self.work, name=f"kpub-prefetch-{idx}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, bibcode):
+        """Queues `bibcode` for analysis unless it already was."""
+        with self.lock:
+            if self.stopped.is_set() or bibcode in self.futures:
+                return
+            future = concurrent.futures.Future()
+            self.futures[bibcode] = future
+        self.tasks.put((bibcode, future))
+
+    def result(self, bibcode):
+        """Waits for and returns the prefetched analysis of `bibcode`.
+
+        Returns None if it was never submitted, was cancelled or failed, in
+        which case the caller computes it itself.
+        """
+        with self.lock:
+            future = self.futures.pop(bibcode, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            return None
+        except Exception as e:
+            log.debug(f"Prefetch of {bibcode} failed: {e}")
+            return None
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None or self.stopped.is_set():
+                return
+            bibcode, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.analyze(bibcode))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def close(self):
+        """Cancels pending work and stops the workers without waiting for running ones."""
+        with self.lock:
+            self.stopped.set()
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+        for _ in self.threads:
+            self.tasks.put(None)
+
+
+class AffiliationClassifier(object):
+    """Classifies affiliation strings into the types defined by `aff_defs`.
+
+    Each type's search strings are compiled once into two combined regexes:
+    all-uppercase strings (acronyms) match case-sensitively, the others
+    case-insensitively.  Results are memoized per affiliation string, as
+    the same affiliations appear on many papers.
+
+    Parameters
+    ----------
+    aff_defs : list of dict
+        Ordered affiliation types, each with a 'type' and a list of regex
+        'strings' to search for.  A type without strings is the default.
+    """
+    def __init__(self, aff_defs):
+        self.aff_defs = aff_defs
+        self.default = ''
+        self.types = []
+        for affdef in aff_defs:
+            if not affdef['strings']:
+                self.default = affdef['type']
+                continue
+            upper = [s for s in affdef['strings'] if s.isupper()]
+            other = [s for s in affdef['strings'] if not s.isupper()]
+            regexes = []
+            if upper:
+                regexes.append(re.compile('|'.join(f"(?:{s})" for s in upper)))
+            if other:
+                regexes.append(re.compile('|'.join(f"(?:{s})" for s in other), re.IGNORECASE))
+            self.types.append((affdef['type'], regexes))
+        self.cache = {}
+
+    def classify(self, affstr):
+        """Returns the type of the first matching definition for one of the
+        semicolon-delimited affiliations in `affstr`, the default type if
+        none match, or None if `affstr` is blank.
+        """
+        try:
+            return self.cache[affstr]
+        except KeyError:
+            pass
+        afftype = self.match(affstr)
+        self.cache[affstr] = afftype
+        return afftype
+
+    def classify_many(self, affstrs):
+        """Returns the types of a sequence of affiliation strings."""
+        return [self.classify(affstr) for affstr in affstrs]
+
+    def match(self, affstr):
+        #Sometimes the value is blank or "-"
+        if len(affstr.strip()) <= 2:
+            return None
+        affs = affstr.split(";")
+        for afftype, regexes in self.types:
+            for regex in regexes:
+                for aff in affs:
+                    if regex.search(aff):
+                        return afftype
+        return self.default
+
+
+class NaiveBayes(object):
+    """Multinomial naive Bayes classifier over sets of string features.
+
+    Each document counts a feature at most once.  Features seen in fewer than
+    `min_count` training documents are ignored and the remaining counts are
+    Laplace smoothed with `alpha`.
+    """
+    def __init__(self, alpha=1.0, min_count=2):
+        self.alpha = alpha
+        self.min_count = min_count
+        self.labels = []
+
+    def fit(self, docs, labels):
+        docs = [set(doc) for doc in docs]
+        doc_freq = collections.Counter()
+        for doc in docs:
+            doc_freq.update(doc)
+        self.vocab = {feat for feat, n in doc_freq.items() if n >= self.min_count}
+        counts = collections.defaultdict(collections.Counter)
+        for doc, label in zip(docs, labels):
+            counts[label].update(doc & self.vocab)
+        priors = collections.Counter(labels)
+        self.labels = sorted(priors)
+        self.log_prior, self.log_prob, self.log_unseen = {}, {}, {}
+        for label in self.labels:
+            total = sum(counts[label].values()) + self.alpha * len(self.vocab)
+            self.log_prior[label] = math.log(priors[label] / len(labels))
+            self.log_prob[label] = {feat: math.log((n + self.alpha) / total)
+                                    for feat, n in counts[label].items()}
+            self.log_unseen[label] = math.log(self.alpha / total)
+        return self
+
+    def predict_proba(self, doc):
+        """Returns a dict mapping each label to its probability for the features `doc`."""
+        doc = set(doc) & self.vocab
+        scores = {}
+        for label in self.labels:
+            log_prob, unseen = self.log_prob[label], self.log_unseen[label]
+            scores[label] = self.log_prior[label] + sum(log_prob.get(feat, unseen) for feat in doc)
+        top = max(scores.values())
+        total = sum(math.exp(score - top) for score in scores.values())
+        return {label: math.exp(score - top) / total for label, score in scores.items()}
+
+
+class ArticleClassifier(object):
+    """Classifies candidate articles for `kpub update --auto`.
+
+    Naive Bayes models trained on the already classified articles predict the
+    mission (including 'unrelated') and the science from the words of the
+    title, abstract and keywords and the scan words (missions, instruments,
+    archive) found in them.  `classify` returns a verdict: 'accept' if the
+    best mission and science are at least `accept` probable, 'reject' if
+    'unrelated' is at least `reject` probable and 'review' otherwise.  The
+    result is remembered per bibcode, so prefetching and the review loop share it.
+    """
+    TOKEN = re.compile(r"[a-z][a-z0-9]+")
+
+    def __init__(self, scanner, accept=AUTO_ACCEPT, reject=AUTO_REJECT):
+        self.scanner = scanner
+        self.accept = accept
+        self.reject = reject
+        self.missions = NaiveBayes()
+        self.sciences = None
+        self.results = {}
+
+    def features(self, article):
+        parts = []
+        for key in ('title', 'abstract', 'keyword'):
+            value = article.get(key) or ''
+            parts.append(' '.join(value) if isinstance(value, list) else value)
+        text = ' '.join(parts).lower()
+        feats = set(self.TOKEN.findall(text))
+        feats.update(f"hit:{word}" for word in self.scanner.scan(' ' + text))
+        return feats
+
+    def fit(self, articles, missions, sciences):
+        """Trains on the `articles` and the `missions` and `sciences` they were classified as."""
+        docs = [self.features(article) for article in articles]
+        self.missions.fit(docs, missions)
+        related = [(doc, science) for doc, mission, science in zip(docs, missions, sciences)
+                   if mission != 'unrelated' and science]
+        if related:
+            self.sciences = NaiveBayes().fit(*zip(*related))
+        self.results = {}
+        return self
+
+    def classify(self, article):
+        """Returns the (verdict, mission, science, probability) of an ADS article dict."""
+        result = self.results.get(article['bibcode'])
+        if result is None:
+            result = self.results[article['bibcode']] = self.score(article)
+        return result
+
+    def score(self, article):
+        feats = self.features(article)
+        probs = self.missions.predict_proba(feats)
+        if probs.get('unrelated', 0) >= self.reject:
+            return 'reject', 'unrelated', '', probs['unrelated']
+        related = {mission: p for mission, p in probs.items() if mission != 'unrelated'}
+        if not related:
+            return 'review', '', '', 0.0
+        mission = max(related, key=related.get)
+        prob = related[mission]
+        science = ''
+        if self.sciences is not None and prob >= self.accept:
+            science_probs = self.sciences.predict_proba(feats)
+            science = max(science_probs, key=science_probs.get)
+            prob *= science_probs[science]
+        verdict = 'accept' if prob >= self.accept else 'review'
+        return verdict, mission, science, prob
+
+
+class BuildManifest(object):
+    """Fingerprints of the inputs each generated output was last built from.
+
+    Outputs whose fingerprint is unchanged, and whose files still exist, are
+    up to date and need not be regenerated.  Stored as json in `filename`.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, name, fingerprint, outputs):
+        return (self.entries.get(name) == fingerprint
+                and all(os.path.exists(fn) for fn in outputs))
+
+    def record(self, name, fingerprint):
+        self.entries[name] = fingerprint
+
+    def save(self):
+        tmpfile = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmpfile, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmpfile, self.filename)
+
+
+class MarkdownWriter(object):
+    """Writes one markdown publication list as its articles are fed to it, newest first.
+
+    Parameters
+    ----------
+    output : str or file
+        Path of the file to write, via a temporary file which replaces it
+        on `close`, or an open file object.
+    template : jinja2 template module
+        The header, group and article macros of template.md.
+    mission, science : str
+        Only articles of this mission and/or science are written.
+        By default all but the 'unrelated' ones are.
+    """
+    def __init__(self, output, template, title="Publications", save_as=None,
+                 group_by_month=False, mission=None, science=None):
+        if isinstance(output, str):
+            self.filename = output
+            self.tmpfile = f"{output}.{os.getpid()}.tmp"
+            self.f = open(self.tmpfile, 'w')
+            save_as = save_as or output.replace("md", "html")
+            log.info('Writing {}'.format(output))
+        else:
+            self.filename = None
+            self.f = output
+        self.template = template
+        self.group_key = 'month' if group_by_month else 'year'
+        self.mission = mission
+        self.science = science
+        self.group = None
+        self.index = 0
+        self.f.write(str(template.header(title, save_as)))
+
+    def accepts(self, art):
+        if self.mission is None:
+            if art['mission'] == 'unrelated':
+                return False
+        elif art['mission'] != self.mission:
+            return False
+        return self.science is None or art['science'] == self.science
+
+    def write(self, art):
+        if art[self.group_key] != self.group:
+            self.group = art[self.group_key]
+            self.index = 0
+            self.f.write(str(self.template.group(self.group)))
+        self.index += 1
+        self.f.write(str(self.template.article(self.index, art)))
+
+    def close(self, discard=False):
+        if self.filename is None:
+            return
+        self.f.close()
+        if discard:
+            os.remove(self.tmpfile)
+        else:
+            os.replace(self.tmpfile, self.filename)
+
+
+class ReportBuilder(object):
+    """Builds several markdown publication lists, and optionally the overview
+    statistics, from a single scan of the publications table.
+
+    Add the lists with `add_markdown`, then call `run`.  Each article read is
+    fanned out to every list whose filters it matches, each grouping by year
+    or month as it goes.
+    """
+    def __init__(self, db):
+        self.db = db
+        templatedir = os.path.join(PACKAGEDIR, 'templates')
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(templatedir))
+        self.template = env.get_template('template.md').module
+        self.writers = []
+
+    def add_markdown(self, output, title="Publications", save_as=None,
+                     group_by_month=False, mission=None, science=None):
+        """Adds a publication list, written to a path or file object `output`."""
+        self.writers.append(dict(output=output, title=title, save_as=save_as,
+                                 group_by_month=group_by_month, mission=mission, science=science))
+
+    def run(self, overview=False, top=20, min_papers=10):
+        """Scans the publications once, writing all lists.
+
+        With `overview`, returns a dict with the 'metrics',
+        'most_cited' (`top`) and 'most_active_first_authors' (with at least
+        `min_papers`), as returned by the corresponding PublicationDB methods.
+        """
+        writers = []
+        try:
+            for kwargs in self.writers:
+                writers.append(MarkdownWriter(template=self.template, **kwargs))
+            missions = {w.mission for w in writers}
+            sciences = {w.science for w in writers}
+            if not overview and len(missions) == 1 and len(sciences) == 1:
+                # Let SQLite filter when all lists show the same publications
+                filters = {'mission': missions.pop(), 'science': sciences.pop()}
+            else:
+                filters = {'unrelated': 'unrelated' in missions}
+            stats = OverviewStats(self.db.config, top) if overview else None
+            for art in self.db.iter_markdown_articles(author_norms=overview, **filters):
+                for writer in writers:
+                    if writer.accepts(art):
+                        writer.write(art)
+                if stats and art['mission'] != 'unrelated':
+                    stats.add(art)
+        except BaseException:
+            for writer in writers:
+                writer.close(discard=True)
+            raise
+        for writer in writers:
+            writer.close()
+        if stats:
+            return stats.result(self.db, min_papers)
+
+
+class OverviewStats(object):
+    """Accumulates the statistics of the overview page one article at a time.
+
+    Matches `PublicationDB.get_metrics`, `get_most_cited` and
+    `get_most_active_first_authors` over the publications not marked
+    'unrelated', when fed those articles newest first.
+    """
+    def __init__(self, config, top=20):
+        self.missions = config.get('missions', [])
+        self.sciences = config.get('sciences', [])
+        self.top = top
+        self.counts = collections.defaultdict(lambda: [0, 0, 0, 0, set()])
+        self.authors = collections.defaultdict(set)
+        self.first_authors = collections.Counter()
+        self.most_cited = []
+        self.seq = 0
+
+    def add(self, art):
+        refereed = art['refereed'] or 0
+        citations = art['citation_count'] or 0
+        phd = int('PhDT' in art['bibcode'])
+        for key in ('all', ('mission', art['mission']), ('science', art['science'])):
+            counts = self.counts[key]
+            counts[0] += 1
+            counts[1] += refereed
+            counts[2] += citations
+            counts[3] += phd
+            if art['first_author_norm'] is not None:
+                counts[4].add(art['first_author_norm'])
+        norms = [norm for norm in art['author_norm'] if norm is not None]
+        self.authors['all'].update(norms)
+        self.authors[art['mission']].update(norms)
+        self.first_authors[art['first_author_norm']] += 1
+        # Keep the `top` most cited; ties go to the newest, which come first
+        self.seq += 1
+        item = (citations, -self.seq, art['bibcode'])
+        if len(self.most_cited) < self.top:
+            heapq.heappush(self.most_cited, item)
+        elif item > self.most_cited[0]:
+            heapq.heapreplace(self.most_cited, item)
+
+    def result(self, db, min_papers=10):
+        metrics = {}
+        count, refereed, citations, phds, first_authors = self.counts['all']
+        metrics['publication_count'] = count
+        metrics['refereed_count'] = refereed
+        metrics['citation_count'] = citations
+        metrics['phd_count'] = phds
+        metrics['first_author_count'] = len(first_authors)
+        metrics['author_count'] = len(self.authors['all'])
+        for mission in self.missions:
+            count, refereed, citations, phds, first_authors = self.counts[('mission', mission)]
+            metrics[f'{mission}_count'] = count
+            metrics[f'{mission}_refereed_count'] = refereed
+            metrics[f'{mission}_citation_count'] = citations
+            metrics[f'{mission}_phd_count'] = phds
+            metrics[f'{mission}_first_author_count'] = len(first_authors)
+            metrics[f'{mission}_author_count'] = len(self.authors[mission])
+        for science in self.sciences:
+            metrics[f'{science}_count'] = self.counts[('science', science)][0]
+        pubcount = metrics["publication_count"]
+        for mission in self.missions:
+            metrics[mission+"_fraction"] = metrics[mission+"_count"] / pubcount if pubcount > 0 else 0
+        for science in self.sciences:
+            metrics[science+"_fraction"] = metrics[science+"_count"] / pubcount if pubcount > 0 else 0
+
+        bibcodes = [bibcode for _, _, bibcode in sorted(self.most_cited, reverse=True)]
+        marks = ", ".join("?" * len(bibcodes))
+        rows = dict(db.con.execute(f"SELECT bibcode, metrics FROM pubs WHERE bibcode IN ({marks})",
+                                   bibcodes))
+        most_cited = [json.loads(rows[bibcode]) for bibcode in bibcodes]
+        most_active = [(name, n) for name, n in self.first_authors.most_common() if n >= min_papers]
+        return {'metrics': metrics, 'most_cited': most_cited,
+                'most_active_first_authors': most_active}
+
+
 class PublicationDB(object):
     """Class wrapping the SQLite database containing the publications.
 
@@ -84,16 +1140,35 @@ class PublicationDB(object):
         self.filename = filename
         self.config = config
         self.con = sql.connect(filename)
+        self.ads = ADSClient((config or {}).get('ADS_API_KEY'))
+        self.cachedir = (config or {}).get('cache_dir') or CACHEDIR
+        self.analysis_cache = AnalysisCache(os.path.join(self.cachedir, 'analysis'))
+        max_mb = (config or {}).get('cache_max_mb') or DOCUMENT_CACHE_MB
+        self.documents = DocumentCache(self.cachedir, max_mb * 2**20)
+        self.scanner = None
+        self.aff_classifier = None
+        self.prefetcher = None
+        db_cfg = (config or {}).get('db', {})
+        self.batch_size = db_cfg.get('batch_size', BATCH_SIZE)
+        journal_mode = db_cfg.get('journal_mode')
+        if journal_mode:
+            self.con.execute(f"PRAGMA journal_mode = {journal_mode}")
+            if journal_mode.upper() == 'WAL':
+                # Safe in WAL mode and avoids an fsync on every commit
+                self.con.execute("PRAGMA synchronous = NORMAL")
         pubs_table_exists = self.con.execute(
                                 """
                                    SELECT COUNT(*) FROM sqlite_master
                                    WHERE type='table' AND name='pubs';
                                 """).fetchone()[0]
         if not pubs_table_exists:
-            self.create_table()    
+            self.create_table()
+        else:
+            self.migrate()
 
     def create_table(self):
-        self.con.execute("""CREATE TABLE pubs(
+        hot_cols = ", ".join(f"{name} {coltype}" for name, coltype in HOT_COLUMNS)
+        self.con.execute(f"""CREATE TABLE pubs(
                                 id UNIQUE,
                                 bibcode UNIQUE,
                                 year,
@@ -103,7 +1178,135 @@ class PublicationDB(object):
                                 science,
                                 instruments,
                                 archive,
-                                metrics)""")
+                                metrics,
+                                {hot_cols})""")
+        self.create_child_tables()
+        self.create_queue_tables()
+        self.create_indexes()
+        # Affiliation types will be classified with the current aff_defs as articles are added
+        self.con.execute("INSERT INTO meta (key, value) VALUES ('aff_defs_hash', ?)",
+                         [self.get_aff_defs_hash()])
+        self.con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.con.commit()
+
+    def create_child_tables(self):
+        """Creates the per-author and per-keyword tables keyed by bibcode."""
+        self.con.execute("""CREATE TABLE IF NOT EXISTS authors(
+                                bibcode,
+                                position INTEGER,
+                                author,
+                                author_norm,
+                                aff,
+                                aff_type,
+                                PRIMARY KEY (bibcode, position))""")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS keywords(
+                                bibcode,
+                                keyword)""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS keywords_bibcode ON keywords(bibcode)")
+        # Settings the stored data depends on, such as the aff_defs hash
+        self.con.execute("CREATE TABLE IF NOT EXISTS meta(key PRIMARY KEY, value)")
+
+    def create_queue_tables(self):
+        """Creates the review queue of candidate articles and the log of ADS harvests."""
+        # Candidates fetched by update(), with their ADS record and highlights until
+        # classified.  state is 'pending', 'skipped' or 'classified'.
+        self.con.execute("""CREATE TABLE IF NOT EXISTS review_queue(
+                                bibcode PRIMARY KEY,
+                                query,
+                                article,
+                                highlights,
+                                state DEFAULT 'pending',
+                                fetched)""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS review_queue_state ON review_queue(state)")
+        # Date each ADS query was last run for each pubdate ('' for none) and
+        # the newest indexstamp it returned, where the next run continues from
+        self.con.execute("""CREATE TABLE IF NOT EXISTS harvests(
+                                query,
+                                pubdate,
+                                harvested,
+                                indexstamp,
+                                PRIMARY KEY (query, pubdate))""")
+
+    def create_indexes(self):
+        """Creates the indexes used by the query and aggregate methods.
+
+        The hot columns sit after the large metrics blob in each pubs row, so
+        reading them from the table itself means walking the blob's overflow
+        pages.  The pubs_metrics covering index lets get_metrics and the
+        annual counts avoid that entirely; it also serves mission+year lookups.
+        """
+        self.con.execute("CREATE INDEX IF NOT EXISTS authors_bibcode_norm ON authors(bibcode, author_norm)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS pubs_metrics ON pubs(mission, year, science, "
+                         "refereed, citation_count, first_author_norm, bibcode)")
+        # query() and to_markdown() filter on mission/science and order by date
+        self.con.execute("CREATE INDEX IF NOT EXISTS pubs_date ON pubs(date)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS pubs_mission_date ON pubs(mission, date)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS pubs_science_date ON pubs(science, date)")
+        # kpub export --archive
+        self.con.execute("CREATE INDEX IF NOT EXISTS pubs_archive ON pubs(archive, bibcode)")
+
+    def migrate(self):
+        """Upgrades an existing database in place to the current schema version.
+
+        Databases created before the schema was versioned have a user_version
+        of 0 and only contain the pubs table with the raw ADS json in the
+        metrics column.
+        """
+        version = self.con.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        log.info(f"Migrating {self.filename} from schema version {version} to {SCHEMA_VERSION}")
+
+        if version < 1:
+            cols = [row[1] for row in self.con.execute("PRAGMA table_info(pubs)")]
+            for name, coltype in HOT_COLUMNS:
+                if name not in cols:
+                    self.con.execute(f"ALTER TABLE pubs ADD COLUMN {name} {coltype}")
+            self.create_child_tables()
+            rows = self.con.execute("SELECT bibcode, metrics FROM pubs").fetchall()
+            for bibcode, metrics in rows:
+                article = json.loads(metrics)
+                self.con.execute("UPDATE pubs SET citation_count=?, read_count=?, refereed=?, "
+                                 "first_author_norm=?, pub=?, doctype=? WHERE bibcode=?",
+                                 get_hot_values(article) + [bibcode])
+                self.add_children(article)
+            # The author rows were classified with the current aff_defs
+            self.con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aff_defs_hash', ?)",
+                             [self.get_aff_defs_hash()])
+
+        if version < 3:
+            self.create_indexes()
+            self.con.execute("ANALYZE")
+
+        if version < 4:
+            # aff_type is filled in by update_aff_types() on first use
+            cols = [row[1] for row in self.con.execute("PRAGMA table_info(authors)")]
+            if 'aff_type' not in cols:
+                self.con.execute("ALTER TABLE authors ADD COLUMN aff_type")
+            self.create_child_tables()
+
+        if version < 5:
+            self.create_queue_tables()
+
+        if version < 6:
+            # Anything entered since the last harvest was indexed after it started
+            cols = [row[1] for row in self.con.execute("PRAGMA table_info(harvests)")]
+            if 'indexstamp' not in cols:
+                self.con.execute("ALTER TABLE harvests ADD COLUMN indexstamp")
+                self.con.execute("UPDATE harvests SET indexstamp = harvested || 'T00:00:00.000Z'")
+
+        self.con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.con.commit()
+
+    def add_children(self, article):
+        """Inserts the author and keyword rows of an article into the child tables."""
+        bibcode = article['bibcode']
+        self.con.execute("DELETE FROM authors WHERE bibcode = ?", [bibcode])
+        self.con.execute("DELETE FROM keywords WHERE bibcode = ?", [bibcode])
+        self.con.executemany("INSERT INTO authors (bibcode, position, author, author_norm, aff, aff_type) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", get_author_rows(article, self.classify_aff))
+        self.con.executemany("INSERT INTO keywords (bibcode, keyword) VALUES (?, ?)",
+                             [[bibcode, kw] for kw in (article.get('keyword') or [])])
 
     def add(self, article, mission="", science="", instruments="", archive=""):
         """Adds a single article object to the database.
@@ -118,36 +1321,107 @@ class PublicationDB(object):
         log.debug('Ingesting {}'.format(article['bibcode']))
 
         # Store the extra metadata in the json string
-        month = article['pubdate'][0:7]
         article['mission'] = mission
         article['science'] = science
         article['instruments'] = instruments
         article['archive'] = archive
+        self.add_many([article])
 
-        #insert to db
-        try:
-            cur = self.con.execute("INSERT INTO pubs "
-                "(id, bibcode, year, month, date, mission, science, instruments, archive, metrics) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                [article['id'], article['bibcode'], article['year'], month, article['pubdate'],
-                mission, science, instruments, archive, json.dumps(article)])
-            log.info(f"Inserted {article['bibcode']}")
-            self.con.commit()
-        except sql.IntegrityError:
-            log.warning('{} was already ingested.'.format(article['bibcode']))
-
-    def add_interactively(self, article, statusmsg="", highlights=None):
+    def add_many(self, articles, batch_size=None):
+        """Adds many article objects to the database using bulk inserts.
+
+        Rows are written with executemany() in batches of `batch_size`, each
+        batch in a single transaction.  Articles which are already in the
+        database (by id or bibcode) are skipped with a warning, like `add`.
+
+        Parameters:
+            articles (iterable): Article json objects returned from ADS API, each
+                optionally carrying the 'mission', 'science', 'instruments' and
+                'archive' classification keys (see `add`).  May be a generator.
+            batch_size (int): Number of articles per transaction (default: self.batch_size)
+
+        Returns:
+            int: Number of articles inserted.
+        """
+        batch_size = batch_size or self.batch_size
+        inserted = 0
+        batch = []
+        for article in articles:
+            batch.append(article)
+            if len(batch) >= batch_size:
+                inserted += self._insert_batch(batch)
+                batch = []
+        if batch:
+            inserted += self._insert_batch(batch)
+        return inserted
+
+    def _insert_batch(self, articles):
+        """Inserts one batch of articles and their child rows in a single transaction."""
+        existing = self.get_existing(articles)
+        pubs_rows, author_rows, keyword_rows = [], [], []
+        for article in articles:
+            if article['bibcode'] in existing or article['id'] in existing:
+                log.warning('{} was already ingested.'.format(article['bibcode']))
+                continue
+            existing.update([article['bibcode'], article['id']])
+            for key in ('mission', 'science', 'instruments', 'archive'):
+                article.setdefault(key, '')
+            pubs_rows.append([article['id'], article['bibcode'], article['year'],
+                              article['pubdate'][0:7], article['pubdate'],
+                              article['mission'], article['science'], article['instruments'],
+                              article['archive'], json.dumps(article)]
+                             + get_hot_values(article))
+            author_rows += get_author_rows(article, self.classify_aff)
+            keyword_rows += [[article['bibcode'], kw] for kw in (article.get('keyword') or [])]
+
+        with self.con:
+            self.con.executemany("INSERT INTO pubs "
+                "(id, bibcode, year, month, date, mission, science, instruments, archive, metrics, "
+                "citation_count, read_count, refereed, first_author_norm, pub, doctype) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", pubs_rows)
+            self.con.executemany("INSERT INTO authors "
+                                 "(bibcode, position, author, author_norm, aff, aff_type) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", author_rows)
+            self.con.executemany("INSERT INTO keywords (bibcode, keyword) VALUES (?, ?)", keyword_rows)
+        for row in pubs_rows:
+            log.info(f"Inserted {row[1]}")
+        return len(pubs_rows)
+
+    def get_existing(self, articles):
+        """Returns the set of ids and bibcodes of `articles` which are already in the database."""
+        existing = set()
+        ids = [a['id'] for a in articles]
+        bibcodes = [a['bibcode'] for a in articles]
+        # Stay well below SQLite's limit on the number of bound parameters
+        for i in range(0, len(articles), 400):
+            chunk_ids, chunk_bibcodes = ids[i:i+400], bibcodes[i:i+400]
+            marks_ids = ", ".join("?" * len(chunk_ids))
+            marks_bibcodes = ", ".join("?" * len(chunk_bibcodes))
+            cur = self.con.execute(f"SELECT id, bibcode FROM pubs "
+                                   f"WHERE id IN ({marks_ids}) OR bibcode IN ({marks_bibcodes});",
+                                   chunk_ids + chunk_bibcodes)
+            for row in cur.fetchall():
+                existing.update(row)
+        return existing
+
+    def add_interactively(self, article, statusmsg="", highlights=None, pending=None):
         """Adds an article by prompting the user for the classification.
 
         Parameters:
             article (json): Article json object returned from ADS API
+            pending (list): If given, the classified article is appended to this
+                list for a later `add_many` instead of being inserted right away.
+
+        Returns:
+            str: The mission chosen, '' if the article was skipped, or None if
+                it was already in the database.
         """        
 
         # Do not show an article that is already in the database
         if self.article_exists(article):
             log.info("{} is already in the database "
                      "-- skipping.".format(article['bibcode']))
-            return
+            return None
 
         # Print paper information to stdout
         #print(chr(27) + "[2J")  # Clear screen
@@ -173,7 +1447,7 @@ class PublicationDB(object):
         #Hitting return or any unrecognized key results in skip
         mission = valmap.get(mission, '')
         if not mission:
-            return
+            return mission
 
         # Prompt the user to classify the paper by science
         science = ''
@@ -194,16 +1468,114 @@ class PublicationDB(object):
             archive = self.get_archive_acknowledgement(article['bibcode'])
 
         #add it
-        self.add(article, mission=mission, science=science, instruments=instruments,
-                 archive=archive)
+        if pending is None:
+            self.add(article, mission=mission, science=science, instruments=instruments,
+                     archive=archive)
+        else:
+            article.update(mission=mission, science=science, instruments=instruments,
+                           archive=archive)
+            pending.append(article)
+        return mission
+
+
+    def add_automatically(self, article, classifier, pending=None):
+        """Adds an article classified by an `ArticleClassifier` without prompting.
+
+        Instruments and archive use are taken from the full-text scan, as
+        proposed in `add_interactively`.  Returns the classifier's verdict;
+        nothing is added if it is 'review'.
+        """
+        verdict, mission, science, prob = classifier.classify(article)
+        if verdict == 'review':
+            print(f"\nAUTO: {article['bibcode']} needs review (p={prob:.3f})")
+            return verdict
+
+        instruments = archive = ''
+        if mission != 'unrelated':
+            analysis = self.analyze(article['bibcode'])
+            instruments = '|'.join(analysis.matches(self.config.get('instruments') or []))
+            if self.config.get('archive'):
+                archive = '1' if analysis.matches(self.config['archive']) else '0'
+        print(f"AUTO: {article['bibcode']} -> {mission} {science} (p={prob:.3f})")
+
+        if pending is None:
+            self.add(article, mission=mission, science=science, instruments=instruments,
+                     archive=archive)
+        else:
+            article.update(mission=mission, science=science, instruments=instruments,
+                           archive=archive)
+            pending.append(article)
+        return verdict
+
+
+    def get_article_classifier(self):
+        """Returns an `ArticleClassifier` trained on the classified articles,
+        or None if there are too few of them or no unrelated ones."""
+        auto_cfg = self.config.get('auto') or {}
+        rows = self.con.execute("""SELECT mission, science,
+                                          json_extract(metrics, '$.title'),
+                                          json_extract(metrics, '$.abstract'),
+                                          json_extract(metrics, '$.keyword')
+                                   FROM pubs""").fetchall()
+        missions = [row[0] for row in rows]
+        if len(rows) < auto_cfg.get('min_examples', AUTO_MIN_EXAMPLES) \
+                or len(set(missions)) < 2 or 'unrelated' not in missions:
+            log.warning("Not enough classified articles to train the auto classifier.")
+            return None
+        #The json text of the title and keyword lists splits into the same words
+        articles = [{'title': title, 'abstract': abstract, 'keyword': keyword}
+                    for _, _, title, abstract, keyword in rows]
+        classifier = ArticleClassifier(self.get_scanner(),
+                                       accept=auto_cfg.get('accept', AUTO_ACCEPT),
+                                       reject=auto_cfg.get('reject', AUTO_REJECT))
+        return classifier.fit(articles, missions, [row[1] for row in rows])
+
 
+    def get_scan_words(self):
+        """Returns the mission, instrument and archive words searched for in article texts."""
+        words = []
+        for key in ('missions', 'instruments', 'archive'):
+            for word in self.config.get(key) or []:
+                if word not in words:
+                    words.append(word)
+        return words
+
+    def get_scanner(self, words=None):
+        """Returns the `WordScanner` for the scan words, building it only when they change."""
+        words = words or self.get_scan_words()
+        if self.scanner is None or self.scanner.words != words:
+            self.scanner = WordScanner(words)
+        return self.scanner
+
+    def analyze(self, bibcode):
+        """Returns the `ArticleAnalysis` of an article, computing it only if it is not cached.
+
+        Snippet display, instrument detection and archive detection all read
+        from the same analysis, so the PDF is downloaded, extracted and
+        scanned at most once per article.  If a `Prefetcher` is running, its
+        result for the article is waited for rather than computed again.
+        """
+        if self.prefetcher is not None:
+            analysis = self.prefetcher.result(bibcode)
+            if analysis is not None:
+                return analysis
+        return self.compute_analysis(bibcode)
+
+    def compute_analysis(self, bibcode):
+        """Returns the cached `ArticleAnalysis` of an article, running it on a cache miss."""
+        words = self.get_scan_words()
+        analysis = self.analysis_cache.get(bibcode, words)
+        if analysis is None:
+            analysis = ArticleAnalysis.run(bibcode, words, self.ads, self.documents,
+                                           self.get_scanner(words))
+            self.analysis_cache.put(analysis)
+        return analysis
 
     def find_all_snippets(self, bibcode):
 
         colors = self.config.get('colors')
         missions = self.config.get('missions', [])
         instruments = self.config.get('instruments', [])
-        ads_api_key = self.config.get('ADS_API_KEY')
 
         #if not config for this, then return empty array
         words = []
@@ -212,12 +1584,7 @@ class PublicationDB(object):
         if not words:
             return []
 
-        #try two methods for finding matches
-        try:
-            counts = get_word_match_counts_by_pdf(bibcode, words, ads_api_key)
-        except Exception as e:
-            print("WARN: Could not parse PDF file.  Using alternate ADS query method...")
-            counts = get_word_match_counts_by_query(bibcode, words, ads_api_key)
+        counts = self.analyze(bibcode).matches(words)
 
         #print snippets
         print("\nSNIPPETS FOUND:")
@@ -238,13 +1605,7 @@ class PublicationDB(object):
             return ''
 
 
-        #try two methods for finding matches
-        ads_api_key = self.config.get('ADS_API_KEY')
-        try:
-            counts = get_word_match_counts_by_pdf(bibcode, archive, ads_api_key)
-        except Exception as e:
-            print("WARN: Could not parse PDF file.  Using alternate ADS query method...")
-            counts = get_word_match_counts_by_query(bibcode, archive, ads_api_key)
+        counts = self.analyze(bibcode).matches(archive)
 
         #print snippets
         # print("ARCHIVE SNIPPETS FOUND:")
@@ -269,13 +1630,7 @@ class PublicationDB(object):
         if not instruments:
             return ''
 
-        #try two methods for finding matches
-        ads_api_key = self.config.get('ADS_API_KEY')
-        try:
-            counts = get_word_match_counts_by_pdf(bibcode, instruments, ads_api_key)
-        except Exception as e:
-            print("WARN: Could not parse PDF file.  Using alternate ADS query method...")
-            counts = get_word_match_counts_by_query(bibcode, instruments, ads_api_key)
+        counts = self.analyze(bibcode).matches(instruments)
 
         #print snippets
         print("\nINSTRUMENT SNIPPETS FOUND:")
@@ -291,12 +1646,143 @@ class PublicationDB(object):
         return val
 
 
-    def add_by_bibcode(self, bibcode, interactive=False, **kwargs):
+    def get_by_bibcode(self, bibcode):
+        """Returns the list of ADS article records matching a bibcode."""
         #TODO: NOTE: Without querying for 'keck' in full text, highlights will not be returned.
         bibcode = bibcode.replace('&', '%26')
         q = f"identifier:{bibcode}"
         data = self.query_ads(q)
-        articles = data['response']['docs'] 
+        return data['response']['docs']
+
+    def get_by_bibcodes(self, bibcodes):
+        """Resolves many bibcodes with a single ADS query.
+
+        The bibcodes are OR'ed together in one `identifier:` search, so
+        alternate and arXiv bibcodes resolve just like with `get_by_bibcode`.
+
+        Returns:
+            dict: Maps each requested bibcode to the list of matching ADS records.
+        """
+        terms = " OR ".join('"{}"'.format(b.replace('&', '%26')) for b in bibcodes)
+        data = self.query_ads(f"identifier:({terms})")
+        found = {b: [] for b in bibcodes}
+        for article in data['response']['docs']:
+            identifiers = set([article['bibcode']] + (article.get('identifier') or [])
+                              + (article.get('alternate_bibcode') or []))
+            for bibcode in bibcodes:
+                if bibcode in identifiers:
+                    found[bibcode].append(article)
+        return found
+
+    def import_csv(self, csvfile, chunk_size=IMPORT_CHUNK_SIZE):
+        """Imports the publications listed in a csv file.
+
+        Each line must have the form "bibcode,mission,science,instruments,archive".
+        The metadata is fetched from ADS `chunk_size` bibcodes at a time and
+        written to the database with `add_many`.  If a chunk cannot be fetched
+        the error is raised, and the articles of that and later chunks are
+        not written.
+
+        Returns:
+            int: Number of articles inserted.
+        """
+        lines = []
+        for line in open(csvfile, 'r').readlines():
+            line = line.strip()
+            if not line:
+                continue
+            col = line.split(',')  # Naive csv parsing
+            if len(col) < 5:
+                log.error(f"Skipping malformed line '{line}'")
+                continue
+            lines.append(col)
+
+        def fetch_articles():
+            """Yields the ADS record of each csv line, with its classification attached."""
+            for i in range(0, len(lines), chunk_size):
+                chunk = lines[i:i+chunk_size]
+                bibcodes = [col[0] for col in chunk]
+                try:
+                    found = self.get_by_bibcodes(bibcodes)
+                except (requests.RequestException, ValueError) as e:
+                    # ADSClient has already retried; abort rather than drop the chunk
+                    log.error(f"Could not fetch {bibcodes[0]}..{bibcodes[-1]}: {e}. Aborting the import.")
+                    raise
+                log.info(f"Fetched {i+len(chunk)} of {len(lines)} bibcodes")
+                for bibcode, mission, science, instrs, archive in (col[:5] for col in chunk):
+                    articles = found.get(bibcode)
+                    if not articles:
+                        log.error(f"No ADS record found for bibcode {bibcode}")
+                        continue
+                    for article in articles:
+                        if bibcode != article['bibcode']:
+                            log.warning("Requested {} but ADS API returned {}".format(
+                                        bibcode, article['bibcode']))
+                        article = dict(article, mission=mission, science=science,
+                                       instruments=instrs, archive=archive)
+                        yield article
+
+        return self.add_many(fetch_articles())
+
+    def fetch_metrics(self, bibcodes):
+        """Fetches the current citation and read counts of up to 2000 bibcodes
+        with a single ADS bigquery request.
+
+        Returns:
+            dict: Maps each bibcode found to its (citation_count, read_count).
+        """
+        url = (f"{ADS_BIGQUERY}q=*:*"
+               "&fl=bibcode,citation_count,read_count"
+               f"&rows={len(bibcodes)}")
+        r = self.ads.post(url, data="bibcode\n" + "\n".join(bibcodes),
+                          headers={'Content-Type': 'big-query/csv'})
+        r.raise_for_status()
+        return {doc['bibcode']: (doc.get('citation_count'), doc.get('read_count'))
+                for doc in r.json()['response']['docs']}
+
+    def refresh_metrics(self, chunk_size=REFRESH_CHUNK_SIZE, workers=REFRESH_WORKERS):
+        """Updates the citation and read counts of all articles from ADS.
+
+        Only those two fields are requested, `chunk_size` bibcodes per bigquery
+        request, with up to `workers` requests in flight through the rate-limited
+        ADS client.  The counts are written to the columns and the metrics json
+        in one transaction once everything has been fetched, so a failed
+        refresh changes nothing.
+
+        Returns:
+            dict: Counts of 'articles', 'requests', 'changed' and 'missing'
+                articles and the 'fetch' and 'write' times in seconds.
+        """
+        bibcodes = [row[0] for row in self.con.execute("SELECT bibcode FROM pubs ORDER BY bibcode")]
+        chunks = [bibcodes[i:i+chunk_size] for i in range(0, len(bibcodes), chunk_size)]
+
+        start = time.perf_counter()
+        metrics = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk, found in zip(chunks, pool.map(self.fetch_metrics, chunks)):
+                metrics.update(found)
+                log.info(f"Fetched {len(metrics)} of {len(bibcodes)} bibcodes")
+        fetched = time.perf_counter()
+
+        missing = [bibcode for bibcode in bibcodes if bibcode not in metrics]
+        if missing:
+            log.warning(f"{len(missing)} bibcodes were not found in ADS, e.g. {missing[0]}. "
+                        "`kpub refresh` re-imports them under their current bibcodes.")
+        rows = [(citations, reads, citations, reads, bibcode, citations, reads)
+                for bibcode, (citations, reads) in metrics.items()]
+        with self.con:
+            cur = self.con.executemany("""UPDATE pubs SET citation_count = ?, read_count = ?,
+                                              metrics = json_set(metrics, '$.citation_count', ?,
+                                                                 '$.read_count', ?)
+                                          WHERE bibcode = ?
+                                            AND (citation_count IS NOT ? OR read_count IS NOT ?)""", rows)
+        return {'articles': len(bibcodes), 'requests': len(chunks), 'changed': max(cur.rowcount, 0),
+                'missing': len(missing), 'fetch': fetched - start,
+                'write': time.perf_counter() - fetched}
+
+    def add_by_bibcode(self, bibcode, interactive=False, **kwargs):
+        articles = self.get_by_bibcode(bibcode)
+        bibcode = bibcode.replace('&', '%26')
 
         if not articles:
             log.error(f"No ADS record found for bibcode {bibcode}")
@@ -317,6 +1803,8 @@ class PublicationDB(object):
 
     def delete_by_bibcode(self, bibcode):
         cur = self.con.execute("DELETE FROM pubs WHERE bibcode = ?;", [bibcode])
+        self.con.execute("DELETE FROM authors WHERE bibcode = ?;", [bibcode])
+        self.con.execute("DELETE FROM keywords WHERE bibcode = ?;", [bibcode])
         log.info('Deleted {} row(s).'.format(cur.rowcount))
         self.con.commit()
 
@@ -342,26 +1830,11 @@ class PublicationDB(object):
         rows : list
             List of SQLite result rows.
         """
-        # Build the query
-        if mission is None:
-            where = "(mission != 'unrelated') "
-        else:
-            where = "(mission = '{}') ".format(mission)
-
-        if science is not None:
-            where += " AND science = '{}' ".format(science)
-
-        if year is not None:
-            if isinstance(year, (list, tuple)):  # Multiple years?
-                str_year = ["'{}'".format(y) for y in year]
-                where += " AND year IN (" + ", ".join(str_year) + ")"
-            else:
-                where += " AND year = '{}' ".format(year)
-
+        where, params = self._where(mission=mission, science=science, year=year)
         cur = self.con.execute("SELECT year, month, metrics, bibcode "
                                "FROM pubs "
-                               "WHERE {} "
-                               "ORDER BY date DESC; ".format(where))
+                               f"WHERE {where} "
+                               "ORDER BY date DESC; ", params)
         return cur.fetchall()
 
     def get_metadata(self, bibcode):
@@ -369,80 +1842,229 @@ class PublicationDB(object):
         cur = self.con.execute("SELECT metrics FROM pubs WHERE bibcode = ?;", [bibcode])
         return json.loads(cur.fetchone()[0])
 
+    def iter_markdown_articles(self, author_norms=False, unrelated=False, **kwargs):
+        """Yields the articles of the publication list as dicts, newest first.
+
+        Only the fields used by the markdown template, the classification
+        and the hot columns are extracted, by SQLite, from each row, and rows
+        are read one at a time.  With `author_norms`, the normalized author
+        names are included too.  Accepts the filters of `query`; with
+        `unrelated`, all publications are returned instead.
+        """
+        if unrelated:
+            where, params = "1", []
+        else:
+            where, params = self._where(**kwargs)
+        norms = "json_extract(metrics, '$.author_norm')" if author_norms else "NULL"
+        cur = self.con.execute("SELECT year, month, date, bibcode, mission, science, pub, "
+                               "refereed, citation_count, first_author_norm, "
+                               "json_extract(metrics, '$.title[0]'), "
+                               "json_extract(metrics, '$.author[0]'), "
+                               "json_extract(metrics, '$.author[1]'), "
+                               "json_extract(metrics, '$.author[2]'), "
+                               "json_array_length(metrics, '$.author'), "
+                               f"json_extract(metrics, '$.property'), {norms} "
+                               "FROM pubs "
+                               f"WHERE {where} "
+                               "ORDER BY date DESC; ", params)
+        for (year, month, date, bibcode, mission, science, pub, refereed, citation_count,
+                first_author_norm, title, *authors, author_count, prop, norms) in cur:
+            if month.endswith("-00"):
+                month = month[:-3] + "-01"
+            yield {'bibcode': bibcode, 'year': year, 'month': month, 'date': date,
+                   'mission': mission, 'science': science, 'pub': pub,
+                   'refereed': refereed, 'citation_count': citation_count,
+                   'first_author_norm': first_author_norm, 'title': title or '',
+                   'author': [a for a in authors if a is not None],
+                   'author_count': author_count or 0,
+                   # The markdown template depends on "property" being iterable
+                   'property': json.loads(prop) if prop else [],
+                   'author_norm': json.loads(norms) if norms else []}
+
     def to_markdown(self, title="Publications",
                     group_by_month=False, save_as=None, **kwargs):
         """Returns the publication list in markdown format.
         """
-        if group_by_month:
-            group_idx = 1
-        else:
-            group_idx = 0  # by year
-
-        articles = collections.OrderedDict({})
-        for row in self.query(**kwargs):
-            group = row[group_idx]
-            if group.endswith("-00"):
-                group = group[:-3] + "-01"
-            if group not in articles:
-                articles[group] = []
-            art = json.loads(row[2])
-            # The markdown template depends on "property" being iterable
-            if art["property"] is None:
-                art["property"] = []
-            articles[group].append(art)
-
-        templatedir = os.path.join(PACKAGEDIR, 'templates')
-        env = jinja2.Environment(loader=jinja2.FileSystemLoader(templatedir))
-        template = env.get_template('template.md')
-        markdown = template.render(title=title, save_as=save_as,
-                                   articles=articles)
-        if sys.version_info >= (3, 0):
-            return markdown  # Python 3
-        else:
-            return markdown.encode("utf-8")  # Python 2
+        f = io.StringIO()
+        builder = ReportBuilder(self)
+        builder.add_markdown(f, title=title, group_by_month=group_by_month,
+                             save_as=save_as, **kwargs)
+        builder.run()
+        return f.getvalue()
 
     def save_markdown(self, output_fn, **kwargs):
         """Saves the database to a text file in markdown format.
 
+        The markdown is written as it is rendered, to a temporary file
+        which then replaces `output_fn`.
+
         Parameters
         ----------
         output_fn : str
             Path of the file to write.
         """
-        markdown = self.to_markdown(save_as=output_fn.replace("md", "html"),
-                                    **kwargs)
-        log.info('Writing {}'.format(output_fn))
-        f = open(output_fn, 'w')
-        f.write(markdown)
-        f.close()
+        builder = ReportBuilder(self)
+        builder.add_markdown(output_fn, **kwargs)
+        builder.run()
+
+    def get_plot_tasks(self):
+        """Returns a (name, plot function, kwargs, queries) tuple for every plot to save.
 
-    def plot(self):
-        """Saves beautiful plot of the database."""
+        `queries` lists the (PublicationDB method, kwargs) calls the plot function
+        makes, so that they can be run once up front by `plot`.
+        """
         missions = self.config.get('missions', [])
         sciences = self.config.get('sciences', [])
         plots_cfg = self.config.get('plots', [])
-        for ext in ['pdf', 'png']:
-            plot.plot_by_year(self, f"{PLOTDIR}/kpub-publication-rate.{ext}", 
-                              first_year=plots_cfg['year_begin'], missions=missions)
-            plot.plot_by_year(self, f"{PLOTDIR}/kpub-publication-rate-no-extrapolation.{ext}", 
-                              first_year=plots_cfg['year_begin'], missions=missions, extrapolate=False)
-            for mission in missions:
-                plot.plot_by_year(self, f"{PLOTDIR}/kpub-publication-rate-{mission}.{ext}", 
-                                 first_year=plots_cfg['year_begin'], missions=[mission])
-            plot.plot_science_piechart(self, f"{PLOTDIR}/kpub-piechart.{ext}", sciences=sciences)
-            plot.plot_author_count(self, f"{PLOTDIR}/kpub-author-count.{ext}", first_year=plots_cfg['year_begin'])
+        year_begin = plots_cfg['year_begin']
+        current_year = datetime.datetime.now().year
+        pub_counts = ('get_publication_counts', {'year_begin': year_begin, 'year_end': current_year})
+        formats = plots_cfg.get('formats') or ['pdf', 'png']
+        tasks = []
+        tasks.append(("publication-rate", 'plot_by_year',
+                      {'output_fn': f"{PLOTDIR}/kpub-publication-rate", 'formats': formats,
+                       'first_year': year_begin, 'missions': missions}, [pub_counts]))
+        tasks.append(("publication-rate-no-extrapolation", 'plot_by_year',
+                      {'output_fn': f"{PLOTDIR}/kpub-publication-rate-no-extrapolation",
+                       'formats': formats, 'first_year': year_begin, 'missions': missions,
+                       'extrapolate': False}, [pub_counts]))
+        for mission in missions:
+            tasks.append((f"publication-rate-{mission}", 'plot_by_year',
+                          {'output_fn': f"{PLOTDIR}/kpub-publication-rate-{mission}",
+                           'formats': formats, 'first_year': year_begin, 'missions': [mission]},
+                          [pub_counts]))
+        tasks.append(("piechart", 'plot_science_piechart',
+                      {'output_fn': f"{PLOTDIR}/kpub-piechart", 'formats': formats,
+                       'sciences': sciences},
+                      [('get_science_counts', {'sciences': sciences})] if sciences else []))
+        tasks.append(("author-count", 'plot_author_count',
+                      {'output_fn': f"{PLOTDIR}/kpub-author-count", 'formats': formats,
+                       'first_year': year_begin},
+                      [('get_cumulative_author_series',
+                        {'first_year': year_begin - 1, 'last_year': current_year})]))
 
         #bokeh plots
         if plots_cfg['instruments']:
-            plot.plot_instruments(self, f"{PLOTDIR}/kpub-publications-by-instrument", 
-                                  year_begin=plots_cfg['year_begin'],
-                                  missions=missions, 
-                                  instruments=plots_cfg['instruments'])
+            tasks.append(("publications-by-instrument", 'plot_instruments',
+                          {'output_fn': f"{PLOTDIR}/kpub-publications-by-instrument",
+                           'year_begin': year_begin, 'missions': missions,
+                           'instruments': plots_cfg['instruments']},
+                          [('get_publication_counts', {'year_begin': year_begin,
+                                                       'year_end': current_year - 1,
+                                                       'instruments': plots_cfg['instruments']})]))
         if self.config['aff_defs']:
-            plot.plot_affiliations(self, f"{PLOTDIR}/kpub-affiliations", 
-                                  year_begin=plots_cfg['year_begin'],
-                                  missions=missions)
+            tasks.append(("affiliations", 'plot_affiliations',
+                          {'output_fn': f"{PLOTDIR}/kpub-affiliations",
+                           'year_begin': year_begin, 'missions': missions},
+                          [('get_affiliation_counts', {'year_begin': year_begin,
+                                                       'year_end': current_year - 1,
+                                                       'mission': mission})
+                           for mission in missions]))
+        return tasks
+
+    def get_fingerprint(self, mission=None, science=None):
+        """Returns a hash of the publications matching the `query` filters.
+
+        It combines, per mission, science and year, the row count, the
+        highest rowid, the citation and read totals and the total size of
+        the classification and metrics columns, so that any insert, delete
+        or update of those publications changes it.
+        """
+        where, params = self._where(mission=mission, science=science)
+        rows = self.con.execute(f"SELECT mission, science, year, COUNT(*), MAX(rowid), "
+                                f"TOTAL(citation_count), TOTAL(read_count), "
+                                f"SUM(LENGTH(instruments) + LENGTH(archive) + LENGTH(metrics)) "
+                                f"FROM pubs WHERE {where} GROUP BY 1, 2, 3 ORDER BY 1, 2, 3",
+                                params).fetchall()
+        return fingerprint(rows)
 
+    def plot(self, only=None, jobs=1, force=False):
+        """Saves beautiful plots of the database.
+
+        The data needed by all plots is queried once up front, then the
+        figures are rendered by `jobs` worker processes (matplotlib is not
+        thread-safe).
+
+        Parameters
+        ----------
+        only : list of str
+            Names (or fnmatch patterns) of the plots to save, e.g.
+            'publication-rate*'.  Defaults to all plots.  Each matplotlib
+            plot is saved in all of the configured plots 'formats'.
+
+        jobs : int
+            Number of worker processes.  With 1, plots are rendered in this process.
+
+        force : bool
+            Plots whose data, settings and plotting code are unchanged since
+            they were last saved (see `BuildManifest`) are skipped, unless
+            `force` is True.
+
+        Returns
+        -------
+        Dict mapping each saved plot name to the seconds it took to render.
+        """
+        tasks = self.get_plot_tasks()
+        if only:
+            tasks = [task for task in tasks
+                     if any(fnmatch.fnmatch(task[0], pattern) for pattern in only)]
+
+        #skip plots whose inputs did not change.  The plots span up to the
+        #current year, and the extrapolation depends on the current date.
+        manifest = BuildManifest(os.path.join(PLOTDIR, '.kpub-manifest.json'))
+        data_hash = fingerprint(self.get_fingerprint(),
+                                self.get_fingerprint(mission='unrelated'), self.config,
+                                get_plot_code_hash())
+        today = datetime.date.today()
+        fingerprints = {}
+        for name, func_name, kwargs, queries in list(tasks):
+            extrapolates = func_name == 'plot_by_year' and kwargs.get('extrapolate', True)
+            fingerprints[name] = fingerprint(data_hash, func_name, kwargs,
+                                             today if extrapolates else today.year)
+            if not force and manifest.is_current(name, fingerprints[name], get_plot_outputs(kwargs)):
+                log.info(f"Skipping plot {name}: unchanged")
+                tasks.remove((name, func_name, kwargs, queries))
+
+        start = time.perf_counter()
+        data = plot.PlotData(self)
+        for name, func_name, kwargs, queries in tasks:
+            for method, query_kwargs in queries:
+                data.fetch(method, **query_kwargs)
+        log.info(f"Queried plot data in {time.perf_counter() - start:.2f}s")
+
+        #a failed plot is reported without stopping the others
+        timings = {}
+        if jobs > 1 and len(tasks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(plot.render_plot, func_name, data, kwargs): name
+                           for name, func_name, kwargs, queries in tasks}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        timings[futures[future]] = future.result()
+                    except Exception as e:
+                        log.error(f"Could not save plot {futures[future]}: {e!r}")
+        else:
+            for name, func_name, kwargs, queries in tasks:
+                try:
+                    timings[name] = plot.render_plot(func_name, data, kwargs)
+                except Exception as e:
+                    log.error(f"Could not save plot {name}: {e!r}")
+
+        for name, func_name, kwargs, queries in tasks:
+            if name in timings:
+                log.info(f"Rendered {name} in {timings[name]:.2f}s")
+                manifest.record(name, fingerprints[name])
+        if timings:
+            manifest.save()
+        log.info(f"Saved {len(timings)} plots in {time.perf_counter() - start:.2f}s")
+        return timings
+
+    def get_science_counts(self, sciences):
+        """Returns the number of publications of each science category in `sciences`."""
+        marks = ", ".join("?" * len(sciences))
+        counts = dict(self.con.execute(f"SELECT science, COUNT(*) FROM pubs "
+                                       f"WHERE science IN ({marks}) GROUP BY science", sciences))
+        return [counts.get(science, 0) for science in sciences]
 
     def get_metrics(self, year=None):
         """Returns a dictionary of overall publication statistics.
@@ -453,6 +2075,10 @@ class PublicationDB(object):
         * # of citations.
         * # of peer-reviewed pubs.
         * # of per mission and science
+
+        All counts are aggregated in SQLite from the hot columns and the
+        authors table, using one query for the publication counts and one
+        for the distinct author counts.
         """
 
         missions = self.config.get('missions', [])
@@ -472,60 +2098,50 @@ class PublicationDB(object):
         for science in sciences:
             metrics[f'{science}_count'] = 0
 
-
-        authors, first_authors = {}, {}
-        authors['all'] = []
-        first_authors['all'] = []
-        for mission in missions:
-            authors[mission] = []
-            first_authors[mission] = []
-
-        for article in self.query(year=year):
-            api_response = article[2]
-            js = json.loads(api_response)
-
-            #general count
-            metrics["publication_count"] += 1
-            metrics[f"{js['mission']}_count"] += 1
-
-            #phd counts
-            if "PhDT" in js['bibcode']:
-                metrics["phd_count"] += 1
-                metrics[f"{js['mission']}_phd_count"] += 1
-
-            #science counts
-            try:
-                metrics[f"{js['science']}_count"] += 1
-            except KeyError:
-                pass
-                #log.warning(f"{js['bibcode']}: no science category")
-
-            #author counts
-            authors['all'].extend(js['author_norm'])
-            first_authors['all'].append(js['first_author_norm'])
-            authors[js['mission']].extend(js['author_norm'])
-            first_authors[js['mission']].append(js['first_author_norm'])
-
-            #refereed counts
-            try:
-                if "REFEREED" in js['property']:
-                    metrics["refereed_count"] += 1
-                    metrics[f"{js['mission']}_refereed_count"] += 1
-            except TypeError:  # proprety is None
-                pass
-
-            #citation counts
-            try:
-                metrics["citation_count"] += js['citation_count']
-                metrics[f"{js['mission']}_citation_count"] += js['citation_count']
-            except (KeyError, TypeError):
-                log.warning("{}: no citation_count".format(js["bibcode"]))
-
-        metrics["author_count"] = np.unique(authors['all']).size
-        metrics["first_author_count"] = np.unique(first_authors['all']).size
+        #publication, refereed, citation, phd and first author counts
+        where, params = self._where(year=year)
+        select = ("COUNT(*), COALESCE(SUM(refereed), 0), COALESCE(SUM(citation_count), 0), "
+                  "COALESCE(SUM(instr(bibcode, 'PhDT') > 0), 0), COUNT(DISTINCT first_author_norm)")
+        cur = self.con.execute(f"SELECT 'all', NULL, {select} FROM pubs WHERE {where} "
+                               f"UNION ALL "
+                               f"SELECT 'mission', mission, {select} FROM pubs WHERE {where} GROUP BY mission "
+                               f"UNION ALL "
+                               f"SELECT 'science', science, {select} FROM pubs WHERE {where} GROUP BY science;",
+                               params * 3)
+        for group, key, count, refereed, citations, phds, first_authors in cur.fetchall():
+            if group == 'all':
+                metrics['publication_count'] = count
+                metrics['refereed_count'] = refereed
+                metrics['citation_count'] = citations
+                metrics['phd_count'] = phds
+                metrics['first_author_count'] = first_authors
+            elif group == 'mission' and key in missions:
+                metrics[f'{key}_count'] = count
+                metrics[f'{key}_refereed_count'] = refereed
+                metrics[f'{key}_citation_count'] = citations
+                metrics[f'{key}_phd_count'] = phds
+                metrics[f'{key}_first_author_count'] = first_authors
+            elif group == 'science' and key in sciences:
+                metrics[f'{key}_count'] = count
+
+        #unique author counts, from the distinct (mission, author) pairs
+        where, params = self._where(year=year, prefix='p.')
+        cur = self.con.execute(f"WITH pairs AS ("
+                               f"  SELECT DISTINCT p.mission, a.author_norm "
+                               f"  FROM pubs p CROSS JOIN authors a ON p.bibcode = a.bibcode "
+                               f"  WHERE {where}) "
+                               f"SELECT NULL, COUNT(DISTINCT author_norm) FROM pairs "
+                               f"UNION ALL "
+                               f"SELECT mission, COUNT(*) FROM pairs GROUP BY mission;",
+                               params)
+        for key, authors in cur.fetchall():
+            if key is None:
+                metrics['author_count'] = authors
+            elif key in missions:
+                metrics[f'{key}_author_count'] = authors
         for mission in missions:
-            metrics[f"{mission}_author_count"] = np.unique(authors[mission]).size
-            metrics[f"{mission}_first_author_count"] = np.unique(first_authors[mission]).size
+            metrics.setdefault(f'{mission}_author_count', 0)
+            metrics.setdefault(f'{mission}_first_author_count', 0)
 
         # Also compute fractions
         pubcount = metrics["publication_count"]
@@ -536,6 +2152,50 @@ class PublicationDB(object):
     
         return metrics
 
+    def get_cumulative_author_series(self, first_year, last_year):
+        """Returns the cumulative paper and unique author counts per year.
+
+        The publications from `first_year` through `last_year` are read once in
+        year order while the sets of authors seen so far are updated
+        incrementally, so the counts for year N equal those returned by
+        `get_metrics(year=[first_year, ..., N])`.
+
+        Returns
+        -------
+        series : dict
+            Lists keyed by 'year', 'publication_count', 'author_count' and
+            'first_author_count', one entry per year.
+        """
+        cur = self.con.execute("SELECT p.year, p.bibcode, p.first_author_norm, a.author_norm "
+                               "FROM pubs p LEFT JOIN authors a ON a.bibcode = p.bibcode "
+                               "WHERE p.mission != 'unrelated' AND p.year >= ? AND p.year <= ? "
+                               "ORDER BY p.year, p.bibcode;",
+                               [str(first_year), str(last_year)])
+        rows = iter(cur)
+        row = next(rows, None)
+
+        series = {'year': [], 'publication_count': [],
+                  'author_count': [], 'first_author_count': []}
+        papers = 0
+        authors, first_authors = set(), set()
+        last_bibcode = None
+        for year in range(first_year, last_year + 1):
+            while row is not None and int(row[0]) <= year:
+                _, bibcode, first_author, author = row
+                if bibcode != last_bibcode:
+                    papers += 1
+                    if first_author is not None:
+                        first_authors.add(first_author)
+                    last_bibcode = bibcode
+                if author is not None:
+                    authors.add(author)
+                row = next(rows, None)
+            series['year'].append(year)
+            series['publication_count'].append(papers)
+            series['author_count'].append(len(authors))
+            series['first_author_count'].append(len(first_authors))
+        return series
+
     def get_all(self, mission=None, science=None):
         """Returns a list of dictionaries, one entry per publication."""
         articles = self.query(mission=mission, science=science)
@@ -543,67 +2203,67 @@ class PublicationDB(object):
 
     def get_most_cited(self, mission=None, science=None, top=10):
         """Returns the most-cited publications."""
-        bibcodes, citations = [], []
-        articles = self.query(mission=mission, science=science)
-        for article in articles:
-            api_response = article[2]
-            js = json.loads(api_response)
-            bibcodes.append(article[3])
-            if js["citation_count"] is None:
-                citations.append(0)
-            else:
-                citations.append(js["citation_count"])
-        idx_top = np.argsort(citations)[::-1][0:top]
-        return [json.loads(articles[idx][2]) for idx in idx_top]
+        return self._get_top_by_column('citation_count', mission=mission, science=science, top=top)
 
     def get_most_read(self, mission=None, science=None, top=10):
-        """Returns the most-cited publications."""
-        bibcodes, citations = [], []
-        articles = self.query(mission=mission, science=science)
-        for article in articles:
-            api_response = article[2]
-            js = json.loads(api_response)
-            bibcodes.append(article[3])
-            citations.append(js["read_count"])
-        idx_top = np.argsort(citations)[::-1][0:top]
-        return [json.loads(articles[idx][2]) for idx in idx_top]
+        """Returns the most-read publications."""
+        return self._get_top_by_column('read_count', mission=mission, science=science, top=top)
+
+    def _get_top_by_column(self, column, mission=None, science=None, top=10):
+        """Returns the metadata of the publications with the highest value in a hot column."""
+        where, params = self._where(mission=mission, science=science)
+        cur = self.con.execute(f"SELECT metrics FROM pubs WHERE {where} "
+                               f"ORDER BY COALESCE({column}, 0) DESC, date DESC LIMIT ?;",
+                               params + [top])
+        return [json.loads(row[0]) for row in cur.fetchall()]
+
+    def _where(self, mission=None, science=None, year=None, prefix=''):
+        """Returns a parameterized WHERE clause matching the filtering done by `query`.
+
+        `prefix` is prepended to the column names, e.g. 'p.' when the pubs
+        table is aliased in a join.
+        """
+        if mission is None:
+            where, params = f"{prefix}mission != 'unrelated'", []
+        else:
+            where, params = f"{prefix}mission = ?", [mission]
+        if science is not None:
+            where += f" AND {prefix}science = ?"
+            params.append(science)
+        if year is not None:
+            years = year if isinstance(year, (list, tuple)) else [year]
+            where += f" AND {prefix}year IN ({', '.join('?' * len(years))})"
+            params += [str(y) for y in years]
+        return where, params
 
     def get_most_active_first_authors(self, min_papers=10):
         """Returns names and paper counts of the most active first authors."""
-        articles = self.query()
-        authors = {}
-        for article in articles:
-            api_response = article[2]
-            js = json.loads(api_response)
-            first_author = js["first_author_norm"]
-            try:
-                authors[first_author] += 1
-            except KeyError:
-                authors[first_author] = 1
-        names = np.array(list(authors.keys()))
-        paper_count = np.array(list(authors.values()))
-        idx_top = np.argsort(paper_count)[::-1]
-        mask = paper_count[idx_top] >= min_papers
-        return zip(names[idx_top], paper_count[idx_top[mask]])
+        cur = self.con.execute("SELECT first_author_norm, COUNT(*) AS n FROM pubs "
+                               "WHERE mission != 'unrelated' "
+                               "GROUP BY first_author_norm "
+                               "HAVING n >= ? "
+                               "ORDER BY n DESC;", [min_papers])
+        return cur.fetchall()
 
     def get_all_authors(self, top=20):
-        articles = self.query()
-        authors = {}
-        for article in articles:
-            api_response = article[2]
-            js = json.loads(api_response)
-            for auth in js["author_norm"]:
-                try:
-                    authors[auth] += 1
-                except KeyError:
-                    authors[auth] = 1
-        names = np.array(list(authors.keys()))
-        paper_count = np.array(list(authors.values()))
-        idx_top = np.argsort(paper_count)[::-1][:top]
-        return names[idx_top], paper_count[idx_top]
+        cur = self.con.execute("SELECT a.author_norm, COUNT(*) AS n "
+                               "FROM authors a JOIN pubs p ON p.bibcode = a.bibcode "
+                               "WHERE p.mission != 'unrelated' "
+                               "GROUP BY a.author_norm "
+                               "ORDER BY n DESC LIMIT ?;", [top])
+        rows = cur.fetchall()
+        names = np.array([row[0] for row in rows])
+        paper_count = np.array([row[1] for row in rows])
+        return names, paper_count
 
     def get_affiliation_counts(self, year_begin, year_end, mission):
+        """Returns the yearly counts of articles by the affiliation type of
+        their first author ('first author <type>') and of articles whose
+        first three authors share one type ('top3 authors <type>').
 
+        The types are materialized in the authors table at ingest, so this is
+        a single GROUP BY; they are reclassified first if aff_defs changed.
+        """
         #init data
         counts = {}
         aff_defs = self.config['aff_defs']
@@ -613,33 +2273,58 @@ class PublicationDB(object):
             for year in range(year_begin, year_end+1):
                 counts['first author '+affdef['type']][year] = 0
                 counts['top3 authors '+affdef['type']][year] = 0
-
-        #query
-        cur = self.con.execute("select year, metrics from pubs "
-                               f" where mission='{mission}' "
-                               f" and year >= '{year_begin}'"
-                               f" and year <= '{year_end}'"
-                               )
-        articles = cur.fetchall()
-
-        #for each article, get affiliations for first 3 authors for each article
-        for article in articles:
-            year = int(article[0])
-            metrics = json.loads(article[1])
-            num_affs = len(metrics['aff'])
-            affs = []
-            for i in range(0,3):
-                if num_affs > i:
-                    afftype = self.get_aff_type(metrics['aff'][i], aff_defs)
-                    if not afftype: continue
-                    affs.append(afftype)
-                    if i == 0:
-                        counts['first author '+afftype][year] += 1
-            if len(affs) == 3 and len(set(affs)) == 1:
-                counts['top3 authors '+afftype][year] += 1
+        self.update_aff_types()
+
+        #per article: first author type and the type shared by the first 3 authors, if any
+        cur = self.con.execute("""
+            SELECT year, first_type, CASE WHEN ntypes = 3 AND ndistinct = 1 THEN top_type END,
+                   COUNT(*)
+            FROM (SELECT p.year AS year,
+                         MAX(CASE WHEN a.position = 0 THEN NULLIF(a.aff_type, '') END) AS first_type,
+                         COUNT(NULLIF(a.aff_type, '')) AS ntypes,
+                         COUNT(DISTINCT NULLIF(a.aff_type, '')) AS ndistinct,
+                         MAX(NULLIF(a.aff_type, '')) AS top_type
+                  FROM pubs p JOIN authors a ON a.bibcode = p.bibcode AND a.position < 3
+                  WHERE p.mission = ? AND p.year >= ? AND p.year <= ?
+                  GROUP BY p.bibcode)
+            GROUP BY 1, 2, 3""", [mission, str(year_begin), str(year_end)])
+        for year, first_type, top3_type, count in cur:
+            if first_type:
+                counts['first author '+first_type][int(year)] += count
+            if top3_type:
+                counts['top3 authors '+top3_type][int(year)] += count
 
         return counts
 
+    def classify_aff(self, affstr):
+        """Returns the type of an affiliation string per the configured aff_defs,
+        or None if there are none."""
+        if not (self.config or {}).get('aff_defs'):
+            return None
+        return self.get_aff_classifier().classify(affstr)
+
+    def get_aff_defs_hash(self):
+        """Returns a hash of the configured aff_defs, stored alongside the affiliation types."""
+        aff_defs = (self.config or {}).get('aff_defs') or []
+        return hashlib.sha256(json.dumps(aff_defs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def update_aff_types(self, force=False):
+        """Reclassifies all author affiliations if aff_defs changed since they were
+        stored (or if `force`).  Returns True if the types were rebuilt."""
+        aff_hash = self.get_aff_defs_hash()
+        stored = self.con.execute("SELECT value FROM meta WHERE key = 'aff_defs_hash'").fetchone()
+        if not force and stored and stored[0] == aff_hash:
+            return False
+        log.info("Classifying author affiliations")
+        rows = self.con.execute("SELECT rowid, aff FROM authors").fetchall()
+        with self.con:
+            self.con.executemany("UPDATE authors SET aff_type = ? WHERE rowid = ?",
+                                 [[self.classify_aff(aff) if aff is not None else None, rowid]
+                                  for rowid, aff in rows])
+            self.con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aff_defs_hash', ?)",
+                             [aff_hash])
+        return True
+
     def get_aff_type(self, affstr, aff_defs):
         '''
         Search for institution strings in affiliation string.  Affiliation string
@@ -647,26 +2332,85 @@ class PublicationDB(object):
         array of preferred affiliation types.  Each type has an array of strings to
         search for.
         '''
-        #Sometimes the value is blank or "-"
-        if len(affstr.strip()) <= 2:
-            return None
+        return self.get_aff_classifier(aff_defs).classify(affstr)
 
-        default = ''
-        affs = affstr.split(";")
-        for affdef in aff_defs:
-            afftype = affdef['type']
-            if not affdef['strings']: 
-                default = afftype
+    def get_aff_classifier(self, aff_defs=None):
+        """Returns the `AffiliationClassifier` for `aff_defs` (default: from the config),
+        building it only when the definitions change."""
+        if aff_defs is None:
+            aff_defs = self.config['aff_defs']
+        if self.aff_classifier is None or self.aff_classifier.aff_defs != aff_defs:
+            self.aff_classifier = AffiliationClassifier(aff_defs)
+        return self.aff_classifier
+
+    def get_publication_counts(self, year_begin=2009, year_end=datetime.datetime.now().year,
+                               instruments=None, cumulative=False):
+        """Returns a year x mission (x instrument) matrix of publication counts.
+
+        All counts come from a single GROUP BY query.  Cumulative counts also
+        include the publications from before `year_begin`.
+
+        Parameters
+        ----------
+        year_begin, year_end : int
+            Range of years to count (inclusive).
+
+        instruments : list of str
+            If given, count the publications per instrument as well.  An
+            instrument matches if its name is contained in the pipe-delimited
+            instruments column.
+
+        cumulative : boolean
+            If `True`, return the running total up to and including each year.
+
+        Returns
+        -------
+        counts : dict
+            'years' (array), 'missions' (list), 'instruments' (list or None)
+            and 'counts', an int array of shape (missions, years) or
+            (missions, instruments, years).
+        """
+        missions = self.config.get('missions', [])
+        years = np.arange(year_begin, year_end + 1)
+
+        where = "p.year <= ?"
+        params = [str(year_end)]
+        if not cumulative:
+            where += " AND p.year >= ?"
+            params.append(str(year_begin))
+
+        if instruments:
+            values = ", ".join(["(?)"] * len(instruments))
+            cur = self.con.execute(f"SELECT p.year, p.mission, i.column1, COUNT(*) "
+                                   f"FROM pubs p JOIN (VALUES {values}) i "
+                                   f"ON p.instruments LIKE '%' || i.column1 || '%' "
+                                   f"WHERE {where} "
+                                   f"GROUP BY p.year, p.mission, i.column1;",
+                                   list(instruments) + params)
+            counts = np.zeros((len(missions), len(instruments), len(years)), dtype=int)
+        else:
+            cur = self.con.execute(f"SELECT p.year, p.mission, NULL, COUNT(*) FROM pubs p "
+                                   f"WHERE {where} "
+                                   f"GROUP BY p.year, p.mission;",
+                                   params)
+            counts = np.zeros((len(missions), len(years)), dtype=int)
+
+        for year, mission, instr, count in cur.fetchall():
+            if mission not in missions:
                 continue
-            for string in affdef['strings']:
-                for aff in affs:
-                    if string.isupper():
-                        if re.search(string, aff):
-                            return afftype
-                    else:
-                        if re.search(string, aff, re.IGNORECASE):
-                            return afftype                  
-        return default
+            # Earlier years only contribute to the cumulative starting value
+            idx = max(int(year) - year_begin, 0)
+            if instruments:
+                counts[missions.index(mission), instruments.index(instr), idx] += count
+            else:
+                counts[missions.index(mission), idx] += count
+
+        if cumulative:
+            counts = np.cumsum(counts, axis=-1)
+
+        return {'years': years, 'missions': missions,
+                'instruments': list(instruments) if instruments else None,
+                'counts': counts}
 
     def get_annual_publication_count(self, year_begin=2009, year_end=datetime.datetime.now().year,
                                      instrument=None):
@@ -680,29 +2424,10 @@ class PublicationDB(object):
         year_end : int
             Year to end counting. (default: current year)
         """
-        # Initialize a dictionary to contain the data to plot
-        result = {}
-        missions = self.config.get('missions', [])
-        for mission in missions:
-            result[mission] = {}
-            for year in range(year_begin, year_end + 1):
-                result[mission][year] = 0
-            q = "SELECT year, COUNT(*) FROM pubs "
-            q += f" WHERE mission = '{mission}' "
-            q += f" AND year >= '{year_begin}' "
-            if instrument: 
-                q += f" AND instruments like '%{instrument}%' "
-            q += " GROUP BY year;"
-            cur = self.con.execute(q)
-            rows = list(cur.fetchall())
-            for row in rows:
-                if int(row[0]) <= year_end:
-                    result[mission][int(row[0])] = row[1]
-        # Also combine counts
-        result['both'] = {}
-        for year in range(year_begin, year_end + 1):
-            result['both'][year] = sum(result[mission][year] for mission in missions)
-        return result
+        instruments = [instrument] if instrument else None
+        data = self.get_publication_counts(year_begin, year_end, instruments=instruments)
+        counts = data['counts'][:, 0, :] if instrument else data['counts']
+        return counts_to_dict(data['years'], data['missions'], counts)
 
     def get_annual_publication_count_cumulative(self, year_begin=2009, year_end=datetime.datetime.now().year):
         """Returns a dict containing the cumulative number of publications per year per mission.
@@ -715,28 +2440,27 @@ class PublicationDB(object):
         year_end : int
             Year to end counting. (default: current year)
         """
-        # Initialize a dictionary to contain the data to plot
-        result = {}
-        missions = self.config.get('missions', [])
-        for mission in missions:
-            result[mission] = {}
-            for year in range(year_begin, year_end + 1):
-                cur = self.con.execute("SELECT COUNT(*) FROM pubs "
-                                       "WHERE mission = ? "
-                                       "AND year <= ?;",
-                                       [mission, str(year)])
-                result[mission][year] = cur.fetchone()[0]
-        # Also combine counts
-        result['both'] = {}
-        for year in range(year_begin, year_end + 1):
-            result['both'][year] = sum(result[mission][year] for mission in missions)
-        return result
+        data = self.get_publication_counts(year_begin, year_end, cumulative=True)
+        return counts_to_dict(data['years'], data['missions'], data['counts'])
 
-    def update(self, month=None):
+    def update(self, month=None, auto=False, full=False):
         """
-        Query ADS for new publications.
+        Query ADS for new publications and review them.
+
+        The candidates are first saved in the review queue, so an interrupted
+        session can be resumed with `review` without querying ADS again.
+
+        Each query only requests the articles ADS indexed since the newest
+        `indexstamp` seen by its previous run for the same `month`.  Without a
+        month, that includes late-indexed articles of any publication date; the
+        first such run of a query covers the current month.
+
         Parameters:
             month (str): Used for ADS pubdate param. Format "YYYY-MM" or "YYYY".
+            auto (bool): Classify the articles the model trained on the database
+                is confident about without prompting; only the others are shown.
+            full (bool): Fetch every article of the month (default: current month)
+                rather than only those indexed since the queries were last run.
         """
         # # git pull reminder
         # print(HIGHLIGHTS['YELLOW'] +
@@ -747,46 +2471,186 @@ class PublicationDB(object):
         # if input() == 'n':
         #     return
 
-        #Assume current month if not supplied.
-        #NOTE: We use the term "month" but user can supply just the year to do a whole year.
-        if month is None:
-            month = datetime.datetime.now().strftime("%Y-%m")
-
         #query 1
         queries = self.config.get('ads_queries')
         for query in queries:
-            log.info(f"\nQuerying {query['name']} (date={month})")
-            data = self.query_ads(query['query'], month)
-            tmp_articles = data['response']['docs'] 
+            queued = self.harvest(query, month, full=full)
+            log.info(f"Queued {queued} new articles for review.")
+
+        self.review(auto=auto)
 
-            #remove those already in our db
-            articles = []
-            for a in tmp_articles:
-                if self.article_exists(a): print(f"SKIPPING {a['bibcode']} already in DB.")
-                else: articles.append(a)
+        #all done
+        log.info(f'\nFinished reviewing all articles for {month or "this update"}.')
+        self.push_reminder()
 
-            #loop and add
-            for idx, article in enumerate(articles):
 
-                # Ignore articles without abstract
-                if not article.get('abstract'):
-                    continue
+    def harvest(self, query, month=None, full=False):
+        """Fetches the candidate articles of an ADS `query` into the review queue.
 
-                # Ignore proposals, cospar abstracts and tmp articles
-                bibcode = article['bibcode']
-                if ".prop." in bibcode or "cosp.." in bibcode or ".tmp" in bibcode:
-                    continue
+        Unless `full`, only articles indexed by ADS since the newest indexstamp
+        seen by the last harvest of the query for `month` are requested (see
+        `update`).  Articles already queued, whether pending, skipped or
+        classified, are not queued again.  The harvest is a single transaction
+        and its watermark is only moved once every page has been read.
+
+        Returns:
+            int: Number of articles queued.
+        """
+        #NOTE: We use the term "month" but user can supply just the year to do a whole year.
+        row = self.con.execute("SELECT indexstamp FROM harvests WHERE query = ? AND pubdate = ?",
+                               [query['query'], month or '']).fetchone()
+        watermark = row[0] if row and not full else None
+        pubdate = month
+        if pubdate is None and watermark is None:
+            #Assume current month if there is nothing to continue from.
+            pubdate = datetime.datetime.now().strftime("%Y-%m")
+        if watermark:
+            log.info(f"\nQuerying {query['name']} (date={pubdate or 'any'}, indexed since {watermark})")
+        else:
+            log.info(f"\nQuerying {query['name']} (date={pubdate})")
+
+        harvested = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+        newest = watermark
+        queued = 0
+        with self.con:
+            for data in self.query_ads_pages(query['query'], pubdate, indexed_since=watermark):
+                stamps = [doc['indexstamp'] for doc in data['response']['docs'] if doc.get('indexstamp')]
+                newest = max(stamps + ([newest] if newest else []), default=None)
+                rows = [(article['bibcode'], query['name'], json.dumps(article),
+                         json.dumps(highlights), harvested)
+                        for article, highlights in self.get_candidates(data)]
+                cur = self.con.executemany("""INSERT OR IGNORE INTO review_queue
+                                              (bibcode, query, article, highlights, fetched)
+                                              VALUES (?, ?, ?, ?, ?)""", rows)
+                queued += max(cur.rowcount, 0)
+            self.con.execute("INSERT OR REPLACE INTO harvests (query, pubdate, harvested, indexstamp) "
+                             "VALUES (?, ?, ?, ?)", [query['query'], month or '', harvested, newest])
+        return queued
+
+
+    def get_candidates(self, data):
+        """Returns the (article, highlights) pairs of a page of ADS results which
+        should be shown for review.
+
+        Articles already in the database are found with one query per page.
+        """
+        docs = data['response']['docs']
+        existing = self.get_existing(docs)
+        candidates = []
+        skipped = 0
+        for article in docs:
+
+            #skip those already in our db
+            if article['bibcode'] in existing or article['id'] in existing:
+                skipped += 1
+                continue
+
+            # Ignore articles without abstract
+            if not article.get('abstract'):
+                continue
+
+            # Ignore proposals, cospar abstracts and tmp articles
+            bibcode = article['bibcode']
+            if ".prop." in bibcode or "cosp.." in bibcode or ".tmp" in bibcode:
+                continue
+
+            candidates.append((article, data['highlighting'][article['id']]))
+        if skipped:
+            print(f"SKIPPING {skipped} articles already in DB.")
+        return candidates
+
+
+    def review(self, auto=False, skipped=False):
+        """
+        Prompts for the classification of the articles in the review queue, oldest first.
+
+        Nothing is requested from ADS other than PDFs.  Articles skipped with an
+        empty answer stay queued as 'skipped' and are only shown again if `skipped`.
+
+        Parameters:
+            auto (bool): Classify the articles the model trained on the database
+                is confident about without prompting; only the others are shown.
+            skipped (bool): Also show the articles skipped before.
+        """
+        states = ['pending', 'skipped'] if skipped else ['pending']
+        rows = self.con.execute(f"""SELECT bibcode, query, article, highlights FROM review_queue
+                                    WHERE state IN ({','.join('?' * len(states))})
+                                    ORDER BY rowid""", states).fetchall()
+        if not rows:
+            log.info("\nNo articles awaiting review.")
+            return
+
+        classifier = self.get_article_classifier() if auto else None
+        verdicts = collections.Counter()
+
+        #While an article is being reviewed, the PDFs of the next few are
+        #downloaded and scanned in the background.  Those about to be rejected
+        #automatically are not needed.
+        depth = self.config.get('prefetch_depth', PREFETCH_DEPTH)
+        if depth:
+            self.get_scanner()
+            self.prefetcher = Prefetcher(self.compute_analysis, min(depth, PREFETCH_MAX_WORKERS))
+
+        def prefetch(candidate):
+            article = candidate[1]
+            if classifier is None or classifier.classify(article)[0] != 'reject':
+                self.prefetcher.submit(article['bibcode'])
+
+        candidates = ((query, json.loads(article), json.loads(highlights))
+                      for _, query, article, highlights in rows)
+        if self.prefetcher is not None:
+            candidates = lookahead(candidates, depth, prefetch)
+
+        #Classified articles are written in batches, and whatever is pending is
+        #still saved if the session is interrupted.
+        pending = []
+        def flush():
+            self.add_many(pending)
+            self.set_queue_state([article['bibcode'] for article in pending], 'classified')
+            pending.clear()
+
+        try:
+            for idx, (query, article, highlights) in enumerate(candidates, 1):
+                if classifier is not None:
+                    verdict = self.add_automatically(article, classifier, pending=pending)
+                    verdicts[verdict] += 1
+                    if verdict != 'review':
+                        continue
 
                 # Propose to the user
                 statusmsg = ("\n\n\n\n\n\n********** "
-                    f"Showing article {idx+1} out of {len(articles)} ({query['name']} query)"
+                    f"Showing article {idx} out of {len(rows)} ({query} query)"
                     " **********\n")
-                highlights = data['highlighting'][article['id']]
-                self.add_interactively(article, statusmsg=statusmsg, highlights=highlights)
-
-        #all done
-        log.info(f'\nFinished reviewing all articles for {month}.')
-        self.push_reminder()
+                mission = self.add_interactively(article, statusmsg=statusmsg, highlights=highlights,
+                                                 pending=pending)
+                if mission == '':
+                    self.set_queue_state([article['bibcode']], 'skipped')
+                elif mission is None:
+                    self.set_queue_state([article['bibcode']], 'classified')
+                if len(pending) >= self.batch_size:
+                    flush()
+        finally:
+            flush()
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+                self.prefetcher = None
+
+        if classifier is not None:
+            log.info(f"\nAuto-classified {verdicts['accept']} accepted, {verdicts['reject']} rejected, "
+                     f"{verdicts['review']} sent for review.")
+
+
+    def set_queue_state(self, bibcodes, state):
+        """Marks queued articles as 'pending', 'skipped' or 'classified'.
+
+        The stored ADS record of classified articles is no longer needed and is dropped.
+        """
+        if state == 'classified':
+            sql_update = "UPDATE review_queue SET state = ?, article = NULL, highlights = NULL WHERE bibcode = ?"
+        else:
+            sql_update = "UPDATE review_queue SET state = ? WHERE bibcode = ?"
+        with self.con:
+            self.con.executemany(sql_update, [(state, bibcode) for bibcode in bibcodes])
 
 
     def push_reminder(self):
@@ -796,10 +2660,9 @@ class PublicationDB(object):
 
 
     def open_pdf(self, bibcode):
-        '''Open PDF file in local browser.  Download if necessary.'''
-        key = self.config.get('ADS_API_KEY')
-        outfile = get_pdf_file(bibcode, key)
-        if os.path.isfile(outfile):
+        '''Open PDF file in local browser.  Download if it is not in the document cache.'''
+        outfile = get_pdf_file(bibcode, self.ads, self.documents, view=True)
+        if outfile and os.path.isfile(outfile):
             print(f"Opening {outfile}...")
             webbrowser.open('file://' + os.path.realpath(outfile))
             #webbrowser.get('firefox').open_new_tab('file://' + os.path.realpath(outfile))
@@ -807,39 +2670,152 @@ class PublicationDB(object):
     def query_ads(self, query, pubdate=None):
         '''
         Query ADS API.  Add in standard params needed for data store and text highlights.
+        All result pages are fetched and merged into a single response dict; use
+        `query_ads_pages` to process large result sets page by page.
 
         Parameters:
             query (str): An ADS compliant query string (exactly what is entered in web search GUI.)
             date (str): Optional ADS pubdate param. YYYY-MM or YYYY. Ex: "2019-03", "2020"
         '''
+        data = {'response': {'numFound': 0, 'docs': []}, 'highlighting': {}}
+        for page in self.query_ads_pages(query, pubdate):
+            data['response']['numFound'] = page['response']['numFound']
+            data['response']['docs'] += page['response']['docs']
+            data['highlighting'].update(page.get('highlighting', {}))
+        return data
+
+    def query_ads_pages(self, query, pubdate=None, rows=ADS_PAGE_SIZE, indexed_since=None):
+        '''
+        Generator which queries the ADS API one page of `rows` results at a time
+        and yields each page's response dict as it arrives.
+
+        Pages are walked with ADS's cursorMark, which requires the sort to end
+        on the unique id field.  If the server does not return a nextCursorMark,
+        the start offset is advanced instead.
+
+        Parameters:
+            query (str): An ADS compliant query string (exactly what is entered in web search GUI.)
+            date (str): Optional ADS pubdate param. YYYY-MM or YYYY. Ex: "2019-03", "2020"
+            rows (int): Number of articles per page.
+            indexed_since (str): Optional ADS indexstamp, e.g. "2020-03-01T12:00:00.000Z";
+                only articles indexed since then are returned.
+        '''
 
         query = query.replace(' ', '+')
         query = query.replace('"', '%22')
         if pubdate: query += f"+pubdate:{pubdate}"
+        if indexed_since: query += f"+indexstamp:[{indexed_since}+TO+*]"
 
         fl = ','.join(FIELDS)
         url = (f'{ADS_API}'
             f'q={query}'
             f"&fl={fl}"
-            "&sort=date+asc"
+            "&sort=date+asc,id+asc"
             "&hl=true"
             "&hl.fl=ack,body,title,abstract"
             "&hl.snippets=4"
             "&hl.fragsize=100"
             "&hl.maxAnalyzedChars=500000"
-            "&rows=9999999"
+            f"&rows={rows}"
         )
-        key = self.config.get('ADS_API_KEY')
-        headers = {'Authorization': f'Bearer {key}'}
-        r = requests.get(url, headers=headers)
-        data = r.json()
-        return data
+        cursor, start = '*', 0
+        while True:
+            if cursor is not None:
+                page_url = url + f"&cursorMark={urllib.parse.quote(cursor)}"
+            else:
+                page_url = url + f"&start={start}"
+            r = self.ads.get(page_url)
+            r.raise_for_status()
+            data = r.json()
+            docs = data['response']['docs']
+            yield data
+
+            start += len(docs)
+            if not docs or start >= data['response']['numFound']:
+                break
+            if cursor is not None:
+                next_cursor = data.get('nextCursorMark')
+                if next_cursor == cursor:
+                    break
+                cursor = next_cursor
 
 
 ##################
 # Helper functions
 ##################
 
+def fingerprint(*parts):
+    """Returns a sha256 hex digest of json-serializable `parts`."""
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_file_size(path):
+    """Returns the size of a file in bytes, or 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def get_plot_code_hash():
+    """Returns a sha256 hex digest of the plotting code, which also sets the plot style."""
+    with open(plot.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_plot_outputs(kwargs):
+    """Returns the files written by a plot function called with `kwargs`."""
+    if 'formats' in kwargs:
+        return [f"{kwargs['output_fn']}.{fmt}" for fmt in kwargs['formats']]
+    # Bokeh plots write one html file per mission
+    return [f"{kwargs['output_fn']}-{mission}.html" for mission in kwargs['missions']]
+
+
+def counts_to_dict(years, missions, counts):
+    """Converts a (missions, years) count array into the nested {mission: {year: count}}
+    dicts returned by the get_annual_publication_count methods, plus a 'both' total."""
+    result = {}
+    for i, mission in enumerate(missions):
+        result[mission] = {int(year): int(count) for year, count in zip(years, counts[i])}
+    total = counts.sum(axis=0) if len(missions) else np.zeros(len(years), dtype=int)
+    result['both'] = {int(year): int(count) for year, count in zip(years, total)}
+    return result
+
+
+def get_hot_values(article):
+    """Returns the values of the HOT_COLUMNS fields for an ADS article dict."""
+    try:
+        refereed = 1 if "REFEREED" in article['property'] else 0
+    except (KeyError, TypeError):  # property is None
+        refereed = 0
+    return [article.get('citation_count'),
+            article.get('read_count'),
+            refereed,
+            article.get('first_author_norm'),
+            article.get('pub'),
+            article.get('doctype')]
+
+
+def get_author_rows(article, classify_aff=None):
+    """Returns (bibcode, position, author, author_norm, aff, aff_type) rows for an ADS article dict.
+
+    `classify_aff` maps an affiliation string to its type; without it aff_type is None.
+    """
+    authors = article.get('author') or []
+    norms = article.get('author_norm') or []
+    affs = article.get('aff') or []
+    rows = []
+    for i in range(max(len(authors), len(norms))):
+        aff = affs[i] if i < len(affs) else None
+        rows.append([article['bibcode'], i,
+                     authors[i] if i < len(authors) else None,
+                     norms[i] if i < len(norms) else None,
+                     aff,
+                     classify_aff(aff) if classify_aff and aff is not None else None])
+    return rows
+
+
 def highlight_text(text, colors):
 
     for word, color in colors.items():
@@ -894,83 +2870,187 @@ def display_abstract(article_dict, colors, highlights=None):
     print('')
 
 
-def get_word_match_counts_by_query(bibcode, words, ads_api_key):
+def get_word_match_counts_by_query(bibcode, words, ads):
+    """Counts the full-text matches of each word in an article using the ADS highlights.
 
-    bibcode = bibcode.replace('&', '%26')
-
-    counts = {}
-    for word in words:
-        word = word.replace(' ', '+')
-        url = (f'{ADS_API}' 
-            f'q=bibcode:%22{bibcode}%22+full:%22{word}%22'
-            "&fl=id,bibcode"
-            "&sort=date+asc"
-            "&hl=true"
-            "&hl.fl=ack,body,title,abstract"
-            "&hl.snippets=4"
-            "&hl.fragsize=100"
-            "&hl.maxAnalyzedChars=500000"
-        )
-        headers = {'Authorization': f'Bearer {ads_api_key}'}
-        r = requests.get(url, headers=headers)
-        data = r.json()
-        counts[word] = {'count': 0, 'snippets': []}
-        for doc in data['response']['docs']:
-            id = doc['id']
-            highlights = data['highlighting'][id]
-            for field, snippets in highlights.items():
-                for snippet in snippets:
+    All words are OR'ed into a single ADS query and each returned highlight
+    snippet is attributed to the words emphasized in it.  If the combined
+    query fails, the words are queried individually, concurrently.
+    """
+    try:
+        terms = [f'full:%22{word.replace(" ", "+")}%22' for word in words]
+        highlights = get_highlights(bibcode, "(" + "+OR+".join(terms) + ")", ads,
+                                    snippets=min(4 * len(words), 100))
+        counts = {word: {'count': 0, 'snippets': []} for word in words}
+        for snippet in highlights:
+            for word in words:
+                if highlight_matches(snippet, word):
                     counts[word]['count'] += 1
                     counts[word]['snippets'].append(snippet)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        log.warning(f"Combined full-text query failed ({e}), querying each word")
+        counts = get_word_match_counts_by_query_concurrent(bibcode, words, ads)
 
     #only return counts > 0
     counts = {key:val for key, val in counts.items() if val['count'] != 0}
     return counts
- 
 
-def get_word_match_counts_by_pdf(bibcode, words, ads_api_key):
 
-    #get pdf file and text
-    outfile = get_pdf_file(bibcode, ads_api_key)
-    text = get_pdf_text(outfile).lower()
+def get_word_match_counts_by_query_concurrent(bibcode, words, ads, max_workers=8):
+    """Counts the full-text matches of each word with one ADS query per word, run in a thread pool."""
+    def count_word(word):
+        snippets = get_highlights(bibcode, f'full:%22{word.replace(" ", "+")}%22', ads)
+        return {'count': len(snippets), 'snippets': snippets}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(count_word, words)
+        return dict(zip(words, results))
+
+
+def get_highlights(bibcode, query, ads, snippets=4):
+    """Returns the ADS highlight snippets of one article for a full-text query."""
+    bibcode = bibcode.replace('&', '%26')
+    url = (f'{ADS_API}' 
+        f'q=bibcode:%22{bibcode}%22+{query}'
+        "&fl=id,bibcode"
+        "&sort=date+asc"
+        "&hl=true"
+        "&hl.fl=ack,body,title,abstract"
+        f"&hl.snippets={snippets}"
+        "&hl.fragsize=100"
+        "&hl.maxAnalyzedChars=500000"
+    )
+    r = ads.get(url)
+    r.raise_for_status()
+    data = r.json()
+    found = []
+    for doc in data['response']['docs']:
+        id = doc['id']
+        highlights = data['highlighting'][id]
+        for field, field_snippets in highlights.items():
+            found += field_snippets
+    return found
+
+
+def highlight_matches(snippet, word):
+    """Does an ADS highlight snippet contain an emphasized match of `word`?
+
+    ADS wraps each matched token in <em> tags, so a word matches if its
+    first token is emphasized and the whole word appears in the text.
+    """
+    emphasized = [em.lower() for em in re.findall(r'<em>(.*?)</em>', snippet)]
+    first = word.split()[0].lower()
+    if first not in emphasized:
+        return False
+    text = snippet.replace('<em>', '').replace('</em>', '').lower()
+    return word.lower() in text
+
+
+def get_word_match_counts_by_pdf(bibcode, words, ads, documents=None, scanner=None):
+    """Counts the matches of `words` in the text of an article's PDF.
+
+    `scanner` is a `WordScanner` for `words`; pass one to avoid rebuilding it
+    for every article.
+    """
+    #get pdf text, from the document cache if possible
+    text = documents.get_text(bibcode) if documents else None
+    if text is None:
+        outfile = get_pdf_file(bibcode, ads, documents)
+        try:
+            text = get_pdf_text(outfile)
+        finally:
+            if documents and outfile and os.path.isfile(outfile):
+                os.remove(outfile)
+        if documents:
+            documents.put_text(bibcode, text)
+
+    #count up matches, returning only counts > 0
+    scanner = scanner or WordScanner(words)
+    return scanner.count(clean_pdf_text(text))
+
+
+def clean_pdf_text(text):
+    """Lower-cases extracted PDF text and replaces line breaks and non-ASCII characters by spaces."""
+    text = text.lower()
     text = text.replace("\n",' ')
     text = text.replace("\r",' ')
-    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\xff]', ' ', text)
-
-    #count up matches
-    counts = {}
-    for word in words:
-        counts[word] = {'count': 0, 'snippets': []}
-        for ch in (' ', '/', '\(', '-', ':'):
-            find = f"{ch}{word}".lower()
-            for m in re.finditer(find, text):
-                    snippet = text[m.start()-80:m.end()+80]
-                    counts[word]['count'] += 1
-                    counts[word]['snippets'].append(snippet)
+    return re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\xff]', ' ', text)
 
-    #only return counts > 0
-    counts = {key:val for key, val in counts.items() if val['count'] != 0}
-    return counts
-  
 
-def get_pdf_file(bibcode, ads_api_key):
+def get_pdf_file(bibcode, ads, documents=None, view=False):
+    """Returns the path of a local copy of an article's PDF, or False.
+
+    With a `DocumentCache` the PDF is taken from, or added to, the cache.  For
+    viewing (`view`) the cache's reusable copy is returned; otherwise the PDF
+    is written to a temporary file for text extraction, which the caller
+    removes.
+    """
+    if documents:
+        outfile = documents.get_view_file(bibcode) if view else None
+        if outfile:
+            return outfile
+        content = documents.get_pdf(bibcode)
+        if content is None:
+            content = download_pdf(bibcode, ads)
+            if not content:
+                return False
+            documents.put_pdf(bibcode, content)
+        if view:
+            return documents.get_view_file(bibcode) or False
+        fd, outfile = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        return outfile
 
     outfile = f'/tmp/{bibcode}.pdf'
     #outfile = f'/home/jriley/temp/{bibcode}.pdf'
     if os.path.isfile(outfile):
         return outfile
+    content = download_pdf(bibcode, ads)
+    if not content:
+        return False
+    with open(outfile, 'wb') as f:
+         f.write(content)
+    return outfile
+
+
+def notify(*args):
+    """Prints a progress message, or only logs it when called from a prefetch worker."""
+    if threading.current_thread().name.startswith('kpub-prefetch'):
+        log.debug(' '.join(str(arg).strip() for arg in args))
+    else:
+        print(*args)
+
 
-    print('\nRetrieving PDF (May take up to a minute)...')
+def lookahead(items, depth, callback):
+    """Generator yielding `items` after calling `callback` on each of the next `depth` ones.
+
+    When item N is yielded, `callback` has been called for items up to N+depth.
+    """
+    window = collections.deque()
+    for item in items:
+        callback(item)
+        window.append(item)
+        if len(window) > depth:
+            yield window.popleft()
+    while window:
+        yield window.popleft()
+
+
+def download_pdf(bibcode, ads):
+    """Downloads an article's PDF and returns its content, or False."""
+    notify('\nRetrieving PDF (May take up to a minute)...')
     url = f'https://ui.adsabs.harvard.edu/link_gateway/{bibcode}/EPRINT_PDF'
     #url = f'https://ui.adsabs.harvard.edu/link_gateway/{bibcode}/PUB_PDF'
-    headers = {f'Authorization': f'Bearer {ads_api_key}'}
-    r = requests.get(url, headers=headers)
+    try:
+        r = ads.get(url, timeout=ADS_PDF_TIMEOUT, retries=ADS_PDF_RETRIES)
+    except requests.RequestException as e:
+        notify(f"Could not download PDF file: {e}")
+        return False
     if r.status_code != 200 or len(r.content) < 1000:
-        print("Could not download PDF file.")
+        notify("Could not download PDF file.")
         return False
-    with open(outfile, 'wb') as f:
-         f.write(r.content)
-    return outfile
+    return r.content
 
 
 def get_pdf_text(outfile):
@@ -983,7 +3063,7 @@ def get_pdf_text(outfile):
             text = text.decode("utf-8")
             if text: return text
         except Exception as e:
-            print(f"textract: {method} method failed.  Trying another method...")
+            notify(f"textract: {method} method failed.  Trying another method...")
     if not text:
         raise Exception("Could not extract PDF text")
 
@@ -1037,6 +3117,8 @@ def kpub_stats(args=None):
                         help="Only show a particular mission. Defaults to all.")
     parser.add_argument('-m', '--month', action='store_true',
                         help='Group the papers by month rather than year.')
+    parser.add_argument('--force', action='store_true',
+                        help="Save all files, even those whose publications did not change.")
     args = parser.parse_args(args)
 
     config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
@@ -1044,6 +3126,21 @@ def kpub_stats(args=None):
 
     pubdb = PublicationDB(args.f, config)
 
+    #only rewrite files whose publications, settings or template changed
+    manifest = BuildManifest(f"{MDDIR}/.kpub-manifest.json")
+    templatedir = os.path.join(PACKAGEDIR, 'templates')
+    def is_current(output_fn, data_hash, template, **kwargs):
+        with open(os.path.join(templatedir, template), 'rb') as f:
+            template_hash = hashlib.sha256(f.read()).hexdigest()
+        hash = fingerprint(data_hash, template_hash, config, kwargs)
+        if not args.force and manifest.is_current(output_fn, hash, [output_fn]):
+            log.info(f"Skipping {output_fn}: unchanged")
+            return True
+        manifest.record(output_fn, hash)
+        return False
+
+    #the lists and overview statistics are all built from one scan of the publications
+    builder = ReportBuilder(pubdb)
     for bymonth in [True, False]:
         if bymonth:
             suffix = "-by-month"
@@ -1053,46 +3150,57 @@ def kpub_stats(args=None):
             title_suffix = ""
 
         output_fn = f"{MDDIR}/kpub-{config['prepend']}-publications{suffix}.md"
-        pubdb.save_markdown(output_fn,
-                         group_by_month=bymonth,
-                         title=f"{title} publications{title_suffix}")
+        if not is_current(output_fn, pubdb.get_fingerprint(), 'template.md', group_by_month=bymonth):
+            builder.add_markdown(output_fn,
+                                 group_by_month=bymonth,
+                                 title=f"{title} publications{title_suffix}")
 
         sciences = config.get('sciences', [])
         if len(sciences) > 1:
             for science in sciences:
                 output_fn = f"{MDDIR}/kpub-{config['prepend']}-publications-{science}{suffix}.md"
-                pubdb.save_markdown(output_fn,
-                                 group_by_month=bymonth,
-                                 science=science,
-                                 title=f"{title} {science} publications{title_suffix}")
+                if is_current(output_fn, pubdb.get_fingerprint(science=science), 'template.md',
+                              group_by_month=bymonth):
+                    continue
+                builder.add_markdown(output_fn,
+                                     group_by_month=bymonth,
+                                     science=science,
+                                     title=f"{title} {science} publications{title_suffix}")
 
         missions = config.get('missions', [])
         if len(missions) > 1:
             for mission in missions:
                 output_fn = f"{MDDIR}/kpub-{config['prepend']}-publications-{mission}{suffix}.md"
-                pubdb.save_markdown(output_fn,
-                                 group_by_month=bymonth,
-                                 mission=mission,
-                                 title=f"{mission.capitalize()} publications{title_suffix}")
+                if is_current(output_fn, pubdb.get_fingerprint(mission=mission), 'template.md',
+                              group_by_month=bymonth):
+                    continue
+                builder.add_markdown(output_fn,
+                                     group_by_month=bymonth,
+                                     mission=mission,
+                                     title=f"{mission.capitalize()} publications{title_suffix}")
 
     # Finally, produce an overview page
-    templatedir = os.path.join(PACKAGEDIR, 'templates')
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(templatedir))
-    template = env.get_template('template-overview.md')
-    markdown = template.render(institution=title,
-                               metrics=pubdb.get_metrics(),
-                               most_cited=pubdb.get_most_cited(top=20),
-                               most_active_first_authors=pubdb.get_most_active_first_authors(),
-                               now=datetime.datetime.now())
-    # most_read=pubdb.get_most_read(20),
     filename = f'{MDDIR}/publications-overview.md'
-    log.info('Writing {}'.format(filename))
-    f = open(filename, 'w')
-    if sys.version_info >= (3, 0):
-        f.write(markdown)  # Python 3
-    else:
-        f.write(markdown.encode("utf-8"))  # Legacy Python
-    f.close()
+    overview = not is_current(filename, pubdb.get_fingerprint(), 'template-overview.md')
+    if builder.writers or overview:
+        stats = builder.run(overview=overview, top=20)
+    if overview:
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(templatedir))
+        template = env.get_template('template-overview.md')
+        markdown = template.render(institution=title,
+                                   metrics=stats['metrics'],
+                                   most_cited=stats['most_cited'],
+                                   most_active_first_authors=stats['most_active_first_authors'],
+                                   now=datetime.datetime.now())
+        # most_read=pubdb.get_most_read(20),
+        log.info('Writing {}'.format(filename))
+        f = open(filename, 'w')
+        if sys.version_info >= (3, 0):
+            f.write(markdown)  # Python 3
+        else:
+            f.write(markdown.encode("utf-8"))  # Legacy Python
+        f.close()
+    manifest.save()
 
     pubdb.push_reminder()
 
@@ -1103,11 +3211,17 @@ def kpub_plot(args=None):
     parser.add_argument('-f', metavar='dbfile',
                         type=str, default=DEFAULT_DB,
                         help="Location of the publication list db. Defaults to ~/.kpub.db.")
+    parser.add_argument('--only', nargs='+', metavar='name',
+                        help="Only save these plots, e.g. 'piechart' or 'publication-rate*'.")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help="Number of plots to render in parallel. Defaults to the number of CPUs.")
+    parser.add_argument('--force', action='store_true',
+                        help="Save all plots, even those whose data did not change.")
     args = parser.parse_args(args)
 
     config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
     pubdb = PublicationDB(args.f, config)
-    pubdb.plot()
+    pubdb.plot(only=args.only, jobs=args.jobs, force=args.force)
     pubdb.push_reminder()
 
 
@@ -1119,12 +3233,40 @@ def kpub_update(args=None):
                         type=str, default=DEFAULT_DB,
                         help="Location of the publication list db. Defaults to ~/.kpub.db.")
     parser.add_argument('month', nargs='?', default=None,
-                        help='Month to query, YYYY-MM or YYYY. e.g. "2015-06" or "2020"')
+                        help='Month to query, YYYY-MM or YYYY. e.g. "2015-06" or "2020". '
+                             'Defaults to all articles indexed by ADS since the last update.')
+    parser.add_argument('--auto', action='store_true',
+                        help="Accept or reject the articles a model trained on the database "
+                             "is confident about and only prompt for the rest.")
+    parser.add_argument('--full', action='store_true',
+                        help="Fetch all articles of the month (default: current month), "
+                             "not only those indexed by ADS since the last update.")
     args = parser.parse_args(args)
 
     config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
 
-    PublicationDB(args.f, config).update(month=args.month)
+    PublicationDB(args.f, config).update(month=args.month, auto=args.auto, full=args.full)
+
+
+def kpub_review(args=None):
+    """Classify the queued candidate articles without querying ADS."""
+    parser = argparse.ArgumentParser(
+        description="Classify the candidate articles queued by `kpub update` without querying ADS.")
+    parser.add_argument('-f', metavar='dbfile',
+                        type=str, default=DEFAULT_DB,
+                        help="Location of the publication list db. Defaults to ~/.kpub.db.")
+    parser.add_argument('--auto', action='store_true',
+                        help="Accept or reject the articles a model trained on the database "
+                             "is confident about and only prompt for the rest.")
+    parser.add_argument('--skipped', action='store_true',
+                        help="Also show the articles skipped before.")
+    args = parser.parse_args(args)
+
+    config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
+
+    db = PublicationDB(args.f, config)
+    db.review(auto=args.auto, skipped=args.skipped)
+    db.push_reminder()
 
 
 def kpub_add(args=None):
@@ -1163,12 +3305,60 @@ def kpub_delete(args=None):
         db.delete_by_bibcode(bibcode)
 
 
+def kpub_affiliations(args=None):
+    """Reclassifies the stored author affiliation types after aff_defs changed."""
+    parser = argparse.ArgumentParser(
+        description="Reclassifies author affiliations if aff_defs changed since they were stored.")
+    parser.add_argument('-f', metavar='dbfile',
+                        type=str, default=DEFAULT_DB,
+                        help="Location of the publication list db. Defaults to ~/.kpub.db.")
+    parser.add_argument('--force', action='store_true',
+                        help="Reclassify even if aff_defs did not change.")
+    args = parser.parse_args(args)
+
+    config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
+
+    db = PublicationDB(args.f, config)
+    if db.update_aff_types(force=args.force):
+        print("Reclassified author affiliations.")
+    else:
+        print("Affiliation types are up to date.")
+
+
+def kpub_cache(args=None):
+    """Shows the size of, or prunes, the local PDF and text cache."""
+    parser = argparse.ArgumentParser(
+        description="Shows statistics of, or prunes, the local PDF and extracted-text cache.")
+    parser.add_argument('action', choices=['stats', 'prune'],
+                        help="'stats' summarizes the cache, 'prune' evicts the least recently used entries.")
+    parser.add_argument('--max-mb', type=float, default=None,
+                        help="Size to prune the cache down to. Defaults to cache_max_mb from the config.")
+    args = parser.parse_args(args)
+
+    config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
+    max_mb = config.get('cache_max_mb') or DOCUMENT_CACHE_MB
+    documents = DocumentCache(config.get('cache_dir') or CACHEDIR, max_mb * 2**20)
+
+    if args.action == 'prune':
+        max_bytes = args.max_mb * 2**20 if args.max_mb is not None else None
+        freed = documents.prune(max_bytes)
+        print(f"Freed {freed / 2**20:.1f} MB")
+    stats = documents.stats()
+    print(f"Cache directory: {documents.directory}")
+    print(f"PDFs:     {stats['pdf_count']:6d} ({stats['pdf_bytes'] / 2**20:.1f} MB)")
+    print(f"Texts:    {stats['text_count']:6d} ({stats['text_bytes'] / 2**20:.1f} MB)")
+    print(f"Viewed:   {stats['view_count']:6d} ({stats['view_bytes'] / 2**20:.1f} MB)")
+    print(f"Analyses: {stats['analysis_count']:6d} ({stats['analysis_bytes'] / 2**20:.1f} MB)")
+    print(f"Bibcodes: {stats['bibcodes']:6d}")
+    print(f"Total: {stats['total_bytes'] / 2**20:.1f} MB of {stats['max_bytes'] / 2**20:.1f} MB")
+
+
 def kpub_import(args=None):
     """Import publications from a csv file.
 
-    The csv file must contain entries of the form "bibcode,mission,science".
-    The actual metadata of each publication will be grabbed using the ADS API,
-    hence this routine may take 10-20 minutes to complete.
+    The csv file must contain entries of the form "bibcode,mission,science,instruments,archive".
+    The actual metadata of the publications will be grabbed using the ADS API,
+    resolving IMPORT_CHUNK_SIZE bibcodes per request.
     """
     parser = argparse.ArgumentParser(
         description="Batch-import papers into the publication list "
@@ -1185,25 +3375,7 @@ def kpub_import(args=None):
     config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
 
     db = PublicationDB(args.f, config)
-    import time
-    for line in open(args.csvfile, 'r').readlines():
-        line = line.strip()
-        if not line:
-            continue
-        for attempt in range(5):
-            try:
-                col = line.strip().split(',')  # Naive csv parsing
-                bibcode = col[0]
-                mission = col[1]
-                science = col[2]
-                instrs  = col[3]
-                archive = col[4]
-                db.add_by_bibcode(bibcode, mission=mission, science=science,
-                    instruments=instrs, archive=archive)
-                time.sleep(0.1)
-                break
-            except Exception as e:
-                print("Warning: attempt #{} for {}: error '{}'".format(attempt, col[0], e))
+    db.import_csv(args.csvfile)
 
     #all done
     log.info(f'\nFinished importing.')
@@ -1212,6 +3384,29 @@ def kpub_import(args=None):
           HIGHLIGHTS['END'])
 
 
+def kpub_refresh_metrics(args=None):
+    """Refresh the citation and read counts of all publications from ADS."""
+    parser = argparse.ArgumentParser(
+        description="Refresh the citation and read counts of all publications from ADS.")
+    parser.add_argument('-f', metavar='dbfile',
+                        type=str, default=DEFAULT_DB,
+                        help="Location of the publication list db. Defaults to ~/.kpub.db.")
+    parser.add_argument('--chunk-size', type=int, default=REFRESH_CHUNK_SIZE,
+                        help=f"Bibcodes per ADS request, at most 2000. Defaults to {REFRESH_CHUNK_SIZE}.")
+    parser.add_argument('--workers', type=int, default=REFRESH_WORKERS,
+                        help=f"Number of concurrent ADS requests. Defaults to {REFRESH_WORKERS}.")
+    args = parser.parse_args(args)
+
+    config = yaml.load(open(f'{PACKAGEDIR}/config/config.live.yaml'), Loader=yaml.FullLoader)
+
+    db = PublicationDB(args.f, config)
+    stats = db.refresh_metrics(chunk_size=min(args.chunk_size, 2000), workers=args.workers)
+    print(f"Refreshed {stats['articles']} articles with {stats['requests']} ADS requests: "
+          f"{stats['changed']} changed, {stats['missing']} not found.")
+    print(f"Fetch: {stats['fetch']:.1f}s  Write: {stats['write']:.2f}s")
+    db.push_reminder()
+
+
 def kpub_export(args=None):
     """Export the bibcodes and classifications in CSV format."""
     parser = argparse.ArgumentParser(description="Export the publication list in CSV format.")
@@ -1322,13 +3517,17 @@ if __name__ == '__main__':
 
     cmd = sys.argv[1]
     if   cmd == 'update':      kpub_update(sys.argv[2:])
+    elif cmd == 'review':      kpub_review(sys.argv[2:])
     elif cmd == 'plot':        kpub_plot(sys.argv[2:])
     elif cmd == 'add':         kpub_add(sys.argv[2:])
     elif cmd == 'delete':      kpub_delete(sys.argv[2:])
     elif cmd == 'import':      kpub_import(sys.argv[2:])
+    elif cmd == 'refresh-metrics': kpub_refresh_metrics(sys.argv[2:])
     elif cmd == 'export':      kpub_export(sys.argv[2:])
     elif cmd == 'stats':       kpub_stats(sys.argv[2:])
     elif cmd == 'spreadsheet': kpub_spreadsheet(sys.argv[2:])
+    elif cmd == 'cache':       kpub_cache(sys.argv[2:])
+    elif cmd == 'affiliations': kpub_affiliations(sys.argv[2:])
     else: print("ERROR: Unknown kpub command")
 
 
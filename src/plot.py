@@ -1,5 +1,8 @@
 """Creates beautiful visualizations of the publication database."""
 import datetime
+import inspect
+import os
+import time
 import numpy as np
 from pprint import pprint
 import sys
@@ -57,6 +60,19 @@ mpl.rcParams["grid.linewidth"] = 1
 
 
 
+def save_figure(output_fn, dpi=200, formats=None):
+    """Saves and closes the current figure, once per format in `formats` if given."""
+    if formats:
+        root = os.path.splitext(output_fn)[0]
+        filenames = [f"{root}.{fmt}" for fmt in formats]
+    else:
+        filenames = [output_fn]
+    for fn in filenames:
+        log.info("Writing {}".format(fn))
+        pl.savefig(fn, dpi=dpi)
+    pl.close()
+
+
 def plot_by_year(db,
                  output_fn='kpub-publication-rate.pdf',
                  first_year=2009,
@@ -64,7 +80,8 @@ def plot_by_year(db,
                  dpi=200,
                  extrapolate=True,
                  missions=[],
-                 colors=["#3498db", "#27ae60", "#95a5a6"]):
+                 colors=["#3498db", "#27ae60", "#95a5a6"],
+                 formats=None):
     """Plots a bar chart showing the number of publications per year.
 
     Parameters
@@ -92,10 +109,16 @@ def plot_by_year(db,
 
     colors : list of str
         Define the facecolor for plots
+
+    formats : list of str
+        If given, the figure is saved once per format, e.g. ['pdf', 'png'],
+        replacing the extension of `output_fn`.
     """
-    # Obtain the dictionary which provides the annual counts
+    # Obtain the (mission, year) array of annual counts
     current_year = datetime.datetime.now().year
-    counts = db.get_annual_publication_count(year_begin=first_year, year_end=current_year)
+    data = db.get_publication_counts(year_begin=first_year, year_end=current_year)
+    years = data['years']
+    counts = data['counts'][[data['missions'].index(m) for m in missions]]
 
     # Now make the actual plot
     fig = pl.figure()
@@ -104,10 +127,9 @@ def plot_by_year(db,
         idx = i % len(colors)
         bottom = None
         if i>0:
-            prev = missions[i-1]
-            bottom = list(counts[prev].values())        
-        pl.bar(np.array(list(counts[mission].keys())),
-               list(counts[mission].values()),
+            bottom = counts[:i].sum(axis=0)
+        pl.bar(years,
+               counts[i],
                bottom = bottom,
                label=mission.capitalize(),
                facecolor=colors[idx],
@@ -117,9 +139,7 @@ def plot_by_year(db,
     if extrapolate:
         now = datetime.datetime.now()
         fraction_of_year_passed = float(now.strftime("%-j")) / 365.2425
-        current_total = 0
-        for mission in missions:
-            current_total += counts[mission][current_year]
+        current_total = counts[:, -1].sum()
         expected = (1/fraction_of_year_passed - 1) * current_total
         pl.bar(current_year,
                expected,
@@ -150,12 +170,10 @@ def plot_by_year(db,
     # Only show horizontal grid lines
     ax.grid(axis='y')
     pl.tight_layout(rect=(0, 0, 1, 0.95), h_pad=1.5)
-    log.info("Writing {}".format(output_fn))
-    pl.savefig(output_fn, dpi=dpi)
-    pl.close()
+    save_figure(output_fn, dpi, formats)
 
 
-def plot_science_piechart(db, output_fn="kpub-piechart.pdf", dpi=200, sciences=[]):
+def plot_science_piechart(db, output_fn="kpub-piechart.pdf", dpi=200, sciences=[], formats=None):
     """Plots a piechart showing science category publications.
 
     Parameters
@@ -171,16 +189,15 @@ def plot_science_piechart(db, output_fn="kpub-piechart.pdf", dpi=200, sciences=[
 
     sciences : str list
         List of sciences categories to plot independently
+
+    formats : list of str
+        If given, the figure is saved once per format, e.g. ['pdf', 'png'],
+        replacing the extension of `output_fn`.
     """
     if not sciences:
       return
 
-    count = []
-    for science in sciences:
-        cur = db.con.execute("SELECT COUNT(*) FROM pubs "
-                             "WHERE science = ?;", [science])
-        rows = list(cur.fetchall())
-        count.append(rows[0][0])
+    count = db.get_science_counts(sciences)
 
     # Plot the pie chart
     patches, texts, autotexts = pl.pie(count,
@@ -206,16 +223,15 @@ def plot_science_piechart(db, output_fn="kpub-piechart.pdf", dpi=200, sciences=[
 
     pl.axis('equal')  # required to ensure pie chart has equal aspect ratio
     pl.tight_layout(rect=(0, 0, 1, 0.85), h_pad=1.5)
-    log.info("Writing {}".format(output_fn))
-    pl.savefig(output_fn, dpi=dpi)
-    pl.close()
+    save_figure(output_fn, dpi, formats)
 
 
 def plot_author_count(db,
                       output_fn='kpub-author-count.pdf',
                       first_year=2008,
                       dpi=200,
-                      colors=["#3498db", "#27ae60", "#95a5a6"]):
+                      colors=["#3498db", "#27ae60", "#95a5a6"],
+                      formats=None):
     """Plots a line chart showing the number of authors over time.
 
     Parameters
@@ -234,6 +250,10 @@ def plot_author_count(db,
 
     colors : list of str
         Define the facecolors
+
+    formats : list of str
+        If given, the figure is saved once per format, e.g. ['pdf', 'png'],
+        replacing the extension of `output_fn`.
     """
     # Obtain the dictionary which provides the annual counts
     current_year = datetime.datetime.now().year
@@ -242,15 +262,11 @@ def plot_author_count(db,
     fig = pl.figure()
     ax = fig.add_subplot(111)
 
-    cumulative_years = []
-    paper_counts = []
-    author_counts, first_author_counts = [], []
-    for year in range(first_year - 1, current_year + 1):
-        cumulative_years.append(year)
-        metrics = db.get_metrics(cumulative_years)
-        paper_counts.append(metrics['publication_count'])
-        author_counts.append(metrics['author_count'])
-        first_author_counts.append(metrics['first_author_count'])
+    series = db.get_cumulative_author_series(first_year - 1, current_year)
+    cumulative_years = series['year']
+    paper_counts = series['publication_count']
+    author_counts = series['author_count']
+    first_author_counts = series['first_author_count']
 
     # plot it
     ax.plot([y for y in cumulative_years], paper_counts, label="Publications", lw=9)
@@ -281,9 +297,7 @@ def plot_author_count(db,
     # Only show horizontal grid lines
     ax.grid(axis='y')
     pl.tight_layout(rect=(0, 0, 1, 0.98), h_pad=1.5)
-    log.info("Writing {}".format(output_fn))
-    pl.savefig(output_fn, dpi=dpi)
-    pl.close()
+    save_figure(output_fn, dpi, formats)
 
 
 def plot_instruments(db,
@@ -307,25 +321,18 @@ def plot_instruments(db,
     instruments : array(str)
         List of instruments to graph
     """
-    # Obtain the dictionary which provides the annual counts
+    # Obtain the (mission, instrument, year) array of annual counts
+    year_end = datetime.datetime.now().year -1
+    data = db.get_publication_counts(year_begin=year_begin,
+                                     year_end=year_end,
+                                     instruments=instruments)
     for i, mission in enumerate(missions):
 
-        data = {}
-        for instr in instruments:    
-            year_end = datetime.datetime.now().year -1
-            counts = db.get_annual_publication_count(year_begin=year_begin, 
-                                                     year_end=year_end,
-                                                     instrument=instr)
-            data[instr] = counts[mission]
-
-        years = list(np.arange(year_begin, year_end+1))
-        years = [str(year) for year in years]
-        instrs = list(data.keys())
+        counts = data['counts'][data['missions'].index(mission)]
+        years = [str(year) for year in data['years']]
+        instrs = list(instruments)
         pallete = Category20[len(instrs)]
-        values = []
-        for instr, idata in data.items():
-          vals = [idata[year] for year in idata]
-          values.append(vals)
+        values = [vals.tolist() for vals in counts]
         plotdata = {
           'years': [years] * len(instrs),
           'values': values,
@@ -337,7 +344,7 @@ def plot_instruments(db,
         p.multi_line(xs = 'years',
                      ys = 'values',
                      color = 'color',
-                     legend = 'columns',
+                     legend_field = 'columns',
                      line_width = 3,
                      source = source)
         p.add_layout(Title(text="by instrument", text_font_style="italic"), 'above')
@@ -390,7 +397,7 @@ def plot_affiliations(db,
         p.multi_line(xs = 'years',
                      ys = 'values',
                      color = 'color',
-                     legend = 'columns',
+                     legend_field = 'columns',
                      line_width = 3,
                      source = source)
         p.add_layout(Title(text=f"{mission.upper()} affiliations per year", text_font_size="16pt"), 'above')
@@ -402,6 +409,56 @@ def plot_affiliations(db,
         save(p)
 
 
+class PlotData(object):
+    """Query results needed by the plot functions, fetched from the database up front.
+
+    Stands in for the `PublicationDB` passed to the plot functions: each
+    `fetch`ed method can be called again with the same arguments, in any
+    positional/keyword form, and returns the stored result.  It holds no
+    database connection, so it can be sent to worker processes.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.signatures = {}
+        self.results = {}
+
+    def key(self, name, args, kwargs):
+        bound = self.signatures[name].bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        return name, repr(bound.arguments)
+
+    def fetch(self, name, *args, **kwargs):
+        """Runs a query method of the database, unless it was already run with these arguments."""
+        if name not in self.signatures:
+            self.signatures[name] = inspect.signature(getattr(type(self.db), name))
+        key = self.key(name, args, kwargs)
+        if key not in self.results:
+            self.results[key] = getattr(self.db, name)(*args, **kwargs)
+        return self.results[key]
+
+    def __getattr__(self, name):
+        if name not in self.__dict__.get('signatures', {}):
+            raise AttributeError(name)
+        def lookup(*args, **kwargs):
+            try:
+                return self.results[self.key(name, args, kwargs)]
+            except KeyError:
+                raise KeyError(f"{name}{args}{kwargs} was not fetched for plotting")
+        return lookup
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['db'] = None
+        return state
+
+
+def render_plot(func_name, data, kwargs):
+    """Runs the plot function `func_name` on `data` and returns the seconds it took."""
+    start = time.perf_counter()
+    globals()[func_name](data, **kwargs)
+    return time.perf_counter() - start
+
+
 if __name__ == "__main__":
     plot_by_year()
     plot_science_piechart()
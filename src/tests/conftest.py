@@ -0,0 +1,194 @@
+"""Shared fixtures: a small synthetic publication database."""
+import json
+import os
+import random
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import yaml
+
+import kpub
+
+
+def make_article(idx, year, month=1, mission=None, authors=None, affs=None,
+                 citation_count=0, read_count=0, refereed=True):
+    """Returns a dict mimicking a document returned by the ADS search API."""
+    bibcode = f"{year}ApJ...{idx:03d}..{idx % 100:02d}X"
+    authors = authors or [f"Author{idx}, A.", "Smith, J.", "Doe, J."]
+    norms = [a.split(',')[0] + ', ' + a.split(', ')[-1][0] for a in authors]
+    return {
+        'id': str(idx),
+        'bibcode': bibcode,
+        'year': str(year),
+        'pubdate': f"{year}-{month:02d}-00",
+        'title': [f"Paper number {idx}"],
+        'abstract': f"Abstract of paper {idx} using Keck HIRES.",
+        'author': authors,
+        'author_norm': norms,
+        'first_author_norm': norms[0],
+        'aff': affs or ["W. M. Keck Observatory", "NASA Ames, CA 94035, USA", "ESO, Germany"][:len(authors)],
+        'citation_count': citation_count,
+        'read_count': read_count,
+        'property': ['REFEREED', 'ARTICLE'] if refereed else ['NOT REFEREED', 'ARTICLE'],
+        'pub': 'The Astrophysical Journal',
+        'doctype': 'article',
+        'keyword': ['stars', 'planets'],
+        'indexstamp': f"{year}-{month:02d}-15T00:00:00.000Z",
+    }
+
+
+@pytest.fixture
+def config():
+    cfg = yaml.load(open(os.path.join(kpub.PACKAGEDIR, 'config', 'config.keck.yaml')),
+                    Loader=yaml.FullLoader)
+    cfg['missions'] = ['keck', 'k2']
+    cfg['sciences'] = ['exoplanets', 'astrophysics']
+    return cfg
+
+
+@pytest.fixture
+def articles():
+    rng = random.Random(42)
+    pool = [f"Person{i}, P." for i in range(40)]
+    affpool = ["W. M. Keck Observatory, Kamuela, HI", "Caltech, Pasadena", "NASA Ames, CA 94035, USA",
+               "Max Planck Institute, Germany", "University of Tokyo, Japan", "-"]
+    arts = []
+    for idx in range(120):
+        year = rng.randint(2008, 2016)
+        nauth = rng.randint(1, 6)
+        authors = rng.sample(pool, nauth)
+        arts.append(make_article(idx, year, month=rng.randint(1, 12), authors=authors,
+                                 affs=[rng.choice(affpool) for _ in authors],
+                                 citation_count=rng.choice([None, 0, 3, 10, 50, 200]),
+                                 read_count=rng.randint(0, 500),
+                                 refereed=rng.random() > 0.3))
+    arts[5]['bibcode'] = "2012PhDT.......105X"
+    arts[6]['property'] = None
+    return arts
+
+
+@pytest.fixture
+def db(tmp_path, config, articles):
+    pubdb = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    rng = random.Random(7)
+    for art in articles:
+        mission = rng.choice(['keck', 'keck', 'k2', 'unrelated'])
+        science = rng.choice(config['sciences']) if mission != 'unrelated' else ''
+        pubdb.add(dict(art), mission=mission, science=science,
+                  instruments=rng.choice(['HIRES', 'NIRC2|OSIRIS', '']),
+                  archive=rng.choice(['0', '1']))
+    return pubdb
+
+
+class StubADS(object):
+    """A local HTTP server mimicking the ADS search API for a fixed set of documents.
+
+    Queries of the form `identifier:("a" OR "b")` return the matching
+    documents; any other query returns every document.  Results are paged
+    with `rows` and either `cursorMark` or, if `cursors` is False, `start`.  All requests are
+    recorded in `requests` as (path, params, headers) tuples.  POSTed bigqueries
+    return the documents of the bibcodes listed in the body, limited to the `fl`
+    fields; the bibcode lists are recorded in `bigqueries`.
+    """
+    def __init__(self, docs=(), cursors=True):
+        self.docs = list(docs)
+        self.cursors = cursors
+        self.requests = []
+        self.errors = []    # (status, headers) responses to send before the real ones
+        self.headers = {}   # extra headers sent with every response
+        self.highlights = {}  # highlighting returned per document id
+        self.bigqueries = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.handle_request(None)
+
+            def do_POST(self):
+                self.handle_request(self.rfile.read(int(self.headers['Content-Length'])).decode())
+
+            def handle_request(self, data):
+                url = urllib.parse.urlsplit(self.path)
+                params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+                with stub.lock:
+                    stub.requests.append((url.path, params, dict(self.headers)))
+                    error = stub.errors.pop(0) if stub.errors else None
+                if error:
+                    status, headers = error
+                    body = {'error': 'stub error'}
+                elif data is not None:
+                    status, body, headers = stub.respond_bigquery(params, data)
+                else:
+                    status, body, headers = stub.respond(url.path, params)
+                headers = dict(stub.headers, **headers)
+                self.send_response(status)
+                for key, val in headers.items():
+                    self.send_header(key, val)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def search(self, q):
+        match = re.search(r'identifier:\((.*)\)', q)
+        if match:
+            wanted = set(re.findall(r'"([^"]+)"', match.group(1)))
+            return [d for d in self.docs if d['bibcode'] in wanted]
+        match = re.search(r'bibcode:"([^"]+)"', q)
+        if match:
+            return [d for d in self.docs if d['bibcode'] == match.group(1)]
+        return list(self.docs)
+
+    def respond(self, path, params):
+        docs = self.search(params.get('q', ''))
+        rows = int(params.get('rows', len(docs) or 1))
+        body = {}
+        cursor = params.get('cursorMark')
+        if cursor is not None and self.cursors:
+            # Solr echoes the same cursor back once the results are exhausted
+            start = 0 if cursor == '*' else int(cursor[1:])
+            page = docs[start:start + rows]
+            body['nextCursorMark'] = f"c{start + len(page)}" if page else cursor
+        else:
+            start = int(params.get('start', 0))
+            page = docs[start:start + rows]
+        body['response'] = {'numFound': len(docs), 'start': start, 'docs': page}
+        body['highlighting'] = {d['id']: self.highlights.get(d['id'], {}) for d in page}
+        return 200, body, {}
+
+    def respond_bigquery(self, params, data):
+        bibcodes = data.splitlines()[1:]
+        with self.lock:
+            self.bigqueries.append(bibcodes)
+        wanted = set(bibcodes)
+        fields = params.get('fl', 'bibcode').split(',')
+        docs = [{f: d[f] for f in fields if f in d} for d in self.docs if d['bibcode'] in wanted]
+        rows = int(params.get('rows', 10))
+        start = int(params.get('start', 0))
+        return 200, {'response': {'numFound': len(docs), 'start': start,
+                                  'docs': docs[start:start + rows]}}, {}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def ads_stub(monkeypatch, articles):
+    """Points kpub at a StubADS server serving the synthetic articles."""
+    stub = StubADS(articles)
+    monkeypatch.setattr(kpub, 'ADS_API', f"{stub.url}/v1/search/query?")
+    monkeypatch.setattr(kpub, 'ADS_BIGQUERY', f"{stub.url}/v1/search/bigquery?")
+    yield stub
+    stub.close()
@@ -0,0 +1,154 @@
+"""Test the ADS API client against a local stub server."""
+import time
+
+import pytest
+import requests
+
+import kpub
+from conftest import StubADS
+
+
+def test_query_ads_pages(db, articles, ads_stub):
+    """Are large result sets fetched page by page with cursorMark?"""
+    pages = list(db.query_ads_pages("ack:keck", rows=25))
+    assert len(pages) == 5
+    assert [p['response']['docs'][0]['bibcode'] for p in pages] == \
+           [articles[i]['bibcode'] for i in range(0, 120, 25)]
+    assert ads_stub.requests[0][1]['cursorMark'] == '*'
+    assert ads_stub.requests[1][1]['cursorMark'] == 'c25'
+    bibcodes = [d['bibcode'] for p in pages for d in p['response']['docs']]
+    assert bibcodes == [a['bibcode'] for a in articles]
+
+
+def test_query_ads_pages_is_lazy(db, ads_stub):
+    """Is the first page available before the later ones are requested?"""
+    pages = db.query_ads_pages("ack:keck", rows=50)
+    first = next(pages)
+    assert len(first['response']['docs']) == 50
+    assert len(ads_stub.requests) == 1
+
+
+def test_query_ads_start_fallback(db, articles, monkeypatch):
+    """Without cursor support, is the start offset used instead?"""
+    stub = StubADS(articles, cursors=False)
+    monkeypatch.setattr(kpub, 'ADS_API', f"{stub.url}/v1/search/query?")
+    try:
+        pages = list(db.query_ads_pages("ack:keck", rows=50))
+        assert [p['response']['start'] for p in pages] == [0, 50, 100]
+        assert [r[1].get('start') for r in stub.requests] == [None, '50', '100']
+        data = db.query_ads("ack:keck")
+        assert len(data['response']['docs']) == len(articles)
+        assert set(data['highlighting']) == set(a['id'] for a in articles)
+    finally:
+        stub.close()
+
+
+def test_query_ads_pages_error(db, ads_stub):
+    """Is an error response raised rather than parsed as a page?"""
+    ads_stub.errors = [(401, {})]
+    with pytest.raises(requests.HTTPError):
+        list(db.query_ads_pages("ack:keck"))
+    assert len(ads_stub.requests) == 1
+
+
+def test_client_retries(db, ads_stub, monkeypatch):
+    """Are 429 and 5xx responses retried with backoff?"""
+    monkeypatch.setattr(db.ads, 'backoff', 0.01)
+    ads_stub.errors = [(503, {}), (429, {})]
+    data = db.query_ads('identifier:("{}")'.format(ads_stub.docs[0]['bibcode']))
+    assert len(data['response']['docs']) == 1
+    assert len(ads_stub.requests) == 3
+
+
+def test_client_gives_up(db, ads_stub, monkeypatch):
+    monkeypatch.setattr(db.ads, 'backoff', 0.01)
+    monkeypatch.setattr(db.ads, 'retries', 2)
+    ads_stub.errors = [(500, {})] * 5
+    with pytest.raises(requests.HTTPError):
+        db.query_ads("ack:keck")
+    assert len(ads_stub.requests) == 3
+
+
+def test_client_returns_client_errors(db, ads_stub):
+    """Are 4xx responses other than 429 returned without retrying, and raised by the callers?"""
+    ads_stub.errors = [(403, {})]
+    r = db.ads.get(f"{kpub.ADS_API}q=ack:keck")
+    assert r.status_code == 403
+    ads_stub.errors = [(401, {})]
+    with pytest.raises(requests.HTTPError):
+        kpub.get_highlights(ads_stub.docs[0]['bibcode'], 'full:keck', db.ads)
+    assert len(ads_stub.requests) == 2
+
+
+def test_client_session_and_auth(db, ads_stub):
+    """Is one authenticated keep-alive session reused for all requests?"""
+    db.ads.session.headers['Authorization'] = 'Bearer secret'
+    db.query_ads("ack:keck")
+    db.query_ads("ack:keck")
+    assert all(r[2]['Authorization'] == 'Bearer secret' for r in ads_stub.requests)
+    pool = db.ads.session.get_adapter(ads_stub.url).poolmanager
+    assert len(pool.pools) == 1
+
+
+def test_rate_limiter_follows_headers(db, ads_stub):
+    """Does the limiter pace requests once the quota reported by ADS is used up?"""
+    ads_stub.headers = {'X-RateLimit-Remaining': '0',
+                        'X-RateLimit-Reset': str(time.time() + 0.5)}
+    db.query_ads("ack:keck")
+    limiter = db.ads.limiter
+    assert limiter.tokens == 0
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start > 0.2
+
+
+def test_word_counts_single_query(db, articles, ads_stub):
+    """Are all words looked up with one request and the snippets attributed per word?"""
+    art = articles[0]
+    ads_stub.highlights[art['id']] = {
+        'body': ["observed with <em>HIRES</em> on Keck I",
+                 "the <em>Keck</em> <em>Observatory</em> <em>Archive</em> (<em>KOA</em>)"],
+        'ack': ["<em>NIRC2</em> and <em>HIRES</em> data"]}
+    words = ['HIRES', 'NIRC2', 'OSIRIS', 'KOA', 'Keck Observatory Archive']
+    counts = kpub.get_word_match_counts_by_query(art['bibcode'], words, db.ads)
+    assert len(ads_stub.requests) == 1
+    assert 'full:"HIRES" OR full:"NIRC2"' in ads_stub.requests[0][1]['q']
+    assert {w: c['count'] for w, c in counts.items()} == \
+           {'HIRES': 2, 'NIRC2': 1, 'KOA': 1, 'Keck Observatory Archive': 1}
+
+
+def test_word_counts_concurrent(db, articles, ads_stub):
+    art = articles[0]
+    ads_stub.highlights[art['id']] = {'body': ["with <em>HIRES</em>"]}
+    counts = kpub.get_word_match_counts_by_query_concurrent(art['bibcode'], ['HIRES', 'LRIS'], db.ads)
+    assert len(ads_stub.requests) == 2
+    assert counts['HIRES']['count'] == 1
+
+
+def test_client_quota_exhausted(db, ads_stub):
+    """Is an exhausted daily quota reported at once instead of waited out?"""
+    reset = time.time() + 3600
+    ads_stub.errors = [(429, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(reset)})]
+    start = time.monotonic()
+    with pytest.raises(kpub.ADSQuotaError, match="quota exhausted until"):
+        db.query_ads("ack:keck")
+    assert len(ads_stub.requests) == 1
+
+    # Later requests fail without waiting for the limiter either
+    with pytest.raises(kpub.ADSQuotaError):
+        db.query_ads("ack:keck")
+    assert len(ads_stub.requests) == 1
+    assert time.monotonic() - start < 5
+
+
+def test_pdf_download_retries_less(db, monkeypatch):
+    calls = []
+
+    def request(method, url, **kwargs):
+        calls.append(url)
+        raise requests.Timeout("stub timeout")
+
+    monkeypatch.setattr(db.ads, 'backoff', 0.01)
+    monkeypatch.setattr(db.ads.session, 'request', request)
+    assert kpub.download_pdf('2020ApJ...001..01X', db.ads) is False
+    assert len(calls) == kpub.ADS_PDF_RETRIES + 1
@@ -0,0 +1,93 @@
+"""Test the classification of author affiliations."""
+import json
+import re
+
+import kpub
+
+AFFS = ["W. M. Keck Observatory, Kamuela, HI 96743, USA",
+        "Department of Astronomy, California Institute of Technology, Pasadena, CA, USA",
+        "Max-Planck-Institut fur Astronomie, Heidelberg, Germany",
+        "Department of Physics, UCLA, Los Angeles, CA; NASA Ames Research Center",
+        "Institute for Astronomy, University of Hawai`i, Honolulu, HI, USA",
+        "University of Colorado, UCB 389, Boulder, CO",
+        "NASA Exoplanet Science Institute, Caltech/IPAC, Pasadena, CA",
+        "Circinus Institute of Technology",
+        "-", "", "  "]
+
+
+def legacy_get_aff_type(affstr, aff_defs):
+    """Original per-string, per-affiliation implementation."""
+    if len(affstr.strip()) <= 2:
+        return None
+    default = ''
+    affs = affstr.split(";")
+    for affdef in aff_defs:
+        afftype = affdef['type']
+        if not affdef['strings']:
+            default = afftype
+            continue
+        for string in affdef['strings']:
+            for aff in affs:
+                if string.isupper():
+                    if re.search(string, aff):
+                        return afftype
+                else:
+                    if re.search(string, aff, re.IGNORECASE):
+                        return afftype
+    return default
+
+
+def test_classifier_matches_legacy(config):
+    classifier = kpub.AffiliationClassifier(config['aff_defs'])
+    expected = [legacy_get_aff_type(aff, config['aff_defs']) for aff in AFFS]
+    assert classifier.classify_many(AFFS) == expected
+    assert classifier.classify_many(AFFS) == expected  # memoized
+    assert set(classifier.cache) == set(AFFS)
+
+
+def test_affiliation_counts(db, config):
+    counts = db.get_affiliation_counts(1990, 2030, 'keck')
+    expected = {key: dict.fromkeys(val, 0) for key, val in counts.items()}
+    rows = db.con.execute("SELECT year, metrics FROM pubs WHERE mission = 'keck'").fetchall()
+    for year, metrics in rows:
+        types = [legacy_get_aff_type(aff, config['aff_defs']) for aff in json.loads(metrics)['aff'][:3]]
+        types = [t for t in types if t]
+        if types and legacy_get_aff_type(json.loads(metrics)['aff'][0], config['aff_defs']):
+            expected['first author ' + types[0]][int(year)] += 1
+        if len(types) == 3 and len(set(types)) == 1:
+            expected['top3 authors ' + types[0]][int(year)] += 1
+    assert counts == expected
+    assert db.get_aff_classifier() is db.get_aff_classifier()
+
+
+def test_aff_types_stored_at_ingest(db, config):
+    """Are affiliation types classified when articles are added?"""
+    classifier = kpub.AffiliationClassifier(config['aff_defs'])
+    rows = db.con.execute("SELECT aff, aff_type FROM authors WHERE aff IS NOT NULL").fetchall()
+    assert rows
+    assert all(aff_type == classifier.classify(aff) for aff, aff_type in rows)
+    assert not db.update_aff_types()
+
+
+def test_aff_types_rebuilt_on_config_change(db, config):
+    config['aff_defs'] = [{'type': 'nasa', 'strings': ['NASA']}, {'type': 'other', 'strings': []}]
+    counts = db.get_affiliation_counts(1990, 2030, 'keck')
+    types = {t for (t,) in db.con.execute("SELECT DISTINCT aff_type FROM authors")}
+    assert types <= {'nasa', 'other', None}
+    assert sum(counts['first author nasa'].values()) > 0
+    assert not db.update_aff_types()
+    assert db.update_aff_types(force=True)
+
+
+def test_migrate_adds_aff_types(tmp_path, config, articles):
+    fn = str(tmp_path / 'v3.db')
+    db = kpub.PublicationDB(fn, config)
+    db.add_many(dict(art, mission='keck') for art in articles[:20])
+    expected = db.get_affiliation_counts(1990, 2030, 'keck')
+    with db.con:
+        db.con.execute("ALTER TABLE authors DROP COLUMN aff_type")
+        db.con.execute("DROP TABLE meta")
+        db.con.execute("PRAGMA user_version = 3")
+    db.con.close()
+    db = kpub.PublicationDB(fn, config)
+    assert db.get_affiliation_counts(1990, 2030, 'keck') == expected
@@ -0,0 +1,114 @@
+"""Test the automatic classification of candidate articles (`kpub update --auto`)."""
+import random
+
+import pytest
+
+import kpub
+from conftest import StubADS, make_article
+from test_fulltext import fake_pdf
+
+KECK_WORDS = ("radial velocity spectroscopy exoplanet host star HIRES NIRC2 adaptive optics "
+              "Keck Observatory Mauna Kea spectrograph").split()
+UNRELATED_WORDS = ("cosmic microwave background polarization BICEP array bolometer "
+                   "South Pole inflation B-mode telescope").split()
+SHARED_WORDS = "we present observations data analysis results model".split()
+
+
+def make_labelled(idx, words, rng, **kwargs):
+    art = make_article(idx, 2010 + idx % 8, **kwargs)
+    art['abstract'] = ' '.join(rng.sample(words, 6) + rng.sample(SHARED_WORDS, 4))
+    art['title'] = [' '.join(rng.sample(words, 3))]
+    return art
+
+
+@pytest.fixture
+def labelled_db(tmp_path, config):
+    config['cache_dir'] = str(tmp_path)
+    config['sciences'] = []
+    config['prefetch_depth'] = 0
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    rng = random.Random(3)
+    for idx in range(80):
+        related = idx % 2 == 0
+        art = make_labelled(idx, KECK_WORDS if related else UNRELATED_WORDS, rng)
+        db.add(art, mission='keck' if related else 'unrelated')
+    return db
+
+
+def test_naive_bayes():
+    model = kpub.NaiveBayes(min_count=1).fit([{'a', 'b'}, {'a', 'c'}, {'d', 'e'}, {'d', 'f'}],
+                                              ['x', 'x', 'y', 'y'])
+    probs = model.predict_proba({'a'})
+    assert probs['x'] > 0.5 > probs['y']
+    assert sum(probs.values()) == pytest.approx(1)
+    # Unknown features leave the priors
+    assert model.predict_proba({'zzz'}) == pytest.approx({'x': 0.5, 'y': 0.5})
+
+
+def test_classify(labelled_db):
+    classifier = labelled_db.get_article_classifier()
+    rng = random.Random(11)
+    keck = make_labelled(200, KECK_WORDS, rng)
+    unrelated = make_labelled(201, UNRELATED_WORDS, rng)
+    mixed = make_article(202, 2020)
+    mixed['abstract'] = "we present data"
+    assert classifier.classify(keck)[:3] == ('accept', 'keck', '')
+    assert classifier.classify(unrelated)[:3] == ('reject', 'unrelated', '')
+    assert classifier.classify(mixed)[0] == 'review'
+
+
+def test_too_few_examples(tmp_path, config):
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    db.add(make_article(1, 2015), mission='keck')
+    assert db.get_article_classifier() is None
+
+
+def test_update_auto(labelled_db, monkeypatch):
+    """Are only the uncertain candidates shown for review?"""
+    rng = random.Random(5)
+    keck = make_labelled(300, KECK_WORDS, rng)
+    unrelated = make_labelled(301, UNRELATED_WORDS, rng)
+    mixed = make_article(302, 2020)
+    mixed['abstract'] = "we present data"
+    stub = StubADS([keck, unrelated, mixed])
+    monkeypatch.setattr(kpub, 'ADS_API', f"{stub.url}/v1/search/query?")
+    calls = fake_pdf(monkeypatch)
+    monkeypatch.setattr(labelled_db, 'push_reminder', lambda: None)
+    labelled_db.config['ads_queries'] = labelled_db.config['ads_queries'][:1]
+    reviewed = []
+    monkeypatch.setattr(labelled_db, 'add_interactively',
+                        lambda article, **kwargs: reviewed.append(article['bibcode']))
+    try:
+        labelled_db.update('2020', auto=True)
+    finally:
+        stub.close()
+
+    assert reviewed == [mixed['bibcode']]
+    row = labelled_db.con.execute("SELECT mission, instruments, archive FROM pubs WHERE bibcode = ?",
+                                  [keck['bibcode']]).fetchone()
+    assert row == ('keck', 'HIRES|NIRC2', '1')
+    assert labelled_db.con.execute("SELECT mission FROM pubs WHERE bibcode = ?",
+                                   [unrelated['bibcode']]).fetchone() == ('unrelated',)
+    # Only the accepted article's PDF was scanned
+    assert calls['text'] == 1
+
+
+def test_prefetch_reuses_verdict(labelled_db, monkeypatch):
+    """Is each candidate scored once even though prefetching also looks at the verdict?"""
+    rng = random.Random(7)
+    candidates = [make_labelled(400 + i, KECK_WORDS if i % 2 else UNRELATED_WORDS, rng) for i in range(4)]
+    stub = StubADS(candidates)
+    monkeypatch.setattr(kpub, 'ADS_API', f"{stub.url}/v1/search/query?")
+    fake_pdf(monkeypatch)
+    monkeypatch.setattr(labelled_db, 'push_reminder', lambda: None)
+    labelled_db.config['ads_queries'] = labelled_db.config['ads_queries'][:1]
+    labelled_db.config['prefetch_depth'] = 2
+    scored = []
+    score = kpub.ArticleClassifier.score
+    monkeypatch.setattr(kpub.ArticleClassifier, 'score',
+                        lambda self, article: scored.append(article['bibcode']) or score(self, article))
+    try:
+        labelled_db.update('2020', auto=True)
+    finally:
+        stub.close()
+    assert sorted(scored) == sorted(art['bibcode'] for art in candidates)
@@ -19,3 +19,39 @@ def test_annual_count():
     # Can we pass multiple years to get_metrics?
     metrics = db.get_metrics(year=[2011, 2012])
     assert metrics['publication_count'] == annual['both'][2011] + annual['both'][2012]
+
+
+def legacy_annual_count(db, year_begin, year_end, instrument=None, cumulative=False):
+    """The original per-mission, per-year COUNT(*) queries."""
+    result = {}
+    for mission in db.config['missions']:
+        result[mission] = {}
+        for year in range(year_begin, year_end + 1):
+            q = "SELECT COUNT(*) FROM pubs WHERE mission = ? "
+            q += "AND year <= ?" if cumulative else "AND year = ?"
+            params = [mission, str(year)]
+            if instrument:
+                q += " AND instruments LIKE ?"
+                params.append(f"%{instrument}%")
+            result[mission][year] = db.con.execute(q, params).fetchone()[0]
+    result['both'] = {year: sum(result[m][year] for m in db.config['missions'])
+                      for year in range(year_begin, year_end + 1)}
+    return result
+
+
+def test_count_matrix_matches_legacy(db):
+    """Do the single-query count matrices agree with the original per-year queries?"""
+    assert db.get_annual_publication_count(2010, 2015) == legacy_annual_count(db, 2010, 2015)
+    assert (db.get_annual_publication_count_cumulative(2010, 2015)
+            == legacy_annual_count(db, 2010, 2015, cumulative=True))
+    for instr in ('HIRES', 'NIRC2', 'OSIRIS', 'KCWI'):
+        assert (db.get_annual_publication_count(2008, 2016, instrument=instr)
+                == legacy_annual_count(db, 2008, 2016, instrument=instr))
+
+
+def test_count_matrix_shape(db):
+    data = db.get_publication_counts(2008, 2016, instruments=['HIRES', 'NIRC2'])
+    assert data['counts'].shape == (len(data['missions']), 2, 9)
+    cumul = db.get_publication_counts(2008, 2016, cumulative=True)['counts']
+    annual = db.get_publication_counts(2008, 2016)['counts']
+    assert (cumul == annual.cumsum(axis=-1)).all()
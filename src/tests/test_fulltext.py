@@ -0,0 +1,206 @@
+"""Test the full-text analysis of articles."""
+import os
+import random
+import re
+
+import pytest
+
+import kpub
+
+TEXT = """Observations were obtained with HIRES and NIRC2 at the W. M. Keck Observatory.
+Data are available from the Keck Observatory Archive (KOA). We thank the KECK staff."""
+
+
+def fake_pdf(monkeypatch, text=TEXT):
+    """Replaces the PDF download and text extraction, returning the call counters."""
+    calls = {'file': 0, 'text': 0}
+
+    def get_pdf_file(bibcode, ads, documents=None):
+        calls['file'] += 1
+        return f"/nonexistent/{bibcode}.pdf"
+
+    def get_pdf_text(outfile):
+        calls['text'] += 1
+        return text
+
+    monkeypatch.setattr(kpub, 'get_pdf_file', get_pdf_file)
+    monkeypatch.setattr(kpub, 'get_pdf_text', get_pdf_text)
+    return calls
+
+
+def test_analysis_is_shared(tmp_path, config, monkeypatch):
+    """Do snippets, instruments and archive detection share one PDF scan?"""
+    config['cache_dir'] = str(tmp_path)
+    calls = fake_pdf(monkeypatch)
+    monkeypatch.setattr(kpub, 'input_with_prefill', lambda prompt, text: text)
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    bibcode = '2020ApJ...001..01X'
+
+    assert set(db.find_all_snippets(bibcode)) == {'keck', 'HIRES', 'NIRC2'}
+    assert db.prompt_instruments(bibcode) == 'HIRES|NIRC2'
+    assert db.get_archive_acknowledgement(bibcode) == '1'
+    assert calls == {'file': 1, 'text': 1}
+
+    # A new session reads the analysis back from disk
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    assert db.analyze(bibcode).matches(['KOA'])['KOA']['count'] == 1
+    assert calls == {'file': 1, 'text': 1}
+
+
+def test_analysis_invalidated_by_words(tmp_path, config, monkeypatch):
+    config['cache_dir'] = str(tmp_path)
+    calls = fake_pdf(monkeypatch)
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    db.analyze('2020ApJ...001..01X')
+    config['instruments'] = config['instruments'] + ['NEWCAM']
+    db.analyze('2020ApJ...001..01X')
+    assert calls['text'] == 2
+
+
+def test_analysis_cache_lru(tmp_path):
+    cache = kpub.AnalysisCache(str(tmp_path), size=2)
+    for i in range(3):
+        cache.put(kpub.ArticleAnalysis(f"b{i}", ['w'], {}, 'pdf'))
+    assert list(cache.memory) == ['b1', 'b2']
+    assert cache.get('b0', ['w']).bibcode == 'b0'  # from disk
+    assert cache.get('b0', ['other']) is None
+
+
+def test_document_cache(tmp_path):
+    """Are PDFs and their text stored once per content and read back intact?"""
+    cache = kpub.DocumentCache(str(tmp_path))
+    pdf = b'%PDF' + b'x' * 2000
+    digest = cache.put_pdf('b1', pdf)
+    assert cache.put_pdf('b2', pdf) == digest
+    cache.put_text('b1', 'some text')
+    assert cache.get_pdf('b2') == pdf
+    assert cache.get_text('b2') == 'some text'
+    stats = cache.stats()
+    assert (stats['pdf_count'], stats['text_count'], stats['bibcodes']) == (1, 1, 2)
+
+    # Corrupt entries are dropped rather than returned
+    with open(cache.path('pdf', digest), 'wb') as f:
+        f.write(b'garbage')
+    assert cache.get_pdf('b1') is None
+    assert cache.get_text('b1') is None
+
+
+def test_document_cache_prune(tmp_path):
+    cache = kpub.DocumentCache(str(tmp_path))
+    for i in range(3):
+        cache.put_pdf(f"b{i}", bytes([i]) * 5000)
+        os.utime(cache.path('pdf', cache.get_hash(f"b{i}")), (i, i))
+    cache.get_pdf('b0')  # most recently used now
+    total = cache.stats()['total_bytes']
+    oldest = os.path.getsize(cache.path('pdf', cache.get_hash('b1')))
+    assert cache.prune(total - 1) == oldest
+    assert cache.get_pdf('b1') is None and cache.get_hash('b1') is None
+    assert cache.get_pdf('b0') and cache.get_pdf('b2')
+
+
+def test_document_cache_running_total(tmp_path, monkeypatch):
+    """Is the cache walked once rather than on every write, and pruned below its limit?"""
+    cache = kpub.DocumentCache(str(tmp_path), max_bytes=50000)
+    walks = []
+    entries = cache.entries
+    monkeypatch.setattr(cache, 'entries', lambda: walks.append(1) or entries())
+    for i in range(60):
+        cache.put_pdf(f"b{i}", random.Random(i).randbytes(2000))
+        cache.put_text(f"b{i}", f"text {i}")
+    assert cache.total == sum(size for mtime, size, path in entries())
+    assert cache.total <= cache.max_bytes
+    # One walk to seed the total, then one per prune down to the low-water mark
+    assert 1 < len(walks) <= 10
+    assert cache.get_pdf('b59') is not None
+
+
+def test_query_fallback_not_persisted(tmp_path):
+    """Is the PDF tried again in a later session after the ADS query fallback was used?"""
+    cache = kpub.AnalysisCache(str(tmp_path))
+    cache.put(kpub.ArticleAnalysis('b0', ['w'], {}, 'query'))
+    assert cache.get('b0', ['w']).method == 'query'
+    assert not os.path.exists(cache.path('b0'))
+    assert kpub.AnalysisCache(str(tmp_path)).get('b0', ['w']) is None
+
+
+def test_prune_evicts_analyses(tmp_path):
+    analyses = kpub.AnalysisCache(str(tmp_path / 'analysis'))
+    cache = kpub.DocumentCache(str(tmp_path))
+    analyses.put(kpub.ArticleAnalysis('b0', ['w'], {}, 'pdf'))
+    os.utime(analyses.path('b0'), (0, 0))
+    cache.put_pdf('b1', b'x' * 5000)
+    stats = cache.stats()
+    assert stats['analysis_count'] == 1
+    assert cache.prune(stats['total_bytes'] - 1) == stats['analysis_bytes']
+    assert not os.path.exists(analyses.path('b0')) and cache.get_pdf('b1')
+
+
+def test_pdf_downloaded_once(tmp_path, monkeypatch):
+    """Is the PDF downloaded and its text extracted only once with a document cache?"""
+    calls = {'download': 0, 'text': 0}
+
+    def download_pdf(bibcode, ads):
+        calls['download'] += 1
+        return b'%PDF' + b'x' * 2000
+
+    def get_pdf_text(outfile):
+        calls['text'] += 1
+        assert open(outfile, 'rb').read(4) == b'%PDF'
+        return TEXT
+
+    monkeypatch.setattr(kpub, 'download_pdf', download_pdf)
+    monkeypatch.setattr(kpub, 'get_pdf_text', get_pdf_text)
+    cache = kpub.DocumentCache(str(tmp_path))
+    for words in (['HIRES'], ['NIRC2', 'KOA']):
+        counts = kpub.get_word_match_counts_by_pdf('b1', words, None, cache)
+        assert set(counts) == set(words)
+    assert calls == {'download': 1, 'text': 1}
+
+
+def legacy_word_counts(text, words):
+    """Per-word, per-prefix regex scan that WordScanner replaces."""
+    counts = {}
+    for word in words:
+        count = 0
+        for ch in (' ', '/', '\\(', '-', ':'):
+            count += len(re.findall(f"{ch}{word}".lower(), text))
+        if count:
+            counts[word] = count
+    return counts
+
+
+def test_scanner_matches_legacy(config):
+    words = config['missions'] + config['instruments'] + config['archive']
+    rng = random.Random(1)
+    vocab = ['the', 'data', 'with', 'keck', '(hires)', 'nirc2/osiris', 'koa:', 'k2-18b',
+             'keck observatory archive', 'hiresolution', 'spectra', 'x-hires', 'mosfire']
+    text = kpub.clean_pdf_text(' '.join(rng.choice(vocab) for i in range(5000)))
+    counts = kpub.WordScanner(words).count(text)
+    assert {word: val['count'] for word, val in counts.items()} == legacy_word_counts(text, words)
+
+
+def test_scanner_offsets():
+    """Are overlapping words and regex metacharacters matched literally?"""
+    scanner = kpub.WordScanner(['Keck', 'Keck Observatory Archive', 'KOA', 'C++'])
+    text = ' keck observatory archive (koa) and c++ (not mkeck)'
+    assert scanner.scan(text) == {'Keck': [(0, 5)], 'Keck Observatory Archive': [(0, 25)],
+                                  'KOA': [(26, 30)], 'C++': [(35, 39)]}
+    assert scanner.count(text)['KOA']['snippets'] == [text]
+
+
+def test_open_pdf_uses_cache(tmp_path, config, monkeypatch):
+    config['cache_dir'] = str(tmp_path)
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    pdf = b'%PDF' + b'x' * 2000
+    db.documents.put_pdf('b1', pdf)
+    opened = []
+    monkeypatch.setattr(kpub, 'download_pdf', lambda bibcode, ads: pytest.fail("downloaded"))
+    monkeypatch.setattr(kpub.webbrowser, 'open', opened.append)
+    db.open_pdf('b1')
+    db.open_pdf('b1')
+    # The same copy in the cache directory is opened each time
+    assert len(opened) == 2 and opened[0] == opened[1]
+    path = opened[0][len('file://'):]
+    assert open(path, 'rb').read() == pdf
+    assert path.startswith(os.path.realpath(str(tmp_path / 'view')))
+    assert db.documents.stats()['view_count'] == 1
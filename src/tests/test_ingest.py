@@ -0,0 +1,62 @@
+"""Test the bulk ingest paths."""
+import pytest
+import requests
+
+import kpub
+
+
+def test_add_many_matches_add(tmp_path, config, articles):
+    """Does add_many produce the same rows as repeated calls to add?"""
+    one = kpub.PublicationDB(str(tmp_path / 'one.db'), config)
+    many = kpub.PublicationDB(str(tmp_path / 'many.db'), config)
+    for art in articles:
+        one.add(dict(art), mission='keck', science='exoplanets', instruments='HIRES', archive='1')
+    batch = [dict(art, mission='keck', science='exoplanets', instruments='HIRES', archive='1')
+             for art in articles]
+    assert many.add_many(iter(batch), batch_size=7) == len(articles)
+    for table in ('pubs', 'authors', 'keywords'):
+        q = f"SELECT * FROM {table} ORDER BY bibcode"
+        assert one.con.execute(q).fetchall() == many.con.execute(q).fetchall()
+
+
+def test_add_many_skips_duplicates(db, articles):
+    count = db.con.execute("SELECT COUNT(*) FROM pubs").fetchone()[0]
+    new = dict(articles[0], id='new-id', bibcode='2099ApJ...999..99X')
+    # Existing rows, and duplicates within the same batch, are skipped
+    assert db.add_many([dict(articles[0]), new, dict(new)]) == 1
+    assert db.con.execute("SELECT COUNT(*) FROM pubs").fetchone()[0] == count + 1
+
+
+def test_journal_mode(tmp_path, config):
+    config['db'] = {'journal_mode': 'WAL', 'batch_size': 3}
+    db = kpub.PublicationDB(str(tmp_path / 'wal.db'), config)
+    assert db.con.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert db.batch_size == 3
+
+
+def test_import_csv_batches_requests(tmp_path, config, articles, ads_stub):
+    """Are the csv bibcodes resolved with one ADS request per chunk?"""
+    csvfile = tmp_path / 'import.csv'
+    lines = [f"{art['bibcode']},keck,exoplanets,HIRES,1" for art in articles]
+    lines.insert(3, "")
+    lines.append("2099ApJ...000..00X,keck,,,0")  # Unknown to ADS
+    csvfile.write_text("\n".join(lines) + "\n")
+
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    assert db.import_csv(str(csvfile), chunk_size=50) == len(articles)
+    assert len(ads_stub.requests) == 3
+    row = db.con.execute("SELECT mission, science, instruments, archive FROM pubs "
+                         "WHERE bibcode = ?", [articles[10]['bibcode']]).fetchone()
+    assert row == ('keck', 'exoplanets', 'HIRES', '1')
+
+
+def test_import_csv_aborts_on_failed_chunk(tmp_path, config, articles, ads_stub, monkeypatch):
+    """Is a chunk that cannot be fetched an error rather than silently skipped?"""
+    csvfile = tmp_path / 'import.csv'
+    csvfile.write_text("\n".join(f"{art['bibcode']},keck,,,0" for art in articles) + "\n")
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    monkeypatch.setattr(db.ads, 'retries', 0)
+    ads_stub.errors = [(500, {})]
+    with pytest.raises(requests.HTTPError):
+        db.import_csv(str(csvfile), chunk_size=50)
+    assert db.con.execute("SELECT COUNT(*) FROM pubs").fetchone()[0] == 0
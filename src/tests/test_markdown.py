@@ -0,0 +1,85 @@
+"""Test the markdown publication lists."""
+import collections
+import json
+
+import jinja2
+import pytest
+
+import kpub
+
+# Template and rendering used before articles were streamed
+LEGACY_TEMPLATE = """Title: {{ title }}
+Save_as: {{ save_as }}
+
+[TOC]
+{% for month in articles %}
+
+{{ month }}
+{{ "-" * month|length }}
+{% for art in articles[month] %}
+{{loop.index}}. [{{ art['title'][0].upper() }}](http://adsabs.harvard.edu/abs/{{ art["bibcode"] }})  
+{{ ', '.join(art['author'][0:3]) }}{% if art['author']|length > 3 %}, et al.{% endif %}    
+{{ art["year"] }}, {% if art["pub"] == "ArXiv e-prints" -%}
+    pre-print
+{%- elif 'REFEREED' in art["property"] -%}
+    refereed
+{%- elif 'NOT REFEREED' in art["property"] -%}
+    not refereed
+{%- endif -%}
+{{ ' ([{bibcode}](http://adsabs.harvard.edu/abs/{bibcode}))'.format(**art) }}  
+{% endfor -%}
+{% endfor -%}"""
+
+
+def legacy_to_markdown(db, title="Publications", group_by_month=False, save_as=None, **kwargs):
+    articles = collections.OrderedDict({})
+    for row in db.query(**kwargs):
+        group = row[1] if group_by_month else row[0]
+        if group.endswith("-00"):
+            group = group[:-3] + "-01"
+        art = json.loads(row[2])
+        if art["property"] is None:
+            art["property"] = []
+        articles.setdefault(group, []).append(art)
+    return jinja2.Template(LEGACY_TEMPLATE).render(title=title, save_as=save_as, articles=articles)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'group_by_month': True}, {'mission': 'k2'},
+                                    {'science': 'exoplanets', 'group_by_month': True}])
+def test_markdown_matches_legacy(db, kwargs):
+    assert db.to_markdown(title="Test", save_as="x.html", **kwargs) == \
+        legacy_to_markdown(db, title="Test", save_as="x.html", **kwargs)
+
+
+def test_save_markdown(db, tmp_path):
+    fn = str(tmp_path / 'pubs.md')
+    db.save_markdown(fn, group_by_month=True, title="Test")
+    assert open(fn).read() == db.to_markdown(title="Test", group_by_month=True,
+                                             save_as=fn.replace("md", "html"))
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+def test_report_builder(db, tmp_path):
+    """Are all lists and the overview built from one scan identical to the separate calls?"""
+    builder = kpub.ReportBuilder(db)
+    expected = {}
+    for i, kwargs in enumerate([{}, {'group_by_month': True}, {'mission': 'keck'},
+                                {'science': 'astrophysics', 'group_by_month': True},
+                                {'mission': 'unrelated'}]):
+        fn = str(tmp_path / f'list{i}.md')
+        builder.add_markdown(fn, title=f"List {i}", **kwargs)
+        expected[fn] = db.to_markdown(title=f"List {i}", save_as=fn.replace("md", "html"), **kwargs)
+
+    statements = []
+    db.con.set_trace_callback(statements.append)
+    overview = builder.run(overview=True, top=20, min_papers=2)
+    db.con.set_trace_callback(None)
+    assert len([s for s in statements if 'FROM pubs' in s and 'bibcode IN' not in s]) == 1
+
+    for fn, markdown in expected.items():
+        assert open(fn).read() == markdown
+    assert overview['metrics'] == db.get_metrics()
+    assert [art['citation_count'] for art in overview['most_cited']] == \
+        [art['citation_count'] for art in db.get_most_cited(top=20)]
+    assert sorted(overview['most_active_first_authors']) == \
+        sorted(db.get_most_active_first_authors(min_papers=2))
@@ -0,0 +1,75 @@
+"""Test the SQL aggregations against the original row-by-row implementations."""
+import json
+
+import numpy as np
+
+
+def legacy_get_metrics(db, year=None):
+    """The original pure-Python implementation of `PublicationDB.get_metrics`."""
+    missions = db.config.get('missions', [])
+    sciences = db.config.get('sciences', [])
+    metrics = {'publication_count': 0, 'refereed_count': 0, 'citation_count': 0, 'phd_count': 0}
+    for mission in missions:
+        for key in ('count', 'refereed_count', 'citation_count', 'phd_count'):
+            metrics[f'{mission}_{key}'] = 0
+    for science in sciences:
+        metrics[f'{science}_count'] = 0
+    authors = {'all': []}
+    first_authors = {'all': []}
+    for mission in missions:
+        authors[mission] = []
+        first_authors[mission] = []
+    for article in db.query(year=year):
+        js = json.loads(article[2])
+        metrics["publication_count"] += 1
+        metrics[f"{js['mission']}_count"] += 1
+        if "PhDT" in js['bibcode']:
+            metrics["phd_count"] += 1
+            metrics[f"{js['mission']}_phd_count"] += 1
+        try:
+            metrics[f"{js['science']}_count"] += 1
+        except KeyError:
+            pass
+        authors['all'].extend(js['author_norm'])
+        first_authors['all'].append(js['first_author_norm'])
+        authors[js['mission']].extend(js['author_norm'])
+        first_authors[js['mission']].append(js['first_author_norm'])
+        try:
+            if "REFEREED" in js['property']:
+                metrics["refereed_count"] += 1
+                metrics[f"{js['mission']}_refereed_count"] += 1
+        except TypeError:
+            pass
+        try:
+            metrics["citation_count"] += js['citation_count']
+            metrics[f"{js['mission']}_citation_count"] += js['citation_count']
+        except (KeyError, TypeError):
+            pass
+    metrics["author_count"] = np.unique(authors['all']).size
+    metrics["first_author_count"] = np.unique(first_authors['all']).size
+    for mission in missions:
+        metrics[f"{mission}_author_count"] = np.unique(authors[mission]).size
+        metrics[f"{mission}_first_author_count"] = np.unique(first_authors[mission]).size
+    pubcount = metrics["publication_count"]
+    for mission in missions:
+        metrics[mission+"_fraction"] = metrics[mission+"_count"] / pubcount if pubcount > 0 else 0
+    for science in sciences:
+        metrics[science+"_fraction"] = metrics[science+"_count"] / pubcount if pubcount > 0 else 0
+    return metrics
+
+
+def test_metrics_match_legacy(db):
+    """Does the SQL implementation of get_metrics agree with the original one?"""
+    for year in (None, 2010, [2011, 2012], [2030]):
+        assert db.get_metrics(year=year) == legacy_get_metrics(db, year=year)
+
+
+def test_cumulative_author_series(db):
+    """Does the one-pass series agree with get_metrics over growing year lists?"""
+    series = db.get_cumulative_author_series(2009, 2017)
+    assert series['year'] == list(range(2009, 2018))
+    for idx, year in enumerate(series['year']):
+        metrics = db.get_metrics(year=list(range(2009, year + 1)))
+        assert series['publication_count'][idx] == metrics['publication_count']
+        assert series['author_count'][idx] == metrics['author_count']
+        assert series['first_author_count'][idx] == metrics['first_author_count']
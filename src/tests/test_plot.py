@@ -0,0 +1,78 @@
+"""Test the plot scheduler."""
+import glob
+import os
+import pickle
+
+import pytest
+
+import kpub
+import plot
+
+
+def test_plot_data(db):
+    data = plot.PlotData(db)
+    counts = data.fetch('get_publication_counts', year_begin=2000, year_end=2020)
+    assert data.fetch('get_publication_counts', 2000, 2020) is counts
+    assert len(data.results) == 1
+
+    # Workers look results up without a database connection
+    data = pickle.loads(pickle.dumps(data))
+    assert data.db is None
+    assert (data.get_publication_counts(year_begin=2000, year_end=2020)['counts'] == counts['counts']).all()
+    with pytest.raises(KeyError):
+        data.get_publication_counts(year_begin=2001, year_end=2020)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_plot_only(db, tmp_path, monkeypatch, jobs):
+    plotdir = tmp_path / 'plots'
+    plotdir.mkdir()
+    monkeypatch.setattr(kpub, 'PLOTDIR', str(plotdir))
+    db.config['plots']['formats'] = ['png', 'svg']
+    timings = db.plot(only=['piechart', 'publication-rate-k*', 'author-count'], jobs=jobs)
+    assert set(timings) == {'piechart', 'publication-rate-keck', 'publication-rate-k2', 'author-count'}
+    expected = [f"kpub-{name}.{fmt}" for name in timings for fmt in ('png', 'svg')]
+    assert sorted(glob.glob("kpub-*", root_dir=plotdir)) == sorted(expected)
+
+
+def test_plot_formats(db, tmp_path, monkeypatch):
+    """Is each figure drawn once for all formats?"""
+    saved = []
+    monkeypatch.setattr(plot.pl, 'savefig', lambda fn, dpi: saved.append(fn))
+    plot.plot_author_count(db, str(tmp_path / 'authors.pdf'), first_year=2000, formats=['pdf', 'png'])
+    assert saved == [str(tmp_path / 'authors.pdf'), str(tmp_path / 'authors.png')]
+
+
+def test_fingerprint(db, articles):
+    before = db.get_fingerprint()
+    science = db.get_fingerprint(science='exoplanets')
+    assert db.get_fingerprint() == before
+    with db.con:
+        db.con.execute("UPDATE pubs SET citation_count = citation_count + 1 "
+                       "WHERE science = 'astrophysics' AND mission != 'unrelated'")
+    assert db.get_fingerprint() != before
+    assert db.get_fingerprint(science='exoplanets') == science
+    db.delete_by_bibcode(articles[0]['bibcode'])
+    db.add(articles[0], mission='keck', science='exoplanets')
+    assert db.get_fingerprint(science='exoplanets') != science
+
+
+def test_plot_skips_unchanged(db, tmp_path, monkeypatch, articles):
+    plotdir = tmp_path / 'plots'
+    plotdir.mkdir()
+    monkeypatch.setattr(kpub, 'PLOTDIR', str(plotdir))
+    only = ['piechart', 'author-count']
+    assert set(db.plot(only=only)) == {'piechart', 'author-count'}
+    assert db.plot(only=only) == {}
+    assert set(db.plot(only=only, force=True)) == {'piechart', 'author-count'}
+
+    # Missing outputs and changed data are rebuilt
+    os.remove(plotdir / 'kpub-piechart.png')
+    assert set(db.plot(only=only)) == {'piechart'}
+    db.delete_by_bibcode(articles[1]['bibcode'])
+    assert set(db.plot(only=only)) == {'piechart', 'author-count'}
+
+    # A change to the plotting code or style rebuilds everything
+    monkeypatch.setattr(kpub, 'get_plot_code_hash', lambda: 'changed')
+    assert set(db.plot(only=only)) == {'piechart', 'author-count'}
+    assert db.plot(only=only) == {}
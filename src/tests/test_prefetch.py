@@ -0,0 +1,120 @@
+"""Test the background prefetching of article analyses during `kpub update`."""
+import threading
+import time
+
+import kpub
+from test_fulltext import fake_pdf
+
+
+def test_lookahead():
+    submitted = []
+    seen = []
+    for item in kpub.lookahead(range(6), 2, submitted.append):
+        seen.append((item, list(submitted)))
+    assert [item for item, _ in seen] == list(range(6))
+    # Items N+1..N+2 are submitted before item N is handed out
+    assert seen[0][1] == [0, 1, 2]
+    assert seen[3][1] == [0, 1, 2, 3, 4, 5]
+
+
+def test_prefetcher_reuses_result():
+    calls = []
+
+    def analyze(bibcode):
+        calls.append(bibcode)
+        return bibcode.upper()
+
+    prefetcher = kpub.Prefetcher(analyze, workers=2)
+    try:
+        for bibcode in ('a', 'b', 'a'):
+            prefetcher.submit(bibcode)
+        assert prefetcher.result('a') == 'A'
+        assert prefetcher.result('b') == 'B'
+        assert prefetcher.result('c') is None
+        assert sorted(calls) == ['a', 'b']
+    finally:
+        prefetcher.close()
+
+
+def test_prefetcher_close_cancels_pending():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def analyze(bibcode):
+        calls.append(bibcode)
+        started.set()
+        release.wait(5)
+        return bibcode
+
+    prefetcher = kpub.Prefetcher(analyze, workers=1)
+    for bibcode in ('a', 'b', 'c'):
+        prefetcher.submit(bibcode)
+    assert started.wait(5)
+    begin = time.monotonic()
+    prefetcher.close()
+    assert time.monotonic() - begin < 1
+    release.set()
+    prefetcher.threads[0].join(5)
+    assert calls == ['a']
+    assert not prefetcher.threads[0].is_alive()
+    # Nothing is submitted after closing
+    prefetcher.submit('d')
+    assert prefetcher.result('d') is None
+
+
+def test_prefetcher_failure_falls_back(tmp_path, config, monkeypatch):
+    config['cache_dir'] = str(tmp_path)
+    calls = fake_pdf(monkeypatch)
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+
+    def fail(bibcode):
+        raise RuntimeError('network down')
+
+    db.prefetcher = kpub.Prefetcher(fail, workers=1)
+    try:
+        db.prefetcher.submit('2020ApJ...001..01X')
+        assert db.analyze('2020ApJ...001..01X').method == 'pdf'
+    finally:
+        db.prefetcher.close()
+    assert calls == {'file': 1, 'text': 1}
+
+
+def test_update_prefetches(tmp_path, config, monkeypatch, ads_stub, articles):
+    """Are the upcoming articles analyzed in the background, each only once?"""
+    config['cache_dir'] = str(tmp_path)
+    config['ads_queries'] = config['ads_queries'][:1]
+    config['prefetch_depth'] = 2
+    calls = fake_pdf(monkeypatch)
+    monkeypatch.setattr(kpub, 'input_with_prefill', lambda prompt, text: text)
+    texts = []
+    get_pdf_text = kpub.get_pdf_text
+
+    def slow_text(outfile):
+        texts.append(threading.current_thread().name)
+        time.sleep(0.01)
+        return get_pdf_text(outfile)
+
+    monkeypatch.setattr(kpub, 'get_pdf_text', slow_text)
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    monkeypatch.setattr(db, 'push_reminder', lambda: None)
+    reviewed = []
+
+    def add_interactively(article, statusmsg='', highlights=None, pending=None):
+        reviewed.append(article['bibcode'])
+        db.prompt_instruments(article['bibcode'])
+        db.get_archive_acknowledgement(article['bibcode'])
+        if len(reviewed) == 5:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(db, 'add_interactively', add_interactively)
+    try:
+        db.update('2015')
+    except KeyboardInterrupt:
+        pass
+    assert len(reviewed) == 5
+    assert db.prefetcher is None
+    # Every reviewed article was scanned once, by a background worker, and at
+    # most the look-ahead depth beyond the last one was started
+    assert 5 <= calls['text'] <= 7
+    assert all(name.startswith('kpub-prefetch') for name in texts)
@@ -0,0 +1,63 @@
+"""Test the bulk refresh of citation and read counts (`kpub refresh-metrics`)."""
+import json
+
+import pytest
+import requests
+
+import kpub
+
+
+@pytest.fixture
+def updated(ads_stub):
+    """Serves new citation and read counts for every article."""
+    ads_stub.docs = [dict(doc, citation_count=(doc['citation_count'] or 0) + idx % 3,
+                          read_count=doc['read_count'] + 1)
+                     for idx, doc in enumerate(ads_stub.docs)]
+    return {doc['bibcode']: doc for doc in ads_stub.docs}
+
+
+def test_refresh_metrics(db, ads_stub, updated):
+    statements = []
+    db.con.set_trace_callback(statements.append)
+    try:
+        stats = db.refresh_metrics(chunk_size=25, workers=3)
+    finally:
+        db.con.set_trace_callback(None)
+    assert stats['articles'] == len(updated) and stats['requests'] == 5
+    assert stats['missing'] == 0 and stats['changed'] == len(updated)
+    assert sorted(b for chunk in ads_stub.bigqueries for b in chunk) == sorted(updated)
+    assert all(r[1]['fl'] == 'bibcode,citation_count,read_count' for r in ads_stub.requests)
+    # All rows are written in a single transaction
+    assert sum(stmt.startswith('COMMIT') for stmt in statements) == 1
+
+    for bibcode, citations, reads, metrics in db.con.execute(
+            "SELECT bibcode, citation_count, read_count, metrics FROM pubs"):
+        assert (citations, reads) == (updated[bibcode]['citation_count'], updated[bibcode]['read_count'])
+        article = json.loads(metrics)
+        assert (article['citation_count'], article['read_count']) == (citations, reads)
+    top = db.get_most_read(top=1)[0]
+    assert top['read_count'] == max(doc['read_count'] for doc in updated.values())
+
+    # Nothing is rewritten when the counts are current
+    assert db.refresh_metrics(chunk_size=50)['changed'] == 0
+
+
+def test_refresh_missing(db, ads_stub, updated):
+    gone = ads_stub.docs.pop(0)
+    before = db.con.execute("SELECT citation_count, read_count FROM pubs WHERE bibcode = ?",
+                            [gone['bibcode']]).fetchone()
+    stats = db.refresh_metrics(chunk_size=40)
+    assert stats['missing'] == 1
+    after = db.con.execute("SELECT citation_count, read_count FROM pubs WHERE bibcode = ?",
+                           [gone['bibcode']]).fetchone()
+    assert after == before
+
+
+def test_refresh_failure_changes_nothing(db, ads_stub, updated, monkeypatch):
+    monkeypatch.setattr(db.ads, 'backoff', 0.01)
+    monkeypatch.setattr(db.ads, 'retries', 1)
+    ads_stub.errors = [(500, {})] * 2
+    before = db.con.execute("SELECT bibcode, citation_count, read_count FROM pubs").fetchall()
+    with pytest.raises(requests.HTTPError):
+        db.refresh_metrics(chunk_size=200, workers=1)
+    assert db.con.execute("SELECT bibcode, citation_count, read_count FROM pubs").fetchall() == before
@@ -0,0 +1,139 @@
+"""Test the review queue of candidate articles filled by `kpub update`."""
+
+import pytest
+
+import kpub
+
+
+@pytest.fixture
+def review_db(tmp_path, config, monkeypatch, ads_stub):
+    config['cache_dir'] = str(tmp_path)
+    config['ads_queries'] = config['ads_queries'][:1]
+    config['prefetch_depth'] = 0
+    ads_stub.docs = ads_stub.docs[:6]
+    db = kpub.PublicationDB(str(tmp_path / 'kpub.db'), config)
+    monkeypatch.setattr(db, 'push_reminder', lambda: None)
+    return db
+
+
+def answer(db, monkeypatch, answers):
+    """Makes `add_interactively` classify articles with the given missions ('' skips)
+    and raise KeyboardInterrupt once they run out.  Returns the bibcodes shown."""
+    shown = []
+
+    def add_interactively(article, statusmsg='', highlights=None, pending=None):
+        if len(shown) == len(answers):
+            raise KeyboardInterrupt
+        mission = answers[len(shown)]
+        shown.append(article['bibcode'])
+        if mission:
+            article.update(mission=mission)
+            pending.append(article)
+        return mission
+
+    monkeypatch.setattr(db, 'add_interactively', add_interactively)
+    return shown
+
+
+def states(db):
+    return dict(db.con.execute("SELECT bibcode, state FROM review_queue"))
+
+
+def test_resume_offline(review_db, monkeypatch, ads_stub, articles):
+    shown = answer(review_db, monkeypatch, ['keck', '', 'unrelated'])
+    with pytest.raises(KeyboardInterrupt):
+        review_db.update('2015')
+    bibcodes = [art['bibcode'] for art in articles[:6]]
+    assert shown == bibcodes[:3]
+    assert review_db.article_exists(articles[0]) and review_db.article_exists(articles[2])
+    assert states(review_db) == dict(zip(bibcodes, ['classified', 'skipped', 'classified',
+                                                    'pending', 'pending', 'pending']))
+
+    # The rest is reviewed without querying ADS
+    requests = len(ads_stub.requests)
+    shown = answer(review_db, monkeypatch, ['k2', 'k2', ''])
+    review_db.review()
+    assert len(ads_stub.requests) == requests
+    assert shown == bibcodes[3:]
+    assert review_db.con.execute("SELECT COUNT(*) FROM review_queue WHERE article IS NOT NULL "
+                                 "AND state = 'classified'").fetchone()[0] == 0
+
+    # Skipped articles are only shown on request
+    shown = answer(review_db, monkeypatch, [])
+    review_db.review()
+    assert shown == []
+    shown = answer(review_db, monkeypatch, ['keck', 'keck'])
+    review_db.review(skipped=True)
+    assert shown == [bibcodes[1], bibcodes[5]]
+    assert set(states(review_db).values()) == {'classified'}
+
+
+def test_update_fetches_delta(review_db, monkeypatch, ads_stub, articles):
+    shown = answer(review_db, monkeypatch, [''] * 6)
+    review_db.update('2015')
+    assert len(shown) == 6
+    assert 'indexstamp' not in ads_stub.requests[-1][1]['q']
+
+    # Skipped articles are not queued or shown again
+    shown = answer(review_db, monkeypatch, [])
+    review_db.update('2015')
+    assert shown == []
+    newest = max(art['indexstamp'] for art in articles[:6])
+    assert f'indexstamp:[{newest} TO *]' in ads_stub.requests[-1][1]['q']
+    review_db.update('2015', full=True)
+    assert 'indexstamp' not in ads_stub.requests[-1][1]['q']
+    # Other months have their own watermark
+    review_db.update('2016')
+    assert 'indexstamp' not in ads_stub.requests[-1][1]['q']
+
+
+def test_update_without_month(review_db, monkeypatch, ads_stub, articles):
+    """Does the first update cover the current month and the next ones whatever ADS indexed since?"""
+    answer(review_db, monkeypatch, [''] * 6)
+    review_db.update()
+    q = ads_stub.requests[-1][1]['q']
+    assert 'pubdate:' in q and 'indexstamp' not in q
+    review_db.update()
+    q = ads_stub.requests[-1][1]['q']
+    newest = max(art['indexstamp'] for art in articles[:6])
+    assert 'pubdate:' not in q and f'indexstamp:[{newest} TO *]' in q
+
+
+def test_harvest_checks_existing_per_page(review_db, articles):
+    for art in articles[:3]:
+        review_db.add(dict(art), mission='keck')
+    statements = []
+    review_db.con.set_trace_callback(statements.append)
+    try:
+        queued = review_db.harvest(review_db.config['ads_queries'][0], '2015')
+    finally:
+        review_db.con.set_trace_callback(None)
+    assert queued == 3
+    lookups = [stmt for stmt in statements if 'FROM pubs' in stmt]
+    assert len(lookups) == 1 and 'bibcode IN' in lookups[0]
+
+
+def test_migrate_harvest_watermark(tmp_path, config):
+    fn = str(tmp_path / 'v5.db')
+    db = kpub.PublicationDB(fn, config)
+    db.con.execute("DROP TABLE harvests")
+    db.con.execute("CREATE TABLE harvests(query, pubdate, harvested, PRIMARY KEY (query, pubdate))")
+    db.con.execute("INSERT INTO harvests VALUES ('q', '2015', '2024-05-01')")
+    db.con.execute("PRAGMA user_version = 5")
+    db.con.commit()
+    db.con.close()
+    db = kpub.PublicationDB(fn, config)
+    assert db.con.execute("SELECT indexstamp FROM harvests").fetchone()[0] == '2024-05-01T00:00:00.000Z'
+
+
+def test_migrate_adds_queue(tmp_path, config):
+    fn = str(tmp_path / 'v4.db')
+    db = kpub.PublicationDB(fn, config)
+    db.con.execute("DROP TABLE review_queue")
+    db.con.execute("DROP TABLE harvests")
+    db.con.execute("PRAGMA user_version = 4")
+    db.con.commit()
+    db.con.close()
+    db = kpub.PublicationDB(fn, config)
+    assert db.con.execute("SELECT COUNT(*) FROM review_queue").fetchone()[0] == 0
+    assert db.con.execute("PRAGMA user_version").fetchone()[0] == kpub.SCHEMA_VERSION
@@ -0,0 +1,110 @@
+"""Test the normalized database schema and the in-place migration."""
+import json
+import sqlite3
+
+import kpub
+from conftest import make_article
+
+
+def test_add_populates_columns(db, articles):
+    """Are the hot columns and child tables filled in by `add`?"""
+    art = articles[0]
+    row = db.con.execute("SELECT citation_count, read_count, refereed, first_author_norm, pub, doctype "
+                         "FROM pubs WHERE bibcode = ?", [art['bibcode']]).fetchone()
+    assert row == (art['citation_count'], art['read_count'], int('REFEREED' in art['property']),
+                   art['first_author_norm'], art['pub'], art['doctype'])
+    authors = db.con.execute("SELECT author_norm, aff FROM authors WHERE bibcode = ? "
+                             "ORDER BY position", [art['bibcode']]).fetchall()
+    assert [a[0] for a in authors] == art['author_norm']
+    assert [a[1] for a in authors] == art['aff']
+    keywords = db.con.execute("SELECT keyword FROM keywords WHERE bibcode = ?", [art['bibcode']]).fetchall()
+    assert [k[0] for k in keywords] == art['keyword']
+
+
+def test_delete_removes_children(db, articles):
+    bibcode = articles[0]['bibcode']
+    db.delete_by_bibcode(bibcode)
+    for table in ('pubs', 'authors', 'keywords'):
+        count = db.con.execute(f"SELECT COUNT(*) FROM {table} WHERE bibcode = ?", [bibcode]).fetchone()[0]
+        assert count == 0
+
+
+def test_migrate_legacy_db(tmp_path, config):
+    """Is a database with the original single-table schema upgraded in place?"""
+    fn = str(tmp_path / 'legacy.db')
+    con = sqlite3.connect(fn)
+    con.execute("CREATE TABLE pubs(id UNIQUE, bibcode UNIQUE, year, month, date, "
+                "mission, science, instruments, archive, metrics)")
+    art = make_article(1, 2015, citation_count=12, read_count=34)
+    con.execute("INSERT INTO pubs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [art['id'], art['bibcode'], art['year'], '2015-01', art['pubdate'],
+                 'keck', '', 'HIRES', '0', json.dumps(art)])
+    con.commit()
+    con.close()
+
+    db = kpub.PublicationDB(fn, config)
+    assert db.con.execute("PRAGMA user_version").fetchone()[0] == kpub.SCHEMA_VERSION
+    row = db.con.execute("SELECT citation_count, read_count, refereed FROM pubs").fetchone()
+    assert row == (12, 34, 1)
+    count = db.con.execute("SELECT COUNT(*) FROM authors WHERE bibcode = ?", [art['bibcode']]).fetchone()[0]
+    assert count == len(art['author'])
+    # The affiliation types were classified during the migration, not again on first use
+    assert not db.update_aff_types()
+    # The archival json blob is left untouched
+    assert db.get_metadata(art['bibcode'])['bibcode'] == art['bibcode']
+
+
+def test_most_cited_uses_columns(db):
+    most_cited = db.get_most_cited(top=5)
+    counts = [art['citation_count'] or 0 for art in most_cited]
+    assert counts == sorted(counts, reverse=True)
+    every = [art['citation_count'] or 0 for art in db.get_all()]
+    assert counts[0] == max(every)
+
+
+def full_table_scans(db, func):
+    """Runs `func` and returns the query plan steps that scan a table without an index."""
+    statements = []
+    db.con.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        db.con.set_trace_callback(None)
+    scans = []
+    for stmt in statements:
+        if not stmt.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        for row in db.con.execute("EXPLAIN QUERY PLAN " + stmt):
+            detail = row[3]
+            if detail.startswith('SCAN') and 'INDEX' not in detail and 'subquery' not in detail \
+                    and 'pairs' not in detail and 'CONSTANT ROW' not in detail:
+                scans.append((stmt, detail))
+    return scans
+
+
+def test_queries_use_indexes(db):
+    """Do the query and aggregate methods avoid full scans of the pubs table?"""
+    calls = [lambda: db.query(),
+             lambda: db.query(mission='keck'),
+             lambda: db.query(science='exoplanets', year=[2010, 2011]),
+             lambda: db.get_metrics(),
+             lambda: db.get_metrics(year=2012),
+             lambda: db.get_annual_publication_count(2008, 2016),
+             lambda: db.get_annual_publication_count_cumulative(2008, 2016),
+             lambda: db.get_affiliation_counts(2008, 2016, 'keck'),
+             lambda: db.get_most_cited(mission='keck')]
+    for call in calls:
+        assert full_table_scans(db, call) == []
+
+
+def test_migrate_creates_indexes(tmp_path, config):
+    fn = str(tmp_path / 'v1.db')
+    db = kpub.PublicationDB(fn, config)
+    for name in ('pubs_date', 'pubs_mission_date', 'pubs_science_date', 'pubs_archive'):
+        db.con.execute(f"DROP INDEX {name}")
+    db.con.execute("PRAGMA user_version = 1")
+    db.con.commit()
+    db.con.close()
+    db = kpub.PublicationDB(fn, config)
+    names = [row[0] for row in db.con.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+    assert 'pubs_mission_date' in names and 'pubs_archive' in names